@@ -0,0 +1,72 @@
+import time
+import click as ck
+import numpy as np
+import pandas as pd
+from src.embedding_index import load_graph_index
+from src.feature_store import FeatureStore
+from src.similarity import DiamondSearch, first_hits
+from src.logging import MyLog
+myLogging = MyLog().logger
+
+
+@ck.command()
+@ck.option(
+    '--data-root', '-dr', default='data',
+    help='Data folder')
+@ck.option('--in-db', '-id', help='Input Diamond DB file', default='initData/swissprot_exp.dmnd')
+@ck.option(
+    '--ont', '-o', default='mf', type=ck.Choice(['mf', 'bp', 'cc']),
+    help='Sub-ontology whose graph is used')
+@ck.option('--n-queries', '-n', default=1000, help='Number of test proteins used as queries')
+@ck.option('--top-k', '-k', default=10, help='Neighbours returned by the embedding index')
+@ck.option('--n-probe', '-np', default=8, help='Index clusters scanned per query')
+def main(data_root, in_db, ont, n_queries, top_k, n_probe):
+    """
+    Compares the ESM embedding index with Diamond for finding the similar
+    training protein of test proteins. Reports how often the index top hit
+    agrees with the Diamond top hit, how often the Diamond top hit is among
+    the index top-k, the recall of the index against exact search and the
+    index query time.
+    """
+    train_df = pd.read_pickle(f'{data_root}/{ont}/train_data.pkl')
+    valid_df = pd.read_pickle(f'{data_root}/{ont}/valid_data.pkl')
+    test_df = pd.read_pickle(f'{data_root}/{ont}/test_data.pkl')
+    proteins = list(train_df['proteins']) + list(valid_df['proteins']) + list(test_df['proteins'])
+    n_anchors = len(train_df) + len(valid_df)
+    anchors = set(proteins[:n_anchors])
+    queries = test_df.sample(min(n_queries, len(test_df)), random_state=0)
+
+    index = load_graph_index(data_root, ont, proteins)
+    store = FeatureStore(f'{data_root}/features')
+    query_emb = np.asarray(store.gather('esm', queries['proteins'].values), dtype=np.float32)
+    anchor_emb = np.asarray(store.gather('esm', proteins[:n_anchors]), dtype=np.float32)
+    anchor_emb /= np.maximum(np.linalg.norm(anchor_emb, axis=1, keepdims=True), 1e-12)
+
+    hits = DiamondSearch(in_db, cache_dir=f'{data_root}/similarity').search(
+        list(queries['proteins']), list(queries['sequences']))
+    diamond_top = first_hits(hits[hits['query'] != hits['target']], anchors)
+
+    agree = in_top_k = exact_agree = n_diamond = 0
+    times = []
+    for p_id, emb in zip(queries['proteins'], query_emb):
+        start = time.perf_counter()
+        # Test nodes are in the graph too, ask for extra neighbours and keep anchors
+        nodes, _ = index.search(emb, k=top_k + len(test_df), n_probe=n_probe)
+        times.append(time.perf_counter() - start)
+        nodes = [proteins[n] for n in nodes if n < n_anchors][:top_k]
+        exact = proteins[int(np.argmax(anchor_emb @ emb))]
+        exact_agree += int(len(nodes) > 0 and nodes[0] == exact)
+        if p_id in diamond_top:
+            n_diamond += 1
+            agree += int(len(nodes) > 0 and nodes[0] == diamond_top[p_id])
+            in_top_k += int(diamond_top[p_id] in nodes)
+    n = len(queries)
+    myLogging.info(f'{ont}: {n} queries, {n_diamond} with a Diamond hit in the graph')
+    myLogging.info(f'Top-1 agreement with Diamond: {agree / max(n_diamond, 1):0.3f}')
+    myLogging.info(f'Diamond top hit in index top-{top_k}: {in_top_k / max(n_diamond, 1):0.3f}')
+    myLogging.info(f'Index top-1 recall against exact search: {exact_agree / max(n, 1):0.3f}')
+    myLogging.info(f'Index query time: {1000 * np.mean(times):0.2f} ms (p95 {1000 * np.percentile(times, 95):0.2f} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import click as ck
+import os
+import pandas as pd
+from src.checkpoint import load_checkpoint
+from src.export import export_model, CHECKPOINT_KEYS
+from src.features import MODEL_FEATURES
+from src.logging import MyLog
+myLogging = MyLog().logger
+
+
+@ck.command()
+@ck.option(
+    '--data-root', '-dr', default='data',
+    help='Data folder')
+@ck.option(
+    '--model-dir', '-md', default='models',
+    help='Models folder')
+@ck.option(
+    '--model-name', '-m', type=ck.Choice(list(MODEL_FEATURES)),
+    default='LifeLongGo_esm_pdb2',
+    help='Prediction model name')
+@ck.option(
+    '--sub-ontologies', '-so', default='bp_mf_cc',
+    help='Training order of the checkpoints')
+@ck.option(
+    '--test-data-name', '-td', default='test', type=ck.Choice(['test', 'cafa3']),
+    help='Test data set name')
+def main(data_root, model_dir, model_name, sub_ontologies, test_data_name):
+    """
+    Exports the checkpoints of a training order as TorchScript inference
+    artifacts which only need PyTorch (see src.export.ExportedPredictor)
+    """
+    for ont in sub_ontologies.split('_'):
+        model_file = f'{model_dir}/{ont}_{model_name}_{sub_ontologies}_{test_data_name}.th'
+        if not os.path.exists(model_file):
+            myLogging.info(f'{model_file} not found, skipping {ont}')
+            continue
+        out_file = f'{os.path.splitext(model_file)[0]}.pt'
+        terms = pd.read_pickle(f'{data_root}/{ont}/terms.pkl')['gos'].values.flatten()
+        export_model(load_checkpoint(model_file, keys=CHECKPOINT_KEYS), out_file, {
+            'ont': ont,
+            'model_name': model_name,
+            'features_column': '_'.join(MODEL_FEATURES[model_name]),
+            'terms': [str(t) for t in terms],
+        })
+        myLogging.info(f'Exported {model_file} - {out_file}')
+
+
+if __name__ == '__main__':
+    main()
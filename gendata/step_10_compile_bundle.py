@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, os.pardir))
+sys.path.append(project_root)
+
+import click as ck
+from src.bundle import compile_bundle
+from src.features import MODEL_FEATURES, features_dim
+from src.logging import MyLog
+myLogging = MyLog().logger
+
+
+@ck.command()
+@ck.option(
+    '--data-root', '-dr', default='../data',
+    help='Data folder')
+@ck.option(
+    '--model-name', '-m', type=ck.Choice(list(MODEL_FEATURES)),
+    default='LifeLongGo_esm_pdb2',
+    help='Model whose input features are compiled')
+@ck.option(
+    '--test-data-name', '-td', default='test', type=ck.Choice(['test', 'cafa3']),
+    help='Test data set name')
+def main(data_root, model_name, test_data_name):
+    """
+    Compiles the training bundles (graph, features, labels and node splits)
+    used by train_llg.py, so that training runs do not rebuild them
+    """
+    features = MODEL_FEATURES[model_name]
+    features_column = '_'.join(features)
+    features_length = features_dim(features)
+    for ont in ['mf', 'bp', 'cc']:
+        bundle_file = compile_bundle(
+            data_root, ont, features_length, features_column,
+            f'{test_data_name}_data.pkl', f'ppi_{test_data_name}.bin')
+        myLogging.info(f'{ont}: {bundle_file}')
+
+
+if __name__ == '__main__':
+    main()
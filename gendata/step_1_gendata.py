@@ -57,16 +57,8 @@ def main(swissprot_file, out_file, device):
     df = df.reset_index()
     df['exp_annotations'] = annotations
 
-    prop_annotations = []
-    for i, row in df.iterrows():
-        # Propagate annotations
-        annot_set = set()
-        annots = row['exp_annotations']
-        for go_id in annots:
-            annot_set |= go.get_ancestors(go_id)
-        annots = list(annot_set)
-        prop_annotations.append(annots)
-    df['prop_annotations'] = prop_annotations
+    # Propagate annotations
+    df['prop_annotations'] = go.propagate_annotations(df['exp_annotations'].values)
 
     cafa_target = []
     for i, row in enumerate(df.itertuples()):
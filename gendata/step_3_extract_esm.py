@@ -7,14 +7,15 @@ sys.path.append(project_root)
 
 # Extract ESM2 embeddings
 from src.extract_esm import extract_esm
+from src.feature_store import FeatureStore
 from src.logging import MyLog
 import pandas as pd
 myLogging = MyLog().logger
 myLogging.info('Extracting ESM2 embeddings')
 prots, esm2_data = extract_esm('../initdata/uniprot_sprot_2024_05.dat.fa', device='cuda:0')
-esm2_data = esm2_data.cpu().tolist()
 myLogging.info(f"Length of esm2_data: {len(esm2_data)}")
+# Embeddings are kept as a memory-mapped float32 matrix instead of a list column
+FeatureStore('../data/features').write('esm', prots, esm2_data)
 df = pd.read_pickle('../initdata/swissprot_step_1.pkl')
-df['esm'] = esm2_data
 df.to_pickle('../initdata/swissprot_step3_esm.pkl')
 myLogging.info("ESM2 File saved successfully.")
\ No newline at end of file
@@ -20,6 +20,7 @@ import tqdm, os
 from torch_geometric.loader import DataLoader
 import pickle
 from gendata.step_4_pdbPraseToJson import parse_pdb
+from src.feature_store import FeatureStore
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
 def get_pdb_feature(in_pdb,cpd_model_dir):
@@ -69,13 +70,16 @@ def get_pdb_feature(in_pdb,cpd_model_dir):
 @ck.option(
     '--out-file', '-o', default='../initData/swissprot_step5_esm_pdb2.pkl',
     help='Result file with a list of proteins, sequences and pdb2')
+@ck.option(
+    '--features-dir', '-fd', default='../data/features',
+    help='Feature store directory for the pdb2 features')
 @ck.option(
     '--num-workers', '-nm', type=int, default=4,
     help='number of threads for loading data, default=4')
 @ck.option(
     '--max-nodes', '-mn', type=int, default=3000,
     help='max number of nodes per batch, default=3000')
-def main(in_file, pdb_json, out_file, models_dir, num_workers, max_nodes):
+def main(in_file, pdb_json, out_file, models_dir, features_dir, num_workers, max_nodes):
     node_dim = (100, 16)
     edge_dim = (32, 1)
     if not os.path.exists(models_dir): os.makedirs(models_dir)
@@ -94,7 +98,7 @@ def main(in_file, pdb_json, out_file, models_dir, num_workers, max_nodes):
     data2 = loop(model, train_loader, optimizer=optimizer)
     path = f"{models_dir}/{model_id}.pt"
     torch.save(model.state_dict(), path)
-    data['pdb2'] = data2
+    FeatureStore(features_dir).write('pdb2', data['proteins'].values, data2)
     # pdb2_feature = pd.DataFrame(data2)
     # pdb2_feature.to_pickle('pdb2_feature.pkl')
     myLogging.info(f"PDB2 Shape: ({len(data2)}, {len(data2[1])})")
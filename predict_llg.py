@@ -1,6 +1,5 @@
 import sys
 import os
-import csv
 import numpy as np
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.abspath(os.path.join(current_dir, os.pardir))
@@ -8,9 +7,16 @@ sys.path.append(project_root)
 import click as ck
 import json
 import pandas as pd
-from src.utils import Ontology, propagate_annots, get_color
+from src.utils import Ontology, get_color
+from src.propagation import AnnotationPropagator
 from src.model_use import SharedCoreDeepGATModel,TaskSpecificModel
-from src.data import load_ppi_data,load_normal_forms,run_diamond_blastp_and_get_first_result
+from src.data import load_normal_forms
+from src.similarity import DiamondSearch, first_hits
+from src.embedding_index import load_graph_index
+from src.bundle import load_bundle
+from src.checkpoint import load_model
+from src.multi_head import build_multi_head, predict_nodes
+from src.features import MODEL_FEATURES, features_dim
 from src.extract_esm import extract_esm
 import torch as th
 from gendata.step_5_run_pdb2 import get_pdb_feature
@@ -18,10 +24,89 @@ import gzip
 import os
 import dgl
 import requests
-from multiprocessing import Pool
-from functools import partial
 from src.logging import MyLog
 myLogging = MyLog().logger
+
+
+def find_anchor(data_root, ont, anchor, hits, esm_feature, in_file):
+    """
+    Finds the graph node of the protein most similar to the query
+    Returns:
+       test_node (int): Node id or None if no similar protein is in the graph
+    """
+    train_df = pd.read_pickle(f'{data_root}/{ont}/train_data.pkl')
+    valid_df = pd.read_pickle(f'{data_root}/{ont}/valid_data.pkl')
+    test_df = pd.read_pickle(f'{data_root}/{ont}/test_data.pkl')
+    graph_proteins = list(train_df['proteins']) + list(valid_df['proteins']) + list(test_df['proteins'])
+    if anchor == 'esm':
+        index = load_graph_index(data_root, ont, graph_proteins)
+        nodes, _ = index.search(esm_feature, k=1)
+        test_node = int(nodes[0])
+        target_protein = graph_proteins[test_node]
+    else:
+        prot_idx = {}
+        for i, p_id in enumerate(graph_proteins):
+            prot_idx[p_id] = i
+        targets = first_hits(hits, prot_idx)
+        if not targets:
+            myLogging.error(f"No similar protein of {in_file} found in the {ont} graph.")
+            return None
+        target_protein = next(iter(targets.values()))
+        test_node = prot_idx[target_protein]
+    myLogging.info(f'{ont} Similar Protein:{target_protein}, Node: {test_node}')
+    return test_node
+
+
+def anchored_graph(data_root, ont, features_length, features_column, test_node, feature, device):
+    """Loads the PPI graph of an ontology with the query features placed on the anchor node"""
+    _, terms_dict, graph, _, _, _, _, _, _ = load_bundle(
+        data_root, ont, features_length, features_column, 'test_data.pkl', 'ppi_test.bin')
+    graph.ndata['feat'][test_node] = th.tensor(feature)
+    return terms_dict, graph.to(device)
+
+
+def write_predictions(fn, ont, preds, terms_dict, go, threshold, out_file, image_file):
+    """Writes the propagated predictions above the threshold and their AmiGO visualization"""
+    terms = list(terms_dict)
+    term_data = {}
+    preds = AnnotationPropagator(go, terms_dict).propagate(preds)
+    with open(out_file, 'wt') as f:
+        above_threshold = np.argwhere(preds[0] >= threshold).flatten()
+        above_threshold = above_threshold[np.argsort(-preds[0][above_threshold])]
+        myLogging.info(f'Above threshold:{threshold},Lenth:{len(above_threshold)}')
+        for j in above_threshold:
+            name = go.get_term(terms[j])['name']
+            score = preds[0][j]
+            color = get_color(score)
+            f.write(f'{fn}\t{ont}\t{terms[j]}\t{name}\t{score:0.3f}\n')
+            # 将每个GO术语及其颜色添加到term_data字典中
+            term_data[terms[j]] = {'font': color}
+    myLogging.info(f'{fn} - {ont} Predicted Saved - {out_file}')
+
+    term_data_json = json.dumps(term_data, indent=4)  # 美化输出
+    # 定义请求的URL
+    url = "https://amigo.geneontology.org/visualize"
+    # 定义请求的参数
+    params = {
+        "mode": "amigo",
+        "format": "png",
+        "term_data_type": "json",
+        "inline": "false",
+        "term_data": term_data_json}
+
+    # 发送GET请求
+    response = requests.get(url, params=params)
+
+    # 检查请求是否成功
+    if response.status_code == 200:
+        # 保存图片
+        with open(image_file, 'wb') as f:
+            f.write(response.content)
+        myLogging.info("Image saved successfully.")
+    else:
+        myLogging.info("Failed to retrieve image. Status code:", response.status_code)
+
+
 @ck.command()
 @ck.option('--in-file', '-if', help='Input FASTA file', default='example/Q5H9Q6.fasta', required=True)
 @ck.option('--in-db', '-id', help='Input Diamond DB file', default='initData/swissprot_exp.dmnd', required=True)
@@ -40,10 +125,19 @@ myLogging = MyLog().logger
     help='Models folder')
 @ck.option('--threshold', '-t', default=0.1, help='Prediction threshold')
 @ck.option('--batch-size', '-bs', default=8, help='Batch size for prediction model')
+@ck.option(
+    '--anchor', '-a', default='diamond', type=ck.Choice(['diamond', 'esm']),
+    help='Find the similar graph protein with Diamond or with the ESM embedding index')
+@ck.option(
+    '--multi-head', '-mh', is_flag=True,
+    help='Predict all ontologies with one backbone pass using the checkpoints of one training order')
+@ck.option(
+    '--order', '-o', default='mf_cc_bp',
+    help='Training order whose checkpoints are merged for --multi-head')
 @ck.option(
     '--device', '-d', default='cpu',
     help='Device')
-def case_study(in_file, in_db,in_pdb, data_root,result_root,cpd_model, model_dir, threshold, batch_size, device):
+def case_study(in_file, in_db,in_pdb, data_root,result_root,cpd_model, model_dir, threshold, batch_size, anchor, multi_head, order, device):
     """
     Case study for testing a single data sample.
     """
@@ -60,17 +154,41 @@ def case_study(in_file, in_db,in_pdb, data_root,result_root,cpd_model, model_dir
 
 
     # Define the necessary paths and features based on model_name
-    features_length = 2560 + 20
-    features_column = 'esm_pdb2'
+    features = MODEL_FEATURES['LifeLongGo_esm_pdb2']
+    features_column = '_'.join(features)
+    features_length = features_dim(features)
     ent_models = {
         'mf': 'bp_cc_mf',
         'cc': 'bp_mf_cc',
         'bp': 'cc_mf_bp'
     }
-    shared_model = SharedCoreDeepGATModel(shared_input_length=2580, shared_hidden_dim=2560,
+    hits = None
+    if anchor == 'diamond':
+        hits = DiamondSearch(in_db, cache_dir=f'{data_root}/similarity').search_fasta(in_file)
+    go_file = f'{data_root}/go.obo'
+    go = Ontology(go_file, with_rels=True)
+
+    if multi_head:
+        multi_head_file = f'{model_dir}/LifeLongGo_esm_pdb2_{order}_multihead.th'
+        model_files = {ont: f'{model_dir}/{ont}_LifeLongGo_esm_pdb2_{order}_test.th' for ont in order.split('_')}
+        model = build_multi_head(model_files, features_length, multi_head_file, device)
+        # The backbone runs once on the graph of the ontology it was last trained on
+        test_node = find_anchor(data_root, model.backbone, anchor, hits, esm_feature[0], in_file)
+        if test_node is None:
+            return
+        _, graph = anchored_graph(
+            data_root, model.backbone, features_length, features_column, test_node, combined_feature, device)
+        multi_preds = predict_nodes(model, graph, [test_node], batch_size)
+        for ont in model.onts:
+            terms_df = pd.read_pickle(f'{data_root}/{ont}/terms.pkl')
+            terms_dict = {v: i for i, v in enumerate(terms_df['gos'].values.flatten())}
+            write_predictions(
+                fn, ont, multi_preds[ont], terms_dict, go, threshold,
+                f'{result_root}/preds_{ont}_{order}.txt', f'{result_root}/{ont}_go_visualization.png')
+        return
+
+    shared_model = SharedCoreDeepGATModel(shared_input_length=features_length, shared_hidden_dim=2560,
                                           shared_embed_dim=2560).to(device)
-    output_diamond_file = f"{in_file.split('.')[0]}_result.tsv"
-    run_diamond_blastp_and_get_first_result(in_db, in_file, output_diamond_file)
     for ont in ['mf', 'cc', 'bp']:
         myLogging.info(f'Predicting {ont} classes')
         # Load the trained model
@@ -86,64 +204,16 @@ def case_study(in_file, in_db,in_pdb, data_root,result_root,cpd_model, model_dir
         n_rels = len(relations)
         n_zeros = len(zero_classes)
 
-        net = TaskSpecificModel(shared_model, 2580, n_terms, n_zeros, n_rels, device).to(device)
-
+        net = TaskSpecificModel(shared_model, features_length, n_terms, n_zeros, n_rels, device).to(device)
 
         # Get the the similary graph
-
-        ppi_graph_file = f'ppi_test.bin'
-        test_data_file = f'test_data.pkl'
-
-        # Here we assume that test_nids are the indices of the test data nodes.
-        train_df = pd.read_pickle(f'data/{ont}/train_data.pkl')
-        valid_df = pd.read_pickle(f'data/{ont}/valid_data.pkl')
-        test_df = pd.read_pickle(f'data/{ont}/test_data.pkl')
-
-        # Get the proteins and their indices
-        proteins = train_df['proteins']
-        prot_idx = {v: k for k, v in enumerate(proteins)}
-        train_n = len(proteins)
-
-        # Create a mapping for validation and test data as well
-        valid_proteins = valid_df['proteins']
-        for i, p_id in enumerate(valid_proteins):
-            prot_idx[p_id] = train_n + i
-        valid_n = len(valid_proteins)
-
-        test_proteins = test_df['proteins']
-        for i, p_id in enumerate(test_proteins):
-            prot_idx[p_id] = train_n + valid_n + i
-        try:
-            with open(output_diamond_file, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f, delimiter='\t')
-                for row in reader:
-                    if row:  # 如果该行不为空，视为符合预期
-                        first_result = row
-                        myLogging.info(first_result)
-                        target_protein = first_result[1]
-                        # myLogging.info(target_protein)
-                        # Check if the protein_name is in the prot_idx dictionary
-                        if target_protein not in prot_idx:
-                            myLogging.error(f"Protein {target_protein} not found in the graph.")
-                            continue
-                        # Get the node id for the given protein_name
-                        test_node = prot_idx[target_protein]
-                        myLogging.info(f'{ont} Similar Protein:{target_protein}, Node: {test_node}')
-                        break
-                    else:
-                        continue
-        except FileNotFoundError:
-            myLogging.error(f"File {output_diamond_file} not found.")
-        except IOError as e:
-            myLogging.error(f"Error reading file: {e}")
-
+        test_node = find_anchor(data_root, ont, anchor, hits, esm_feature[0], in_file)
+        if test_node is None:
+            continue
 
         # Loading PPI data
-        mfs_dict, terms_dict, graph, train_nids, valid_nids, test_nids, data, labels, test_df = load_ppi_data(
-            data_root, ont, features_length, features_column, test_data_file, ppi_graph_file)
-        graph.ndata['feat'][test_node] = th.tensor(combined_feature)
-        graph = graph.to(device)
-        # myLogging.info(graph)
+        terms_dict, graph = anchored_graph(
+            data_root, ont, features_length, features_column, test_node, combined_feature, device)
         sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
         test_dataloader = dgl.dataloading.DataLoader(
             graph, [test_node], sampler,
@@ -154,58 +224,17 @@ def case_study(in_file, in_db,in_pdb, data_root,result_root,cpd_model, model_dir
         )
 
         # Model prediction
-        net.load_state_dict(th.load(model_file, map_location=device))
+        load_model(net, model_file, device)
         net.eval()
         with th.no_grad():
             for input_nodes, output_nodes, blocks in test_dataloader:
                 logits = net(input_nodes, output_nodes, blocks)
                 predicted = logits.detach().cpu().numpy()
-                # You can return or myLogging.info predictions here
-                # myLogging.info(f"Prediction for test node {test_node}: {predicted}")
 
         preds = np.array(predicted)
-        out_file = f'{result_root}/preds_{ont}_{ent_models[ont]}.txt'
-        go_file = f'{data_root}/go.obo'
-        go = Ontology(go_file, with_rels=True)
-        term_data = {}
-        with Pool(2) as p:
-            preds = p.map(partial(propagate_annots, go=go, terms_dict=terms_dict), preds)
-        with open(out_file, 'wt') as f:
-            above_threshold = np.argwhere(preds[0] >= threshold).flatten()
-            above_threshold = above_threshold[np.argsort(-preds[0][above_threshold])]
-            myLogging.info(f'Above threshold:{threshold},Lenth:{len(above_threshold)}')
-            for j in above_threshold:
-                name = go.get_term(terms[j])['name']
-                score = preds[0][j]
-                color = get_color(score)
-                f.write(f'{fn}\t{ont}\t{terms[j]}\t{name}\t{score:0.3f}\n')
-                # 将每个GO术语及其颜色添加到term_data字典中
-                term_data[terms[j]] = {'font': color}
-        myLogging.info(f'{fn} - {ont} Predicted Saved - {out_file}')
-
-        term_data_json = json.dumps(term_data, indent=4)  # 美化输出
-        # myLogging.info(term_data_json)
-        # 定义请求的URL
-        url = "https://amigo.geneontology.org/visualize"
-        # 定义请求的参数
-        params = {
-            "mode": "amigo",
-            "format": "png",
-            "term_data_type": "json",
-            "inline": "false",
-            "term_data": term_data_json}
-
-        # 发送GET请求
-        response = requests.get(url, params=params)
-
-        # 检查请求是否成功
-        if response.status_code == 200:
-            # 保存图片
-            with open(f'{result_root}/{ont}_go_visualization.png', 'wb') as f:
-                f.write(response.content)
-            myLogging.info("Image saved successfully.")
-        else:
-            myLogging.info("Failed to retrieve image. Status code:", response.status_code)
+        write_predictions(
+            fn, ont, preds, terms_dict, go, threshold,
+            f'{result_root}/preds_{ont}_{ent_models[ont]}.txt', f'{result_root}/{ont}_go_visualization.png')
 
 if __name__ == '__main__':
     case_study()
@@ -0,0 +1,81 @@
+import click as ck
+import time
+from src.utils import Ontology
+from src.propagation import AnnotationPropagator
+from src.model_use import SharedCoreDeepGATModel, TaskSpecificModel
+from src.data import load_normal_forms
+from src.bundle import load_bundle
+from src.checkpoint import load_model
+from src.features import MODEL_FEATURES, features_dim
+from src.metrics import EvaluationSession
+from src.quantize import quantize_model, predict_split, check_accuracy, save_quantized
+from src.logging import MyLog
+myLogging = MyLog().logger
+
+
+@ck.command()
+@ck.option(
+    '--data-root', '-dr', default='data',
+    help='Data folder')
+@ck.option(
+    '--model-dir', '-md', default='models',
+    help='Models folder')
+@ck.option(
+    '--model-name', '-m', type=ck.Choice(list(MODEL_FEATURES)),
+    default='LifeLongGo_esm_pdb2',
+    help='Prediction model name')
+@ck.option(
+    '--sub-ontologies', '-so', default='bp_mf_cc',
+    help='Training order of the checkpoint')
+@ck.option(
+    '--ont', '-o', default='cc', type=ck.Choice(['mf', 'bp', 'cc']),
+    help='Sub-ontology of the checkpoint')
+@ck.option(
+    '--test-data-name', '-td', default='test', type=ck.Choice(['test', 'cafa3']),
+    help='Test data set name')
+@ck.option('--bf16-gat', is_flag=True, help='Run the GAT layer under bfloat16 autocast')
+@ck.option(
+    '--tolerance', '-t', default=0.01,
+    help='Largest allowed drop of test Fmax and AUC against the float32 model')
+@ck.option('--batch-size', '-bs', default=256, help='Batch size for prediction')
+def main(data_root, model_dir, model_name, sub_ontologies, ont, test_data_name, bf16_gat, tolerance, batch_size):
+    """
+    Exports an int8 dynamically quantized CPU model if its test Fmax and AUC
+    stay within the tolerance of the float32 model
+    """
+    features = MODEL_FEATURES[model_name]
+    features_length = features_dim(features)
+    model_file = f'{model_dir}/{ont}_{model_name}_{sub_ontologies}_{test_data_name}.th'
+    out_file = f'{model_dir}/{ont}_{model_name}_{sub_ontologies}_{test_data_name}_int8.th'
+    test_data_file = f'{test_data_name}_data.pkl'
+    _, terms_dict, graph, _, _, test_nids, _, labels, _ = load_bundle(
+        data_root, ont, features_length, '_'.join(features), test_data_file, f'ppi_{test_data_name}.bin')
+    _, _, _, _, relations, zero_classes = load_normal_forms(f'{data_root}/go.norm', terms_dict)
+    shared_model = SharedCoreDeepGATModel(
+        shared_input_length=features_length, shared_hidden_dim=2560, shared_embed_dim=2560)
+    net = TaskSpecificModel(
+        shared_model, features_length, len(terms_dict), len(zero_classes), len(relations), 'cpu')
+    load_model(net, model_file)
+    qnet = quantize_model(net, bf16_gat)
+
+    start = time.perf_counter()
+    ref_preds = predict_split(net, graph, test_nids, batch_size)
+    fp32_time = time.perf_counter() - start
+    start = time.perf_counter()
+    preds = predict_split(qnet, graph, test_nids, batch_size)
+    int8_time = time.perf_counter() - start
+    myLogging.info(f'Inference time: float32 {fp32_time:0.2f}s, quantized {int8_time:0.2f}s')
+
+    go = Ontology(f'{data_root}/go.obo', with_rels=True)
+    session = EvaluationSession.get(data_root, ont, test_data_file)
+    ok, report = check_accuracy(
+        ref_preds, preds, labels[test_nids].numpy(), session, AnnotationPropagator(go, terms_dict), tolerance)
+    if not ok:
+        raise ck.ClickException(
+            f'Quantized model degrades Fmax or AUC by more than {tolerance}, not exporting')
+    save_quantized(qnet, out_file, bf16_gat, report)
+    myLogging.info(f'Quantized model saved - {out_file}')
+
+
+if __name__ == '__main__':
+    main()
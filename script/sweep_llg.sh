@@ -0,0 +1,16 @@
+#!/bin/bash
+
+conda activate llg
+jobDir='you Path'
+cd $jobDir
+script="sweep_llg.py"
+data_dir="data"
+batch_size=8
+epochs=512
+test_data="test"
+modes_dir="../models"
+result_dir="../Results"
+workers=3
+
+# All six training orders, shared order prefixes are trained once
+python $script -dr ${data_dir} -m "LifeLongGo_esm_pdb2" -bs $batch_size -ep $epochs -td $test_data -md $modes_dir -rd $result_dir -w $workers -d cpu
@@ -0,0 +1,141 @@
+import queue
+import threading
+import numpy as np
+import torch as th
+import dgl
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+_END = object()
+
+
+class BlockCache(object):
+    """
+    Drop-in replacement for a `dgl.dataloading.DataLoader` with a one-layer
+    full-neighbour sampler over a fixed graph. Such a loader samples the same
+    blocks for a batch in every epoch, so the blocks are built once, on the
+    first iteration, and kept as flat index arrays: the input nodes and the
+    block edges of every batch, concatenated with per-batch offsets. Local
+    indices are stored as int32.
+
+    Each epoch the blocks are recreated from the cached arrays, optionally
+    in a new batch order. A background thread builds the next batch and
+    gathers its features (block 'feat' node data) and labels (output node
+    'label' data) while the current batch is computed.
+    Args:
+        graph (DGLGraph): Graph with 'feat' node data
+        nids (Tensor): Output node ids, batched in this order
+        batch_size (int): Output nodes per batch
+        labels (CSRLabels): Node labels, staged as blocks[-1].dstdata['label']
+        shuffle (boolean): Reshuffle the batch order every epoch
+        prefetch (int): Number of batches prepared ahead, 0 to build batches
+            in the calling thread
+    """
+
+    def __init__(self, graph, nids, batch_size, labels=None, shuffle=False, prefetch=2):
+        self.graph = graph
+        self.nids = nids
+        self.batch_size = batch_size
+        self.labels = labels
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.n_batches = (len(nids) + batch_size - 1) // batch_size
+        self._built = False
+
+    def __len__(self):
+        return self.n_batches
+
+    def _build(self):
+        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+        dataloader = dgl.dataloading.DataLoader(
+            self.graph, self.nids, sampler,
+            batch_size=self.batch_size,
+            shuffle=False,
+            drop_last=False,
+            num_workers=0)
+        node_type = np.int32 if self.graph.num_nodes() < 2 ** 31 else np.int64
+        input_nodes, src, dst = [], [], []
+        n_src, n_dst, n_edges = [0], [0], [0]
+        for batch_input_nodes, batch_output_nodes, blocks in dataloader:
+            block = blocks[0]
+            block_src, block_dst = block.edges()
+            input_nodes.append(batch_input_nodes.cpu().numpy().astype(node_type))
+            src.append(block_src.cpu().numpy().astype(np.int32))
+            dst.append(block_dst.cpu().numpy().astype(np.int32))
+            n_src.append(block.num_src_nodes())
+            n_dst.append(block.num_dst_nodes())
+            n_edges.append(block.num_edges())
+        self.input_nodes = th.from_numpy(np.concatenate(input_nodes))
+        self.src = th.from_numpy(np.concatenate(src))
+        self.dst = th.from_numpy(np.concatenate(dst))
+        self.src_offsets = np.cumsum(n_src)
+        self.dst_offsets = np.cumsum(n_dst)
+        self.edge_offsets = np.cumsum(n_edges)
+        self.n_batches = len(n_src) - 1
+        self._built = True
+        size = sum(t.numel() * t.element_size() for t in (self.input_nodes, self.src, self.dst))
+        myLogging.info(f'Block cache: {self.n_batches} batches, {len(self.src)} edges, {size / 2 ** 20:0.1f} MiB')
+
+    def batch(self, i):
+        """Returns (input_nodes, output_nodes, blocks) of batch `i` with features and labels"""
+        device = self.graph.device
+        input_nodes = self.input_nodes[self.src_offsets[i]:self.src_offsets[i + 1]].to(device, self.graph.idtype)
+        n_dst = int(self.dst_offsets[i + 1] - self.dst_offsets[i])
+        edges = slice(self.edge_offsets[i], self.edge_offsets[i + 1])
+        block = dgl.create_block(
+            (self.src[edges].to(device, self.graph.idtype), self.dst[edges].to(device, self.graph.idtype)),
+            num_src_nodes=len(input_nodes), num_dst_nodes=n_dst, idtype=self.graph.idtype, device=device)
+        # The output nodes are the first source nodes of a block
+        output_nodes = input_nodes[:n_dst]
+        features = self.graph.ndata['feat'][input_nodes.long()]
+        block.srcdata[dgl.NID] = input_nodes
+        block.dstdata[dgl.NID] = output_nodes
+        block.srcdata['feat'] = features
+        block.dstdata['feat'] = features[:n_dst]
+        if self.labels is not None:
+            block.dstdata['label'] = self.labels[output_nodes.long()]
+        return input_nodes, output_nodes, [block]
+
+    def __iter__(self):
+        if not self._built:
+            self._build()
+        order = th.randperm(self.n_batches).tolist() if self.shuffle else range(self.n_batches)
+        if not self.prefetch:
+            for i in order:
+                yield self.batch(i)
+            return
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def worker():
+            try:
+                for i in order:
+                    if not put(self.batch(i)):
+                        return
+                put(_END)
+            except BaseException as e:
+                put(e)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,194 @@
+import os
+import numpy as np
+import pandas as pd
+import torch as th
+import dgl
+from src.data import load_ppi_data
+from src.features import FEATURE_SOURCES, parse_features
+from src.mmap_store import file_sha256, save_arrays, load_arrays, read_meta
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+BUNDLE_VERSION = 2
+
+
+def bundle_path(data_root, ont, features_column, ppi_graph_file='ppi_test.bin'):
+    graph_name = os.path.splitext(os.path.basename(ppi_graph_file))[0]
+    return f'{data_root}/{ont}/{graph_name}_{features_column}.llgb'
+
+
+def bundle_inputs(data_root, ont, features_column, test_data_file='test_data.pkl',
+                  ppi_graph_file='ppi_test.bin'):
+    """Returns the files a training bundle is compiled from"""
+    files = [
+        f'{data_root}/{ont}/terms.pkl',
+        f'{data_root}/mf/terms.pkl',
+        f'{data_root}/{ont}/train_data.pkl',
+        f'{data_root}/{ont}/valid_data.pkl',
+        f'{data_root}/{ont}/{test_data_file}',
+        f'{data_root}/{ont}/{ppi_graph_file}',
+    ]
+    for name in parse_features(features_column):
+        store_file = f'{data_root}/features/{name}.arr'
+        if FEATURE_SOURCES[name].stored and os.path.exists(store_file):
+            files.append(store_file)
+    return files
+
+
+def fingerprints(files, known=None):
+    """
+    Computes size, modification time and SHA-256 of every file. Hashes in
+    `known` are reused for files whose size and modification time did not
+    change, so checking an up to date bundle does not read its inputs.
+    """
+    known = known or {}
+    result = {}
+    for filename in files:
+        st = os.stat(filename)
+        old = known.get(filename)
+        if old is not None and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+            digest = old['sha256']
+        else:
+            digest = file_sha256(filename)
+        result[filename] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest}
+    return result
+
+
+def _is_current(meta, inputs):
+    if meta is None or meta.get('version') != BUNDLE_VERSION:
+        return False
+    known = meta.get('inputs', {})
+    if sorted(known) != sorted(inputs):
+        return False
+    current = fingerprints(inputs, known)
+    return all(current[f]['sha256'] == known[f]['sha256'] for f in inputs)
+
+
+def compile_bundle(data_root, ont, features_length=2560, features_column='esm',
+                   test_data_file='test_data.pkl', ppi_graph_file='ppi_test.bin', bundle_file=None):
+    """
+    Loads the PPI graph, features, labels and node splits with
+    `load_ppi_data` and writes them into one memory-mappable bundle file
+    Returns:
+       bundle_file (string): Path of the written bundle
+    """
+    if bundle_file is None:
+        bundle_file = bundle_path(data_root, ont, features_column, ppi_graph_file)
+    _, terms_dict, graph, train_nids, valid_nids, test_nids, data, labels, _ = load_ppi_data(
+        data_root, ont, features_length, features_column, test_data_file, ppi_graph_file)
+    inputs = bundle_inputs(data_root, ont, features_column, test_data_file, ppi_graph_file)
+    src, dst = graph.edges()
+    # Graph nodes are the proteins of the train, valid and test splits in this order
+    proteins = np.concatenate([
+        pd.read_pickle(f'{data_root}/{ont}/{name}')['proteins'].values.astype(str)
+        for name in ('train_data.pkl', 'valid_data.pkl', test_data_file)])
+    rows, cols = np.nonzero(labels.numpy())
+    label_indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+    label_indptr[1:] = np.cumsum(np.bincount(rows, minlength=len(labels)))
+    terms = list(terms_dict)
+    arrays = {
+        'src': src.numpy(),
+        'dst': dst.numpy(),
+        'feat': data.numpy(),
+        'label_indptr': label_indptr,
+        'label_indices': cols.astype(np.int32),
+        'train_nids': train_nids.numpy(),
+        'valid_nids': valid_nids.numpy(),
+        'test_nids': test_nids.numpy(),
+        'terms': np.array(terms, dtype=f'U{max([len(t) for t in terms] + [1])}'),
+        'proteins': proteins,
+    }
+    if 'etypes' in graph.edata:
+        arrays['etypes'] = graph.edata['etypes'].numpy()
+    meta = {
+        'version': BUNDLE_VERSION,
+        'ont': ont,
+        'features_column': features_column,
+        'test_data_file': test_data_file,
+        'ppi_graph_file': ppi_graph_file,
+        'num_nodes': graph.num_nodes(),
+        'inputs': fingerprints(inputs),
+    }
+    save_arrays(bundle_file, arrays, meta)
+    myLogging.info(f'Training bundle: saved {bundle_file}')
+    return bundle_file
+
+
+class CSRLabels(object):
+    """
+    Binary label matrix kept in CSR form (usually memory-mapped from a
+    bundle). Indexing with node ids gathers only those rows into a dense
+    float32 tensor, so the full n_nodes x n_terms matrix is never built.
+    Args:
+        indptr (numpy.ndarray): Row pointers (n_nodes + 1)
+        indices (numpy.ndarray): Term indices of the labels of every row
+        n_terms (int): Number of terms (columns)
+        device (string): Device of the gathered rows
+    """
+
+    def __init__(self, indptr, indices, n_terms, device='cpu'):
+        self.indptr = indptr
+        self.indices = indices
+        self.n_terms = n_terms
+        self.device = device
+
+    @property
+    def shape(self):
+        return (len(self.indptr) - 1, self.n_terms)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def to(self, device):
+        return CSRLabels(self.indptr, self.indices, self.n_terms, device)
+
+    def __getitem__(self, nids):
+        if th.is_tensor(nids):
+            nids = nids.cpu().numpy()
+        nids = np.asarray(nids, dtype=np.int64)
+        starts = self.indptr[nids]
+        counts = self.indptr[nids + 1] - starts
+        rows = np.repeat(np.arange(len(nids)), counts)
+        # Positions of the labels of every requested row in `indices`
+        positions = np.arange(int(counts.sum())) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        labels = th.zeros((len(nids), self.n_terms), dtype=th.float32)
+        labels[th.from_numpy(rows), th.from_numpy(np.asarray(self.indices[positions], dtype=np.int64))] = 1
+        return labels.to(self.device)
+
+
+def load_bundle(data_root, ont, features_length=2560, features_column='esm',
+                test_data_file='test_data.pkl', ppi_graph_file='ppi_test.bin', bundle_file=None):
+    """
+    Drop-in replacement of `data.load_ppi_data` which reads a compiled
+    training bundle. The bundle is (re)compiled when it is missing, has an
+    old format or any of its input files changed. Arrays are memory-mapped
+    copy-on-write instead of read into memory, and labels are returned as
+    `CSRLabels` (not stored as graph node data) whose rows are gathered
+    per split or batch.
+    """
+    if bundle_file is None:
+        bundle_file = bundle_path(data_root, ont, features_column, ppi_graph_file)
+    inputs = bundle_inputs(data_root, ont, features_column, test_data_file, ppi_graph_file)
+    meta = read_meta(bundle_file) if os.path.exists(bundle_file) else None
+    if not _is_current(meta, inputs):
+        myLogging.info(f'Compiling training bundle {bundle_file}')
+        compile_bundle(data_root, ont, features_length, features_column,
+                       test_data_file, ppi_graph_file, bundle_file)
+    meta, arrays = load_arrays(bundle_file, mode='c')
+    data = th.from_numpy(arrays['feat'])
+    if features_length is not None and data.shape[1] != features_length:
+        raise ValueError(
+            f'Features {features_column} have length {data.shape[1]}, expected {features_length}')
+    terms_dict = {v: i for i, v in enumerate(arrays['terms'].tolist())}
+    labels = CSRLabels(arrays['label_indptr'], arrays['label_indices'], len(terms_dict))
+
+    graph = dgl.graph(
+        (th.from_numpy(arrays['src']), th.from_numpy(arrays['dst'])), num_nodes=meta['num_nodes'])
+    if 'etypes' in arrays:
+        graph.edata['etypes'] = th.from_numpy(arrays['etypes'])
+    graph.ndata['feat'] = data
+    train_nids, valid_nids, test_nids = (
+        th.from_numpy(arrays[name]) for name in ('train_nids', 'valid_nids', 'test_nids'))
+    test_df = pd.read_pickle(f'{data_root}/{ont}/{test_data_file}')
+    return None, terms_dict, graph, train_nids, valid_nids, test_nids, data, labels, test_df
@@ -0,0 +1,304 @@
+import os
+import random
+import shutil
+import hashlib
+import tempfile
+import threading
+import collections
+import numpy as np
+import torch as th
+from src.mmap_store import save_arrays, load_arrays, read_meta
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(state_dict, filename, meta=None):
+    """
+    Writes a model state dict with every tensor stored separately in an
+    array store (see `mmap_store.save_arrays`), so loaders can memory-map it
+    and read only the tensors they need. The file is replaced atomically.
+    Args:
+       state_dict (dict): Parameter name to tensor
+       filename (string): Output file
+       meta (dict): JSON-serializable metadata
+    """
+    arrays = {name: t.detach().cpu().numpy() for name, t in state_dict.items()}
+    meta = dict(meta or {})
+    meta['checkpoint_version'] = CHECKPOINT_VERSION
+    save_arrays(filename, arrays, meta)
+
+
+def is_tensor_checkpoint(filename):
+    """Returns True if `filename` was written by `save_checkpoint`"""
+    meta = read_meta(filename)
+    return meta is not None and 'checkpoint_version' in meta
+
+
+def load_checkpoint(filename, device='cpu', keys=None, skip=()):
+    """
+    Loads a state dict written by `save_checkpoint` or, for older
+    checkpoints, by `torch.save`
+    Args:
+       filename (string): Checkpoint file
+       device (string): Device of the returned tensors
+       keys (iterable): Load only these tensors (all by default)
+       skip (tuple): Top-level module names whose tensors are left out,
+           e.g. `model_use.EL_MODULES`
+    Returns:
+       state_dict (dict): Parameter name to tensor
+    """
+    wanted = None if keys is None else set(keys)
+
+    def selected(name):
+        if name.split('.', 1)[0] in skip:
+            return False
+        return wanted is None or name in wanted
+
+    if is_tensor_checkpoint(filename):
+        _, arrays = load_arrays(filename, mmap=True)
+        return {name: th.from_numpy(np.array(arr)).to(device)
+                for name, arr in arrays.items() if selected(name)}
+    state_dict = th.load(filename, map_location=device)
+    return {name: t for name, t in state_dict.items() if selected(name)}
+
+
+def load_model(net, filename, device='cpu'):
+    """
+    Loads a checkpoint into a model. Tensors the model does not have, such
+    as ELEmbedding tables of a model created without them, are skipped and
+    never read from a tensor checkpoint.
+    Args:
+       net (nn.Module): Model
+       filename (string): Checkpoint file
+       device (string): Device of the model
+    """
+    keys = net.state_dict().keys()
+    state_dict = load_checkpoint(filename, device, keys=keys)
+    net.load_state_dict(state_dict)
+    return net
+
+
+def save_snapshot(shared_model, ewc, filename, meta=None):
+    """
+    Writes the state carried from one task to the next: the shared model
+    parameters and the EWC Fisher diagonal and old parameters
+    """
+    arrays = {f'shared_model.{k}': v for k, v in shared_model.state_dict().items()}
+    ewc_state = ewc.state_dict()
+    arrays['ewc.fisher'] = ewc_state['fisher']
+    if ewc_state['anchor'] is not None:
+        arrays['ewc.anchor'] = ewc_state['anchor']
+    meta = dict(meta or {})
+    meta['ewc'] = {'mode': ewc_state['mode'], 'lambda_ewc': ewc_state['lambda_ewc'], 'decay': ewc_state['decay']}
+    save_checkpoint(arrays, filename, meta)
+
+
+def load_snapshot(shared_model, ewc, filename, device='cpu'):
+    """Restores a state written by `save_snapshot` in place"""
+    state = load_checkpoint(filename, device)
+    prefix = 'shared_model.'
+    shared_model.load_state_dict({k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)})
+    ewc.load_state_dict({'fisher': state['ewc.fisher'], 'anchor': state.get('ewc.anchor')})
+
+
+def rng_state():
+    """Returns the Python, NumPy and PyTorch (CPU and CUDA) random states"""
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': th.get_rng_state()}
+    if th.cuda.is_available():
+        state['cuda'] = th.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """Restores random states returned by `rng_state`"""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    th.set_rng_state(state['torch'])
+    if 'cuda' in state and th.cuda.is_available():
+        th.cuda.set_rng_state_all(state['cuda'])
+
+
+def _save_state(state, filename):
+    out_dir = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_file = tempfile.mkstemp(dir=out_dir, prefix='.tmp_', suffix='.state')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            th.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, filename)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def cpu_copy(obj):
+    """Returns `obj` with every tensor in nested dicts, lists and tuples copied to CPU memory"""
+    if th.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: cpu_copy(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_copy(v) for v in obj)
+    return obj
+
+
+def state_digest(state_dict):
+    """SHA-1 digest of the names and contents of a state dict's tensors"""
+    h = hashlib.sha1()
+    for name, t in state_dict.items():
+        h.update(name.encode('utf-8'))
+        h.update(np.ascontiguousarray(t.numpy()).view(np.uint8))
+    return h.hexdigest()
+
+
+class CheckpointManager(object):
+    """
+    Keeps the complete state of a lifelong training run in one file, so an
+    interrupted run can continue where it stopped. The state is a dictionary
+    of the caller (models, optimizer, scheduler, EWC, task position, random
+    states) saved with `torch.save` to a temporary file which then replaces
+    the previous state, so a crash while saving leaves the last state intact.
+    Args:
+        filename (string): State file
+        every (int): Save the state every this many epochs within a task,
+            0 to save only at task boundaries
+        writer (AsyncCheckpointWriter): Write the state in the background
+    """
+
+    def __init__(self, filename, every=1, writer=None):
+        self.filename = filename
+        self.every = every
+        self.writer = writer
+
+    def due(self, epoch):
+        """Returns True if the state should be saved after `epoch` (0-based)"""
+        return self.every > 0 and (epoch + 1) % self.every == 0
+
+    def save(self, state):
+        if self.writer is not None:
+            self.writer.submit(self.filename, _save_state, cpu_copy(state), keep=1)
+        else:
+            _save_state(state, self.filename)
+
+    def load(self):
+        """Returns the saved state or None if there is none"""
+        if not os.path.exists(self.filename):
+            return None
+        myLogging.info(f'Resuming from {self.filename}')
+        return th.load(self.filename, map_location='cpu', weights_only=False)
+
+
+class AsyncCheckpointWriter(object):
+    """
+    Writes checkpoints on a background thread. The caller only waits for
+    the tensors to be copied to CPU memory; serialization and the atomic
+    write (temporary file and rename) happen on the writer thread.
+    Files are written in the order they were first queued. A newer save of
+    a file replaces its pending older one in place, and a model checkpoint
+    identical to the last one written to that file is skipped.
+    The previous `keep - 1` versions of a file are kept as `{filename}.1`
+    (newest) to `{filename}.{keep - 1}`.
+    Errors of the writer thread are raised by the next call to `submit`,
+    `flush` or `close`.
+    Args:
+        keep (int): Number of versions of every checkpoint file to keep
+    """
+
+    def __init__(self, keep=1):
+        self.keep = keep
+        self._pending = collections.OrderedDict()
+        self._digests = {}
+        self._cond = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, filename, write, payload, keep=None, digest=None):
+        """
+        Queues write(payload, filename)
+        Args:
+           payload: Data owned by the writer from now on (a CPU copy)
+           keep (int): Versions to keep, the writer's default if None
+           digest: Content digest to skip identical writes, True to compute
+               it from a state dict payload
+        """
+        self._raise()
+        with self._cond:
+            # A pending older save is replaced in its queue position, so files
+            # submitted after it (a state referencing a model) are still written later
+            self._pending[filename] = (write, payload, self.keep if keep is None else keep, digest)
+            self._cond.notify_all()
+
+    def save_checkpoint(self, state_dict, filename, meta=None):
+        """Asynchronous `save_checkpoint`"""
+        state_dict = cpu_copy(state_dict)
+        self.submit(filename, lambda state, f: save_checkpoint(state, f, meta), state_dict, digest=True)
+
+    def _rotate(self, filename, keep):
+        if keep <= 1 or not os.path.exists(filename):
+            return
+        oldest = f'{filename}.{keep - 1}'
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for i in range(keep - 2, 0, -1):
+            if os.path.exists(f'{filename}.{i}'):
+                os.replace(f'{filename}.{i}', f'{filename}.{i + 1}')
+        # The current file stays in place until it is atomically replaced
+        try:
+            os.link(filename, f'{filename}.1')
+        except OSError:
+            shutil.copyfile(filename, f'{filename}.1')
+
+    def _write(self, filename, write, payload, keep, digest):
+        if digest is True:
+            digest = state_digest(payload)
+        if digest is not None and self._digests.get(filename) == digest and os.path.exists(filename):
+            return
+        self._rotate(filename, keep)
+        write(payload, filename)
+        self._digests[filename] = digest
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                filename, job = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                self._write(filename, *job)
+            except BaseException as e:
+                myLogging.error(f'Writing {filename} failed: {e}')
+                self._error = e
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def flush(self):
+        """Waits until every queued checkpoint is written"""
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+        self._raise()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
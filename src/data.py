@@ -1,145 +1,56 @@
+import os
+import hashlib
+import numpy as np
 import pandas as pd
 import torch as th
 import dgl
+from src.features import parse_features, assemble_features
+from src.mmap_store import file_sha256, save_arrays, load_arrays, read_meta
 from src.logging import MyLog
 
 myLogging = MyLog().logger
 
+NF_VERSION = 1
 
-def get_data(df, features_dict, terms_dict, features_length, features_column):
+
+def get_labels(df, terms_dict):
     """
-    Converts dataframe file with protein information and returns
-    PyTorch tensors
+    Builds the label matrix of propagated annotations
     """
-    data = th.zeros((len(df), features_length), dtype=th.float32)
     labels = th.zeros((len(df), len(terms_dict)), dtype=th.float32)
     for i, row in enumerate(df.itertuples()):
-        # Data vector
-        if features_column == 'esmS':
-            data[i, :] = th.FloatTensor(row.esmS)
-        elif features_column == 'pdb2':
-            data[i, :] = th.FloatTensor(row.pdb2)
-        elif features_column == 'esm':
-            data[i, :] = th.FloatTensor(row.esm)
-        elif features_column == 'ssa_esmS':
-            merged_list = row.ssa + row.esmS
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'ssa_unir_esmS':
-            merged_list = row.ssa + row.UNIREPEB + row.esmS
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'esm_pdb2':
-            merged_list = row.esm + row.pdb2
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'ssa_unir':
-            merged_list = row.ssa + row.UNIREPEB
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'ssa':
-            data[i, :] = th.FloatTensor(row.ssa)
-        elif features_column == 'unir':
-            data[i, :] = th.FloatTensor(row.UNIREPEB)
-        elif features_column == 'ssa_esm':
-            merged_list = row.ssa + row.esm
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'ssa_esm_pdb2':
-            merged_list = row.ssa + row.esm + row.pdb2
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'ssa_esm_pdb':
-            merged_list = row.ssa + row.esm + row.pdb
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'unir_esm':
-            merged_list = row.UNIREPEB + row.esm
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'ssa_unir_esm':
-            merged_list = row.ssa + row.UNIREPEB +row.esm
-            data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'interpros':
-            for feat in row.interpros:
-                if feat in features_dict:
-                    data[i, features_dict[feat]]
-        elif features_column == 'mf_preds':
-            data[i, :] = th.FloatTensor(row.mf_preds)
-        elif features_column == 'prop_annotations':
-            for feat in row.prop_annotations:
-                if feat in features_dict:
-                    data[i, features_dict[feat]] = 1
-        # Labels vector
         for go_id in row.prop_annotations:
             if go_id in terms_dict:
                 g_id = terms_dict[go_id]
                 labels[i, g_id] = 1
-    return data, labels
+    return labels
 
-def get_ppi_data(df, features_dict, terms_dict, features_length, features_column):
+
+def get_data(df, features_dict, terms_dict, features_length, features_column, data_root=None):
     """
     Converts dataframe file with protein information and returns
-    PyTorch tensors
+    PyTorch tensors. The input matrix is assembled from the feature sources
+    named in `features_column` (see `features.FEATURE_SOURCES`); stored
+    sources are read from the feature store in data_root/features when
+    data_root is given.
     """
-    pdb_feature_length = 20
-    seq_feature_length = 1280
-    pdb_data = th.zeros((len(df), pdb_feature_length), dtype=th.float32)
-    seq_data = th.zeros((len(df), seq_feature_length), dtype=th.float32)
+    names = parse_features(features_column)
+    data = assemble_features(df, names, features_dict, data_root)
+    if features_length is not None and data.shape[1] != features_length:
+        raise ValueError(
+            f'Features {features_column} have length {data.shape[1]}, expected {features_length}')
+    return th.from_numpy(data), get_labels(df, terms_dict)
 
-    labels = th.zeros((len(df), len(terms_dict)), dtype=th.float32)
-    for i, row in enumerate(df.itertuples()):
-        # Data vector
-        # if features_column == 'esmS':
-        #     merged_list = row.esmS
-        #     seq_data[i, :] = th.FloatTensor(merged_list)
-        if features_column == 'esmS_pdb2':
-            # merged_list = row.esmS + row.pdb2
-            seq_data[i, :] = th.FloatTensor(row.esmS)
-            pdb_data[i, :] = th.FloatTensor(row.pdb2)
-        # elif features_column == 'ssa_esmS':
-        #     seq_data[i, :] = th.FloatTensor(row.esmS)
-        #     pdb_data[i, :] = th.FloatTensor(row.pdb2)
-        # elif features_column == 'ssa_unir_esmS':
-        #     merged_list = row.ssa + row.UNIREPEB + row.esmS
-        #     data[i, :] = th.FloatTensor(merged_list)
-        elif features_column == 'esm_pdb2':
-            seq_data[i, :] = th.FloatTensor(row.esm)
-            pdb_data[i, :] = th.FloatTensor(row.pdb2)
-        # elif features_column == 'ssa_unir':
-        #     merged_list = row.ssa + row.UNIREPEB
-        #     data[i, :] = th.FloatTensor(merged_list)
-        # elif features_column == 'ssa':
-        #     data[i, :] = th.FloatTensor(row.ssa)
-        # elif features_column == 'unir':
-        #     data[i, :] = th.FloatTensor(row.UNIREPEB)
-        # elif features_column == 'ssa_esm':
-        #     merged_list = row.ssa + row.esm
-        #     data[i, :] = th.FloatTensor(merged_list)
-        # elif features_column == 'ssa_esm_pdb2':
-        #     merged_list = row.ssa + row.esm + row.pdb2
-        #     data[i, :] = th.FloatTensor(merged_list)
-        # elif features_column == 'ssa_esm_pdb':
-        #     merged_list = row.ssa + row.esm + row.pdb
-        #     data[i, :] = th.FloatTensor(merged_list)
-        # elif features_column == 'unir_esm':
-        #     merged_list = row.UNIREPEB + row.esm
-        #     data[i, :] = th.FloatTensor(merged_list)
-        # elif features_column == 'ssa_unir_esm':
-        #     merged_list = row.ssa + row.UNIREPEB +row.esm
-        #     data[i, :] = th.FloatTensor(merged_list)
-        # elif features_column == 'esm':
-        #     data[i, :] = th.FloatTensor(row.esm)
-        # elif features_column == 'pdb':
-        #     data[i, :] = th.FloatTensor(row.pdb)
-        # elif features_column == 'interpros':
-        #     for feat in row.interpros:
-        #         if feat in features_dict:
-        #             data[i, features_dict[feat]]
-        # elif features_column == 'mf_preds':
-        #     data[i, :] = th.FloatTensor(row.mf_preds)
-        # elif features_column == 'prop_annotations':
-        #     for feat in row.prop_annotations:
-        #         if feat in features_dict:
-        #             data[i, features_dict[feat]] = 1
-        # Labels vector
-        for go_id in row.prop_annotations:
-            if go_id in terms_dict:
-                g_id = terms_dict[go_id]
-                labels[i, g_id] = 1
-    return seq_data, pdb_data, labels
+
+def get_ppi_data(df, features_dict, terms_dict, features_length, features_column, data_root=None):
+    """
+    Converts dataframe file with protein information and returns
+    PyTorch tensors of the sequence and structure features separately
+    """
+    names = parse_features(features_column)
+    seq_data = assemble_features(df, names[:-1], features_dict, data_root)
+    pdb_data = assemble_features(df, names[-1:], features_dict, data_root)
+    return th.from_numpy(seq_data), th.from_numpy(pdb_data), get_labels(df, terms_dict)
 
 
 def load_data(
@@ -198,7 +109,7 @@ def load_ppi_data(data_root, ont, features_length=2560,
     df = pd.concat([train_df, valid_df, test_df])
     graphs, nids = dgl.load_graphs(f'{data_root}/{ont}/{ppi_graph_file}')
 
-    data, labels = get_data(df, mfs_dict, terms_dict, features_length, features_column)
+    data, labels = get_data(df, mfs_dict, terms_dict, features_length, features_column, data_root)
     graph = graphs[0]
     graph.ndata['feat'] = data
     graph.ndata['labels'] = labels
@@ -206,15 +117,17 @@ def load_ppi_data(data_root, ont, features_length=2560,
     return feat_dict, terms_dict, graph, train_nids, valid_nids, test_nids, data, labels, test_df
 
 
-def load_normal_forms(go_file, terms_dict):
+def parse_normal_forms(go_file, terms_dict):
     """
-    Parses and loads normalized (using Normalize.groovy script)
+    Parses normalized (using Normalize.groovy script)
     ontology axioms file
     Args:
         go_file (string): Path to a file with normal forms
         terms_dict (dict): Dictionary with GO classes that are predicted
     Returns:
-
+        nf1, nf2, nf3, nf4 (list): Lists of axiom index tuples
+        relations (dict): Relation to index mapping
+        zclasses (dict): Index mapping of classes which are not predicted
     """
     nf1 = []
     nf2 = []
@@ -261,6 +174,61 @@ def load_normal_forms(go_file, terms_dict):
                 rel, go2 = right.split(' some ')
                 nf4.append((get_index(go1), get_rel_index(rel), get_index(go2)))
     return nf1, nf2, nf3, nf4, relations, zclasses
+
+
+def terms_digest(terms_dict):
+    """SHA-256 of the GO ids of a terms_dict in index order"""
+    terms = sorted(terms_dict, key=terms_dict.get)
+    return hashlib.sha256('\n'.join(terms).encode('utf-8')).hexdigest()
+
+
+def _id_array(ids):
+    return np.array(ids, dtype=f'U{max([len(i) for i in ids] + [1])}')
+
+
+def load_normal_forms(go_file, terms_dict, nf_file=None):
+    """
+    Loads normalized ontology axioms from their compiled form, which is
+    kept next to go.norm and rebuilt with `parse_normal_forms` when the
+    go.norm content or the terms_dict changes
+    Args:
+        go_file (string): Path to a file with normal forms
+        terms_dict (dict): Dictionary with GO classes that are predicted
+        nf_file (string): Compiled file location, optional
+    Returns:
+        nf1, nf2, nf3, nf4 (numpy.ndarray): int32 arrays of axiom indices
+            with 2, 3, 3 and 3 columns
+        relations (dict): Relation to index mapping
+        zclasses (dict): Index mapping of classes which are not predicted
+    """
+    digest = terms_digest(terms_dict)
+    if nf_file is None:
+        nf_file = f'{os.path.splitext(go_file)[0]}_{digest[:16]}.nfs'
+    norm_digest = file_sha256(go_file)
+    meta = read_meta(nf_file) if os.path.exists(nf_file) else None
+    if (meta is None or meta.get('version') != NF_VERSION
+            or meta.get('sha256') != norm_digest or meta.get('terms') != digest):
+        myLogging.info(f'Compiling normal forms {nf_file}')
+        nf1, nf2, nf3, nf4, relations, zclasses = parse_normal_forms(go_file, terms_dict)
+        arrays = {
+            'nf1': np.array(nf1, dtype=np.int32).reshape(-1, 2),
+            'nf2': np.array(nf2, dtype=np.int32).reshape(-1, 3),
+            'nf3': np.array(nf3, dtype=np.int32).reshape(-1, 3),
+            'nf4': np.array(nf4, dtype=np.int32).reshape(-1, 3),
+            'relations': _id_array(sorted(relations, key=relations.get)),
+            'zclasses': _id_array(sorted(zclasses, key=zclasses.get)),
+        }
+        meta = {'version': NF_VERSION, 'sha256': norm_digest, 'terms': digest,
+                'n_terms': len(terms_dict)}
+        try:
+            save_arrays(nf_file, arrays, meta)
+        except OSError as e:
+            myLogging.info(f'Could not write normal forms {nf_file}: {e}')
+    else:
+        _, arrays = load_arrays(nf_file, mmap=False)
+    relations = {r: i for i, r in enumerate(arrays['relations'].tolist())}
+    zclasses = {z: len(terms_dict) + i for i, z in enumerate(arrays['zclasses'].tolist())}
+    return arrays['nf1'], arrays['nf2'], arrays['nf3'], arrays['nf4'], relations, zclasses
 import subprocess
 def run_diamond_blastp_and_get_first_result(database, fasta, output_file):
     command = [
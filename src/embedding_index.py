@@ -0,0 +1,174 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from src.feature_store import FeatureStore
+from src.mmap_store import save_arrays, load_arrays, read_meta
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+INDEX_VERSION = 1
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norm, 1e-12)
+
+
+def spherical_kmeans(data, n_lists, n_iter=10, sample_size=None, seed=0, chunk_size=8192):
+    """
+    Clusters unit vectors by cosine similarity
+    Args:
+       data (numpy.ndarray): Normalized vectors (n x dim)
+       n_lists (int): Number of clusters
+       n_iter (int): Lloyd iterations
+       sample_size (int): Number of vectors used for training, all by default
+    Returns:
+       centroids (numpy.ndarray): Normalized centroids (n_lists x dim)
+    """
+    rng = np.random.default_rng(seed)
+    if sample_size is not None and sample_size < len(data):
+        data = data[np.sort(rng.choice(len(data), sample_size, replace=False))]
+    centroids = np.array(data[rng.choice(len(data), n_lists, replace=False)], dtype=np.float32)
+    for _ in range(n_iter):
+        assign = assign_lists(data, centroids, chunk_size)
+        sums = np.zeros_like(centroids)
+        for s in range(0, len(data), chunk_size):
+            np.add.at(sums, assign[s:s + chunk_size], data[s:s + chunk_size])
+        empty = np.flatnonzero(np.bincount(assign, minlength=n_lists) == 0)
+        sums[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def assign_lists(data, centroids, chunk_size=8192):
+    """Returns the most similar centroid of every vector"""
+    assign = np.zeros(len(data), dtype=np.int64)
+    for s in range(0, len(data), chunk_size):
+        assign[s:s + chunk_size] = np.argmax(
+            np.asarray(data[s:s + chunk_size], dtype=np.float32) @ centroids.T, axis=1)
+    return assign
+
+
+class EmbeddingIndex(object):
+    """
+    Inverted-file (IVF) index for cosine nearest-neighbour search over
+    protein embeddings. Vectors are normalized, clustered with spherical
+    k-means and stored grouped by cluster, so a query scores the centroids
+    and then only the contiguous rows of the `n_probe` closest clusters.
+    The index is saved as one array-store file and memory-mapped on load.
+    """
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.centroids = np.asarray(arrays['centroids'])
+        self.list_indptr = np.asarray(arrays['list_indptr'])
+        self.vectors = arrays['vectors']
+        self.ids = arrays['ids']
+
+    @classmethod
+    def build(cls, embeddings, ids=None, n_lists=None, n_iter=10, sample_size=65536,
+              dtype=np.float32, seed=0):
+        """
+        Builds an index
+        Args:
+           embeddings (array-like): Vectors (n x dim)
+           ids (array-like): Integer id of every vector, row numbers by default
+           n_lists (int): Number of clusters, about 4 * sqrt(n) by default
+           dtype: Storage type of the vectors, float32 or float16
+        """
+        data = _normalize(embeddings)
+        if ids is None:
+            ids = np.arange(len(data))
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(len(data)))
+        n_lists = max(1, min(n_lists, len(data)))
+        centroids = spherical_kmeans(data, n_lists, n_iter, sample_size, seed)
+        assign = assign_lists(data, centroids)
+        order = np.argsort(assign, kind='stable')
+        list_indptr = np.zeros(n_lists + 1, dtype=np.int64)
+        list_indptr[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+        arrays = {
+            'centroids': centroids,
+            'list_indptr': list_indptr,
+            'vectors': data[order].astype(dtype),
+            'ids': np.asarray(ids, dtype=np.int64)[order],
+        }
+        meta = {'version': INDEX_VERSION, 'n_lists': n_lists, 'dim': int(data.shape[1])}
+        return cls(meta, arrays)
+
+    def save(self, filename, meta=None):
+        self.meta.update(meta or {})
+        save_arrays(filename, {
+            'centroids': self.centroids, 'list_indptr': self.list_indptr,
+            'vectors': np.asarray(self.vectors), 'ids': np.asarray(self.ids)}, self.meta)
+
+    @classmethod
+    def load(cls, filename):
+        meta, arrays = load_arrays(filename)
+        return cls(meta, arrays)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=10, n_probe=8):
+        """
+        Finds the most similar stored vectors
+        Args:
+           query (array-like): Query vector (dim,)
+           k (int): Number of neighbours
+           n_probe (int): Number of clusters that are scanned
+        Returns:
+           ids (numpy.ndarray): Ids of the neighbours, most similar first
+           scores (numpy.ndarray): Cosine similarities
+        """
+        q = _normalize(np.asarray(query).reshape(-1))
+        n_probe = min(n_probe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ q), n_probe - 1)[:n_probe]
+        rows = np.concatenate([
+            np.arange(self.list_indptr[c], self.list_indptr[c + 1]) for c in np.sort(lists)])
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ q
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return np.asarray(self.ids)[rows[top]], scores[top]
+
+
+def graph_proteins(data_root, ont, test_data_file='test_data.pkl'):
+    """Returns the proteins of the PPI graph nodes in node order"""
+    proteins = []
+    for split in ['train_data.pkl', 'valid_data.pkl', test_data_file]:
+        proteins += list(pd.read_pickle(f'{data_root}/{ont}/{split}')['proteins'])
+    return proteins
+
+
+def load_graph_index(data_root, ont, proteins, feature='esm', index_file=None, **kwargs):
+    """
+    Loads the embedding index of a graph's proteins, whose ids are node
+    numbers. The index is built from the feature store and rebuilt when the
+    stored features or the protein list change.
+    Args:
+       data_root (string): Data folder with the feature store
+       ont (string): Sub-ontology of the graph
+       proteins (list): Proteins of the graph nodes in node order
+       feature (string): Stored embedding type
+    """
+    store = FeatureStore(f'{data_root}/features')
+    if index_file is None:
+        index_file = f'{data_root}/{ont}/{feature}.ivf'
+    st = os.stat(store.path(feature))
+    key = {
+        'version': INDEX_VERSION,
+        'store': [st.st_size, st.st_mtime_ns],
+        'proteins': hashlib.sha1('\n'.join(proteins).encode('utf-8')).hexdigest(),
+    }
+    meta = read_meta(index_file) if os.path.exists(index_file) else None
+    if meta is None or any(meta.get(k) != v for k, v in key.items()):
+        myLogging.info(f'Building embedding index {index_file}')
+        index = EmbeddingIndex.build(store.gather(feature, proteins), **kwargs)
+        index.save(index_file, key)
+    return EmbeddingIndex.load(index_file)
@@ -0,0 +1,165 @@
+import torch as th
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+EWC_MODES = ['running', 'task', 'online']
+
+
+class FlatEWC(object):
+    """
+    Elastic weight consolidation for the shared model with all parameters,
+    gradients, anchor (old) parameters and the Fisher diagonal kept in flat
+    buffers. The parameters and their gradients are re-pointed to views of
+    one contiguous buffer each, so the penalty gradient and the Fisher update
+    are single fused vector operations. The penalty gradient
+    2 * lambda * F * (theta - theta_old) is added to the flat gradient after
+    `backward()` instead of building the penalty into the autograd graph.
+
+    Modes:
+        running: Fisher is accumulated from the squared gradients of every
+            step and divided by the number of steps at the end of every
+            epoch, the anchor is the last saved set of parameters (the
+            original training scheme). The Fisher being accumulated stays in
+            the parameter type during an epoch.
+        task: Fisher is estimated once at the end of a task on a sample of
+            batches and added to the Fisher of earlier tasks (standard EWC)
+        online: Like task, but earlier Fisher is multiplied by `decay`
+            (online EWC)
+
+    Create it after the model is moved to its device, moving the model later
+    detaches the parameters from the flat buffers.
+    Args:
+        model (nn.Module): Shared model
+        lambda_ewc (float): Penalty weight
+        mode (string): One of EWC_MODES
+        decay (float): Fisher decay of the online mode
+        dtype (torch.dtype): Storage type of the Fisher diagonal and anchor,
+            torch.float32 or torch.float16
+    """
+
+    def __init__(self, model, lambda_ewc=0.5, mode='running', decay=0.9, dtype=th.float32):
+        if mode not in EWC_MODES:
+            raise ValueError(f'Unknown EWC mode {mode}')
+        self.lambda_ewc = lambda_ewc
+        self.mode = mode
+        self.decay = decay if mode == 'online' else 1.0
+        self.dtype = dtype
+        self.params = [p for p in model.parameters() if p.requires_grad]
+        total = sum(p.numel() for p in self.params)
+        device = self.params[0].device
+        self.flat = th.empty(total, dtype=self.params[0].dtype, device=device)
+        self.grad = th.zeros_like(self.flat)
+        self._param_views = []
+        self._grad_views = []
+        offset = 0
+        for p in self.params:
+            n = p.numel()
+            self._param_views.append(self.flat[offset:offset + n].view_as(p))
+            self._grad_views.append(self.grad[offset:offset + n].view_as(p))
+            offset += n
+        self._bind()
+        self.fisher = th.zeros(total, dtype=dtype, device=device)
+        self.anchor = None
+        self._fisher_sum = None
+
+    def _bind(self):
+        """Makes parameters and gradients views of the flat buffers again if they were replaced"""
+        for p, p_view, g_view in zip(self.params, self._param_views, self._grad_views):
+            if p.data_ptr() != p_view.data_ptr():
+                p_view.copy_(p.data)
+                p.data = p_view
+            if p.grad is None:
+                g_view.zero_()
+                p.grad = g_view
+            elif p.grad.data_ptr() != g_view.data_ptr():
+                g_view.copy_(p.grad)
+                p.grad = g_view
+
+    def save_old_parameters(self):
+        """Sets the anchor to the current parameters"""
+        self._bind()
+        self.anchor = self.flat.detach().to(self.dtype, copy=True)
+
+    def _current_fisher(self):
+        if self._fisher_sum is not None:
+            return self._fisher_sum
+        return self.fisher.to(self.flat.dtype)
+
+    def penalty(self):
+        """Returns the EWC penalty value"""
+        if self.anchor is None:
+            return 0.0
+        self._bind()
+        with th.no_grad():
+            diff = self.flat - self.anchor.to(self.flat.dtype)
+            return self.lambda_ewc * th.dot(self._current_fisher(), diff * diff).item()
+
+    def after_backward(self):
+        """
+        Adds the penalty gradient to the parameter gradients and, in the
+        running mode, accumulates the squared gradients into the Fisher.
+        Call it between `backward()` and `optimizer.step()`.
+        """
+        self._bind()
+        with th.no_grad():
+            if self.anchor is not None:
+                diff = self.flat - self.anchor.to(self.flat.dtype)
+                self.grad.addcmul_(self._current_fisher(), diff, value=2 * self.lambda_ewc)
+            if self.mode == 'running':
+                if self._fisher_sum is None:
+                    self._fisher_sum = self.fisher.to(self.flat.dtype, copy=True)
+                self._fisher_sum.addcmul_(self.grad, self.grad)
+
+    def end_epoch(self, n_steps):
+        """Averages the running Fisher over the epoch's steps and updates the anchor"""
+        if self.mode != 'running':
+            return
+        if self._fisher_sum is not None:
+            with th.no_grad():
+                self._fisher_sum.div_(n_steps)
+                self.fisher = self._fisher_sum.to(self.dtype, copy=True)
+            if self.dtype != self.flat.dtype:
+                self._fisher_sum = None
+        self.save_old_parameters()
+
+    def consolidate(self, loss_fn, batches):
+        """
+        Estimates the Fisher diagonal of the finished task from squared
+        batch gradients, merges it with earlier tasks and anchors the
+        current parameters. Does nothing in the running mode.
+        Args:
+           loss_fn (callable): Returns the loss of a batch
+           batches (iterable): Sample of training batches
+        """
+        if self.mode == 'running':
+            return
+        task_fisher = th.zeros_like(self.flat)
+        n_batches = 0
+        for batch in batches:
+            self._bind()
+            self.grad.zero_()
+            loss = loss_fn(batch)
+            loss.backward()
+            self._bind()
+            with th.no_grad():
+                task_fisher.addcmul_(self.grad, self.grad)
+            n_batches += 1
+        self.grad.zero_()
+        if n_batches == 0:
+            return
+        with th.no_grad():
+            fisher = self.fisher.to(self.flat.dtype).mul_(self.decay)
+            self.fisher = fisher.add_(task_fisher, alpha=1.0 / n_batches).to(self.dtype)
+        self.save_old_parameters()
+        myLogging.info(f'EWC: {self.mode} Fisher estimated on {n_batches} batches')
+
+    def state_dict(self):
+        return {'mode': self.mode, 'lambda_ewc': self.lambda_ewc, 'decay': self.decay,
+                'fisher': self.fisher, 'anchor': self.anchor}
+
+    def load_state_dict(self, state):
+        self._fisher_sum = None
+        self.fisher = state['fisher'].to(device=self.flat.device, dtype=self.dtype)
+        anchor = state['anchor']
+        self.anchor = None if anchor is None else anchor.to(device=self.flat.device, dtype=self.dtype)
@@ -0,0 +1,183 @@
+import json
+import numpy as np
+import torch as th
+import torch.nn as nn
+import torch.nn.functional as F
+from typing import Optional
+from src.mmap_store import load_arrays
+
+# This module must not import DGL or src.model_use, exported models are
+# loaded in environments without DGL.
+
+
+class SparseGAT(nn.Module):
+    """
+    Single-head graph attention layer computing the same function as DGL's
+    GATConv (no residual, explicit bias, no activation) in eval mode, with
+    the edge softmax done by scatter operations and the aggregation by a
+    sparse matrix product.
+    """
+
+    def __init__(self, in_features: int, out_features: int, negative_slope: float = 0.2):
+        super().__init__()
+        self.fc = nn.Linear(in_features, out_features, bias=False)
+        self.attn_l = nn.Parameter(th.zeros(out_features))
+        self.attn_r = nn.Parameter(th.zeros(out_features))
+        self.bias = nn.Parameter(th.zeros(out_features))
+        self.negative_slope = negative_slope
+
+    def forward(self, x: th.Tensor, src: th.Tensor, dst: th.Tensor, num_dst: int) -> th.Tensor:
+        feat_src = self.fc(x)
+        feat_dst = feat_src[:num_dst]
+        el = (feat_src * self.attn_l).sum(dim=-1)
+        er = (feat_dst * self.attn_r).sum(dim=-1)
+        e = F.leaky_relu(el[src] + er[dst], self.negative_slope)
+        e_max = th.full((num_dst,), float('-inf'), dtype=e.dtype, device=e.device)
+        e_max = e_max.scatter_reduce(0, dst, e, reduce='amax', include_self=True)
+        a = th.exp(e - e_max[dst])
+        denom = th.zeros(num_dst, dtype=a.dtype, device=a.device).index_add(0, dst, a)
+        a = a / denom[dst]
+        adj = th.sparse_coo_tensor(th.stack([dst, src]), a, (num_dst, x.shape[0]))
+        return th.sparse.mm(adj, feat_src) + self.bias
+
+
+class InferenceModel(nn.Module):
+    """
+    Inference-only LifelongGO model: the shared MLP block, the GAT layer and
+    the task head, without the ELEmbedding tables of `BaseModel`.
+    The input is a one-hop block: `features` of the source nodes where the
+    first `num_dst` rows are the output nodes, and the block edges `src` ->
+    `dst` as row indices.
+    """
+
+    def __init__(self, input_length: int, hidden_dim: int, embed_dim: int, nb_gos: int):
+        super().__init__()
+        self.linear = nn.Linear(input_length, hidden_dim)
+        self.layer_norm = nn.LayerNorm(hidden_dim)
+        self.conv = SparseGAT(hidden_dim, embed_dim)
+        self.head = nn.Linear(embed_dim, nb_gos)
+
+    def forward(self, features: th.Tensor, src: th.Tensor, dst: th.Tensor, num_dst: int) -> th.Tensor:
+        x = self.layer_norm(F.relu(self.linear(features)))
+        x = self.conv(x, src, dst, num_dst)
+        return th.sigmoid(self.head(x))
+
+
+# `TaskSpecificModel` checkpoint tensors used by `InferenceModel`
+CHECKPOINT_KEYS = (
+    'shared_model.shared_net1.linear.weight', 'shared_model.shared_net1.linear.bias',
+    'shared_model.shared_net1.layer_norm.weight', 'shared_model.shared_net1.layer_norm.bias',
+    'shared_model.shared_conv1.fc.weight', 'shared_model.shared_conv1.attn_l',
+    'shared_model.shared_conv1.attn_r', 'shared_model.shared_conv1.bias',
+    'task_net.0.weight', 'task_net.0.bias')
+
+
+def inference_state(state_dict):
+    """Maps a `TaskSpecificModel` state dict to `InferenceModel` parameters"""
+    conv = 'shared_model.shared_conv1.'
+    state = {
+        'linear.weight': state_dict['shared_model.shared_net1.linear.weight'],
+        'linear.bias': state_dict['shared_model.shared_net1.linear.bias'],
+        'layer_norm.weight': state_dict['shared_model.shared_net1.layer_norm.weight'],
+        'layer_norm.bias': state_dict['shared_model.shared_net1.layer_norm.bias'],
+        'conv.fc.weight': state_dict[conv + 'fc.weight'],
+        'conv.attn_l': state_dict[conv + 'attn_l'].reshape(-1),
+        'conv.attn_r': state_dict[conv + 'attn_r'].reshape(-1),
+        'head.weight': state_dict['task_net.0.weight'],
+        'head.bias': state_dict['task_net.0.bias'],
+    }
+    if conv + 'bias' in state_dict:
+        state['conv.bias'] = state_dict[conv + 'bias'].reshape(-1)
+    else:
+        state['conv.bias'] = th.zeros(state['conv.fc.weight'].shape[0])
+    return state
+
+
+def export_model(state_dict, out_file, meta=None):
+    """
+    Writes a TorchScript inference artifact for a trained model
+    Args:
+       state_dict (dict): `TaskSpecificModel` state dict
+       out_file (string): Output file
+       meta (dict): JSON-serializable metadata such as the predicted terms
+    """
+    state = inference_state(state_dict)
+    hidden_dim, input_length = state['linear.weight'].shape
+    nb_gos, embed_dim = state['head.weight'].shape
+    model = InferenceModel(input_length, hidden_dim, embed_dim, nb_gos)
+    model.load_state_dict(state)
+    model.eval()
+    scripted = th.jit.script(model)
+    meta = dict(meta or {})
+    meta.update({'input_length': input_length, 'nb_gos': nb_gos})
+    th.jit.save(scripted, out_file, _extra_files={'meta.json': json.dumps(meta)})
+    return scripted
+
+
+def load_exported(model_file):
+    """
+    Loads an exported artifact
+    Returns:
+       model (torch.jit.ScriptModule): Inference model
+       meta (dict): Stored metadata
+    """
+    files = {'meta.json': ''}
+    model = th.jit.load(model_file, map_location='cpu', _extra_files=files)
+    return model, json.loads(files['meta.json'])
+
+
+def block_inputs(src, dst, nids):
+    """
+    Builds the one-hop block of the output nodes from whole-graph edges
+    Returns:
+       src_nodes (numpy.ndarray): Graph ids of the block source nodes, the
+           output nodes first
+       block_src, block_dst (numpy.ndarray): Block edges as row indices
+    """
+    nids = np.asarray(nids, dtype=np.int64)
+    dst_pos = {int(n): i for i, n in enumerate(nids)}
+    edges = np.flatnonzero(np.isin(dst, nids))
+    e_src = np.asarray(src[edges], dtype=np.int64)
+    e_dst = np.asarray(dst[edges], dtype=np.int64)
+    others = np.setdiff1d(np.unique(e_src), nids)
+    src_nodes = np.concatenate([nids, others])
+    position = dict(dst_pos)
+    for i, n in enumerate(others.tolist()):
+        position[n] = len(nids) + i
+    block_src = np.array([position[n] for n in e_src.tolist()], dtype=np.int64)
+    block_dst = np.array([dst_pos[n] for n in e_dst.tolist()], dtype=np.int64)
+    return src_nodes, block_src, block_dst
+
+
+class ExportedPredictor(object):
+    """
+    Predicts graph nodes with an exported model and the edges and features
+    of a compiled training bundle, without DGL
+    Args:
+        model_file (string): Exported model
+        bundle_file (string): Training bundle of the model's graph
+    """
+
+    def __init__(self, model_file, bundle_file):
+        self.model, self.meta = load_exported(model_file)
+        _, arrays = load_arrays(bundle_file)
+        self.src = arrays['src']
+        self.dst = arrays['dst']
+        self.feat = arrays['feat']
+
+    def predict(self, nids, overrides: Optional[dict] = None):
+        """
+        Args:
+           nids (list): Output node ids
+           overrides (dict): Node id to feature vector replacing its stored features
+        Returns:
+           preds (numpy.ndarray): Scores (len(nids) x n_terms)
+        """
+        src_nodes, block_src, block_dst = block_inputs(self.src, self.dst, nids)
+        features = np.array(self.feat[src_nodes], dtype=np.float32)
+        for node, vec in (overrides or {}).items():
+            features[src_nodes == node] = vec
+        with th.no_grad():
+            preds = self.model(
+                th.from_numpy(features), th.from_numpy(block_src), th.from_numpy(block_dst), len(nids))
+        return preds.numpy()
@@ -0,0 +1,141 @@
+import os
+import numpy as np
+from src.mmap_store import save_arrays, load_arrays
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+
+class FeatureStore(object):
+    """
+    Directory of memory-mapped feature matrices, one file per feature type
+    (esm, esmS, pdb2, ...). Each file holds a contiguous float32 or float16
+    matrix with one row per protein and the protein ids of its rows, so a
+    split's features are gathered with one fancy-index operation instead of
+    converting list-valued DataFrame columns row by row.
+    Args:
+        root (string): Store directory, usually data_root/features
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._features = {}
+
+    def path(self, name):
+        return f'{self.root}/{name}.arr'
+
+    def has(self, name):
+        return name in self._features or os.path.exists(self.path(name))
+
+    def write(self, name, proteins, data, dtype=np.float32):
+        """
+        Stores a feature matrix
+        Args:
+           name (string): Feature type
+           proteins (list): Protein ids of the rows
+           data (array-like): Matrix (n_proteins x dim) or a list of vectors
+           dtype: Storage type, float32 or float16
+        """
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        if hasattr(data, 'detach'):
+            data = data.detach().cpu().numpy()
+        data = np.asarray(data, dtype=dtype)
+        proteins = np.asarray(list(proteins), dtype=str)
+        if data.ndim != 2 or len(data) != len(proteins):
+            raise ValueError(f'Feature {name}: expected {len(proteins)} rows, got shape {data.shape}')
+        order = np.argsort(proteins, kind='stable')
+        save_arrays(self.path(name), {
+            'data': data, 'proteins': proteins, 'order': order, 'sorted_proteins': proteins[order]},
+            {'name': name, 'dim': int(data.shape[1])})
+        self._features.pop(name, None)
+        myLogging.info(f'Feature store: saved {name} {data.shape} {data.dtype} to {self.path(name)}')
+
+    def update(self, name, proteins, data):
+        """
+        Adds rows for proteins that are not yet stored, keeping existing rows
+        and the stored dtype
+        """
+        if not self.has(name):
+            self.write(name, proteins, data)
+            return
+        proteins = np.asarray(list(proteins), dtype=str)
+        known = set(self.proteins(name).tolist())
+        new = np.array([p not in known for p in proteins.tolist()], dtype=bool)
+        if not new.any():
+            return
+        old = self.matrix(name)
+        data = np.concatenate([np.asarray(old), np.asarray(data, dtype=old.dtype)[new]])
+        proteins = np.concatenate([np.asarray(self.proteins(name)).astype(str), proteins[new]])
+        self.write(name, proteins, data, old.dtype)
+
+    def update_from_frame(self, name, df, column=None):
+        """Adds a list-valued DataFrame column (one vector per protein) to the store"""
+        column = column or name
+        data = np.zeros((len(df), len(df[column].iloc[0])), dtype=np.float32)
+        for i, vec in enumerate(df[column].values):
+            data[i] = vec
+        self.update(name, df['proteins'].values, data)
+
+    def _load(self, name):
+        if name not in self._features:
+            if not os.path.exists(self.path(name)):
+                raise KeyError(f'Feature {name} is not in the store {self.root}')
+            _, arrays = load_arrays(self.path(name))
+            self._features[name] = arrays
+        return self._features[name]
+
+    def dim(self, name):
+        return self._load(name)['data'].shape[1]
+
+    def proteins(self, name):
+        return self._load(name)['proteins']
+
+    def matrix(self, name):
+        """Returns the memory-mapped matrix of a feature"""
+        return self._load(name)['data']
+
+    def rows(self, name, proteins):
+        """
+        Finds the rows of the given proteins
+        Raises:
+           KeyError: If a protein has no stored feature vector
+        """
+        arrays = self._load(name)
+        ids, order = arrays['proteins'], arrays['order']
+        query = np.asarray(list(proteins), dtype=str)
+        if len(order) == 0:
+            rows = np.zeros(len(query), dtype=np.int64)
+            missing = np.ones(len(query), dtype=bool)
+        else:
+            pos = np.minimum(np.searchsorted(arrays['sorted_proteins'], query), len(order) - 1)
+            rows = np.asarray(order)[pos]
+            missing = ids[rows] != query
+        if missing.any():
+            raise KeyError(f'Feature {name}: {int(missing.sum())} proteins are missing, e.g. {query[missing][0]}')
+        return rows
+
+    def gather(self, name, proteins):
+        """
+        Returns the feature matrix of the given proteins. A contiguous run of
+        rows is returned as a view of the memory map without copying.
+        """
+        rows = self.rows(name, proteins)
+        data = self.matrix(name)
+        if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows) and np.all(np.diff(rows) == 1):
+            return data[rows[0]:rows[-1] + 1]
+        return data[rows]
+
+    def gather_many(self, names, proteins, out=None):
+        """
+        Concatenates several features of the given proteins into one float32
+        matrix, writing each feature into its block of a preallocated array
+        """
+        dims = [self.dim(name) for name in names]
+        if out is None:
+            out = np.empty((len(proteins), sum(dims)), dtype=np.float32)
+        start = 0
+        for name, dim in zip(names, dims):
+            out[:, start:start + dim] = self.gather(name, proteins)
+            start += dim
+        return out
@@ -0,0 +1,133 @@
+import numpy as np
+from src.feature_store import FeatureStore
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+
+class FeatureSource(object):
+    """
+    A named block of model input features.
+
+    Args:
+        name (string): Source name used in feature column strings ('esm', 'pdb2', ...)
+        dim (int): Number of features, None when it depends on the data or
+            on a vocabulary
+        column (string): DataFrame column holding the values, defaults to name
+        multi_hot (boolean): The column holds lists of ids which are encoded
+            with the vocabulary passed as `features_dict`
+        stored (boolean): The features can be kept in the feature store
+    """
+
+    def __init__(self, name, dim=None, column=None, multi_hot=False, stored=False):
+        self.name = name
+        self.dim = dim
+        self.column = column or name
+        self.multi_hot = multi_hot
+        self.stored = stored
+
+    def length(self, df=None, features_dict=None, store=None):
+        if self.multi_hot:
+            return len(features_dict)
+        if self.dim is not None:
+            return self.dim
+        if store is not None and self.stored and store.has(self.name):
+            return store.dim(self.name)
+        return len(df[self.column].iloc[0])
+
+    def fill(self, df, out, features_dict=None, store=None):
+        """Writes the features of the proteins in `df` into the block `out`"""
+        if self.multi_hot:
+            for i, ids in enumerate(df[self.column].values):
+                for feat in ids:
+                    if feat in features_dict:
+                        out[i, features_dict[feat]] = 1
+        elif store is not None and self.stored and (store.has(self.name) or self.column in df.columns):
+            proteins = df['proteins'].values
+            try:
+                store.rows(self.name, proteins)
+            except KeyError:
+                if self.column not in df.columns:
+                    raise
+                myLogging.info(f'Adding {self.name} features to {store.root}')
+                store.update_from_frame(self.name, df, self.column)
+            out[:] = store.gather(self.name, proteins)
+        else:
+            values = df[self.column].values
+            if len(values) > 0:
+                out[:] = np.stack(values).astype(np.float32, copy=False)
+
+
+FEATURE_SOURCES = {}
+
+
+def register_feature_source(source):
+    FEATURE_SOURCES[source.name] = source
+    return source
+
+
+register_feature_source(FeatureSource('esm', 2560, stored=True))
+register_feature_source(FeatureSource('esmS', 1280, stored=True))
+register_feature_source(FeatureSource('pdb2', 20, stored=True))
+register_feature_source(FeatureSource('pdb', stored=True))
+register_feature_source(FeatureSource('ssa'))
+register_feature_source(FeatureSource('unir', column='UNIREPEB'))
+register_feature_source(FeatureSource('mf_preds'))
+register_feature_source(FeatureSource('interpros', multi_hot=True))
+register_feature_source(FeatureSource('prop_annotations', multi_hot=True))
+
+# Input feature sources of every model variant
+MODEL_FEATURES = {
+    'LifeLongGo_esm_pdb2': ['esm', 'pdb2'],
+    'LifeLongGo_esm': ['esm'],
+    'LifeLongGo_pdb2': ['pdb2'],
+    'LifeLongGo_esmS': ['esmS'],
+    'LifeLongGo_esmS_pdb2': ['esmS', 'pdb2'],
+}
+
+# Input feature sources of the precomputed-aggregation MLP variants (train_sgc.py)
+SGC_MODEL_FEATURES = {
+    'LifeLongGo_esm_pdb2_sgc': ['esm', 'pdb2'],
+}
+
+
+def parse_features(features_column):
+    """
+    Returns the feature source names of a features column string such as
+    'esm_pdb2' or 'ssa_unir_esmS'
+    """
+    if features_column in FEATURE_SOURCES:
+        return [features_column]
+    names = features_column.split('_')
+    for name in names:
+        if name not in FEATURE_SOURCES:
+            raise ValueError(f'Unknown feature source {name} in {features_column}')
+    return names
+
+
+def features_dim(names, df=None, features_dict=None, store=None):
+    """Total input length of a list of feature sources"""
+    return sum(FEATURE_SOURCES[name].length(df, features_dict, store) for name in names)
+
+
+def assemble_features(df, names, features_dict=None, data_root=None, out=None):
+    """
+    Builds the (n_proteins x features_length) float32 input matrix by writing
+    each source into its block of a preallocated array
+    Args:
+       df (pandas.DataFrame): Proteins
+       names (list): Feature source names
+       features_dict (dict): Vocabulary for multi-hot sources
+       data_root (string): Data folder with the feature store, optional
+    Returns:
+       data (numpy.ndarray): Input features
+    """
+    store = FeatureStore(f'{data_root}/features') if data_root is not None else None
+    dims = [FEATURE_SOURCES[name].length(df, features_dict, store) for name in names]
+    if out is None:
+        out = np.zeros((len(df), sum(dims)), dtype=np.float32)
+    start = 0
+    for name, dim in zip(names, dims):
+        FEATURE_SOURCES[name].fill(df, out[:, start:start + dim], features_dict, store)
+        start += dim
+    return out
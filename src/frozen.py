@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+from src.mmap_store import save_arrays, load_arrays, read_meta
+from src.checkpoint import state_digest
+from src.metrics import StreamingMetrics
+from src.torch_utils import FastTensorDataLoader
+from src.training import evaluate_chunks, train_epoch, ModelSelection
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+EMBEDDING_CACHE_VERSION = 1
+
+
+def set_frozen(module, frozen=True):
+    """Freezes (or unfreezes) the parameters of a module"""
+    for p in module.parameters():
+        p.requires_grad_(not frozen)
+
+
+def shared_embeddings(shared_model, graph, nids, filename, chunk_size=16384):
+    """
+    Returns the shared model embeddings of graph nodes from full-graph
+    inference, cached in a memory-mappable file. The cache is rebuilt when
+    the shared model parameters or the nodes change.
+    Args:
+       shared_model (SharedCoreDeepGATModel): Frozen shared model
+       graph (DGLGraph): Whole graph with 'feat' node data
+       nids (Tensor): Node ids, one embedding row per id in this order
+       filename (string): Cache file
+       chunk_size (int): Output nodes per inference call
+    Returns:
+       embeddings (numpy.memmap): (len(nids) x embed_dim) matrix mapped
+           copy-on-write, so tensors can wrap it without copying
+    """
+    digest = state_digest({k: v.detach().cpu() for k, v in shared_model.state_dict().items()})
+    nodes_digest = state_digest({'nids': nids.detach().cpu()})
+    meta = read_meta(filename) if os.path.exists(filename) else None
+    if (meta is not None and meta.get('version') == EMBEDDING_CACHE_VERSION
+            and meta.get('shared_model') == digest and meta.get('nids') == nodes_digest):
+        myLogging.info(f'Loading cached embeddings {filename}')
+        return load_arrays(filename, mode='c')[1]['embeddings']
+    shared_model.eval()
+    chunks = []
+    with th.no_grad():
+        for i in range(0, len(nids), chunk_size):
+            chunks.append(shared_model.inference(graph, nids[i:i + chunk_size]).cpu().numpy())
+    embeddings = np.concatenate(chunks)
+    save_arrays(filename, {'embeddings': embeddings}, {
+        'version': EMBEDDING_CACHE_VERSION, 'shared_model': digest, 'nids': nodes_digest})
+    myLogging.info(f'Cached {embeddings.shape} shared embeddings - {filename}')
+    return load_arrays(filename, mode='c')[1]['embeddings']
+
+
+def fit_head(head, train_x, train_y, valid_x, valid_y, epochs, batch_size, eval_batch_size,
+             early_stop='loss', save_best=None, lr=1e-3, patience=15):
+    """
+    Trains a task head on fixed shared embeddings with large batches
+    Args:
+       head (nn.Module): Task head (embeddings -> scores)
+       train_x, train_y (Tensor): Training embeddings and labels
+       valid_x, valid_y (Tensor): Validation embeddings and labels
+       epochs (int): Maximum number of epochs
+       batch_size (int): Training batch size
+       eval_batch_size (int): Batch size of the validation loss, the
+           training batch size of the full model so that losses compare
+       early_stop (string): Model selection metric, 'loss' or 'fmax'
+       save_best (callable): Called whenever the validation score improves
+       lr (float): Adam learning rate
+    Returns:
+       best_score (float): Best validation score (loss or -Fmax)
+    """
+    optimizer = th.optim.Adam(head.parameters(), lr=lr)
+    train_loader = FastTensorDataLoader(train_x, train_y, batch_size=batch_size, shuffle=True)
+    selection = ModelSelection(early_stop, save_best, patience=patience, verbose=False)
+    for epoch in range(epochs):
+        head.train()
+        train_loss = train_epoch(
+            train_loader, lambda batch: F.binary_cross_entropy(head(batch[0]), batch[1]), optimizer)
+        head.eval()
+        valid_metrics = StreamingMetrics()
+        with th.no_grad():
+            chunks = ((head(valid_x[i:i + eval_batch_size]), valid_y[i:i + eval_batch_size])
+                      for i in range(0, len(valid_x), eval_batch_size))
+            valid_loss = evaluate_chunks(chunks, eval_batch_size, valid_metrics)
+        valid_fmax, _ = valid_metrics.fmax()
+        myLogging.info(f'Head epoch {epoch}: Loss - {train_loss}, Valid loss - {valid_loss}, '
+                       f'Fmax - {valid_fmax:0.3f}')
+        if selection.step(head, valid_loss, valid_fmax):
+            break
+    return selection.best_score
@@ -0,0 +1,316 @@
+import os
+import numpy as np
+from src.mmap_store import file_sha256, save_arrays, load_arrays, read_meta
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+INDEX_VERSION = 2
+
+
+def parse_obo(filename, with_rels=False):
+    """
+    Parses an OBO file into a list of term dictionaries in file order
+    Args:
+       filename (string): Path to go.obo
+       with_rels (boolean): Treat all relationship lines as is_a edges
+    Returns:
+       terms (list): List of dicts with id, name, namespace, is_a, alt_ids, is_obsolete
+    """
+    terms = list()
+    obj = None
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line == '[Term]':
+                if obj is not None:
+                    terms.append(obj)
+                obj = dict()
+                obj['is_a'] = list()
+                obj['part_of'] = list()
+                obj['regulates'] = list()
+                obj['alt_ids'] = list()
+                obj['is_obsolete'] = False
+                continue
+            elif line == '[Typedef]':
+                if obj is not None:
+                    terms.append(obj)
+                obj = None
+            else:
+                if obj is None:
+                    continue
+                l = line.split(": ")
+                if l[0] == 'id':
+                    obj['id'] = l[1]
+                elif l[0] == 'alt_id':
+                    obj['alt_ids'].append(l[1])
+                elif l[0] == 'namespace':
+                    obj['namespace'] = l[1]
+                elif l[0] == 'is_a':
+                    obj['is_a'].append(l[1].split(' ! ')[0])
+                elif with_rels and l[0] == 'relationship':
+                    it = l[1].split()
+                    # add all1.csv types of relationships
+                    obj['is_a'].append(it[1])
+                elif l[0] == 'name':
+                    obj['name'] = l[1]
+                elif l[0] == 'is_obsolete' and l[1] == 'true':
+                    obj['is_obsolete'] = True
+        if obj is not None:
+            terms.append(obj)
+    return terms
+
+
+def _csr(rows, n_rows):
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(r) for r in rows])
+    indices = np.fromiter(
+        (x for r in rows for x in r), dtype=np.int32, count=int(indptr[-1]))
+    return indptr, indices
+
+
+def _closure_order(n_keys, roots, children):
+    """Depth-first preorder of keys so that a term's lineage gets nearby bit positions"""
+    order = []
+    visited = np.zeros(n_keys, dtype=bool)
+    for root in list(roots) + list(range(n_keys)):
+        if visited[root]:
+            continue
+        visited[root] = True
+        stack = [root]
+        while stack:
+            k = stack.pop()
+            order.append(k)
+            for ch in reversed(children[k]):
+                if not visited[ch]:
+                    visited[ch] = True
+                    stack.append(ch)
+    return np.array(order, dtype=np.int32)
+
+
+def compile_closure(key_parents, key_children):
+    """
+    Computes the transitive is_a closure of every key as sparse bitsets.
+
+    Bit positions follow a depth-first order of the hierarchy, so each
+    ancestor set occupies only a few 64-bit words. Row k of the CSR arrays
+    holds (block, word) pairs with the bits of all ancestors of k
+    (k included); bit b of block w stands for key `bit_key[w * 64 + b]`.
+    Args:
+       key_parents (list): Parent key ids of every key
+       key_children (list): Child key ids of every key
+    Returns:
+       arrays (dict): bit_key, anc_indptr, anc_blocks and anc_words arrays
+    """
+    n_keys = len(key_parents)
+    roots = [k for k in range(n_keys) if len(key_parents[k]) == 0]
+    bit_key = _closure_order(n_keys, roots, key_children)
+    rank = np.empty(n_keys, dtype=np.int64)
+    rank[bit_key] = np.arange(n_keys)
+    rows = []
+    ranks = []
+    for k in range(n_keys):
+        seen = {k}
+        stack = [k]
+        while stack:
+            t = stack.pop()
+            for p in key_parents[t]:
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+        rows.append(np.full(len(seen), k, dtype=np.int64))
+        ranks.append(rank[list(seen)])
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    ranks = np.concatenate(ranks) if ranks else np.zeros(0, dtype=np.int64)
+    blocks = ranks >> 6
+    words = np.left_shift(np.uint64(1), (ranks & 63).astype(np.uint64))
+    code = rows * (n_keys // 64 + 1) + blocks
+    order = np.argsort(code, kind='stable')
+    code, words = code[order], words[order]
+    uniq, first = np.unique(code, return_index=True)
+    if len(uniq) > 0:
+        words = np.bitwise_or.reduceat(words, first)
+    else:
+        words = np.zeros(0, dtype=np.uint64)
+    owner = uniq // (n_keys // 64 + 1)
+    indptr = np.zeros(n_keys + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(owner, minlength=n_keys))
+    return {
+        'bit_key': bit_key,
+        'anc_indptr': indptr,
+        'anc_blocks': (uniq % (n_keys // 64 + 1)).astype(np.int32),
+        'anc_words': words.astype('<u8'),
+    }
+
+
+def compile_terms(terms):
+    """
+    Converts parsed OBO terms into flat arrays.
+
+    Every key that `Ontology.ont` used to contain (non-obsolete term ids and
+    all alt_ids) gets an integer id. Keys point to a term record which holds
+    the namespace, name, parents and children, so alt_ids share their
+    primary term's data exactly like the shared dicts did.
+    Returns:
+       meta (dict): Namespaces and sizes
+       arrays (dict): Arrays for `OntologyIndex`
+    """
+    records = {}
+    for i, obj in enumerate(terms):
+        records[obj['id']] = i
+    key_term = dict(records)
+    for term_id in list(records.keys()):
+        i = records[term_id]
+        for t_id in terms[i]['alt_ids']:
+            key_term[t_id] = i
+        if terms[i]['is_obsolete']:
+            del key_term[term_id]
+    keys = list(key_term.keys())
+    key_index = {k: i for i, k in enumerate(keys)}
+
+    namespaces = sorted(set(obj['namespace'] for obj in terms if 'namespace' in obj))
+    ns_index = {ns: i for i, ns in enumerate(namespaces)}
+    n_terms = len(terms)
+
+    parents = [[key_index[p] for p in obj['is_a'] if p in key_index] for obj in terms]
+    children = [set() for _ in range(n_terms)]
+    for k, term in key_term.items():
+        for p_id in terms[term]['is_a']:
+            if p_id in key_term:
+                children[key_term[p_id]].add(key_index[k])
+    alt_ids = [[key_index[a] for a in obj['alt_ids'] if a in key_index] for obj in terms]
+
+    names = [obj.get('name', '').encode('utf-8') for obj in terms]
+    name_offsets = np.zeros(n_terms + 1, dtype=np.int64)
+    name_offsets[1:] = np.cumsum([len(n) for n in names])
+    max_len = max([len(k) for k in keys] + [len(obj['id']) for obj in terms] + [1])
+
+    arrays = {
+        'keys': np.array(keys, dtype=f'U{max_len}'),
+        'key_term': np.array([key_term[k] for k in keys], dtype=np.int32),
+        'term_ids': np.array([obj['id'] for obj in terms], dtype=f'U{max_len}'),
+        'namespace': np.array(
+            [ns_index.get(obj.get('namespace'), -1) for obj in terms], dtype=np.int8),
+        'is_obsolete': np.array([obj['is_obsolete'] for obj in terms], dtype=bool),
+        'names': np.frombuffer(b''.join(names), dtype=np.uint8),
+        'name_offsets': name_offsets,
+    }
+    arrays['parent_indptr'], arrays['parent_indices'] = _csr(parents, n_terms)
+    arrays['child_indptr'], arrays['child_indices'] = _csr(
+        [sorted(c) for c in children], n_terms)
+    arrays['alt_indptr'], arrays['alt_indices'] = _csr(alt_ids, n_terms)
+    key_terms = [key_term[k] for k in keys]
+    arrays.update(compile_closure(
+        [parents[t] for t in key_terms],
+        [sorted(children[t]) for t in key_terms]))
+    meta = {'namespaces': namespaces, 'n_keys': len(keys), 'n_terms': n_terms}
+    return meta, arrays
+
+
+class OntologyIndex(object):
+    """
+    Compiled, memory-mapped ontology with integer term ids.
+
+    Behaves as a read-only mapping from GO ids (including alt_ids) to term
+    dictionaries so that code written against the old `Ontology.ont` dict
+    keeps working, while `Ontology` queries go through the integer arrays.
+    """
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.namespaces = meta['namespaces']
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+        self.key_list = self.keys.tolist()
+        self.key_index = {k: i for i, k in enumerate(self.key_list)}
+
+    @classmethod
+    def load(cls, filename, with_rels=False, index_file=None):
+        """
+        Loads the compiled index for an OBO file, (re)building it when it
+        is missing, has an old format or the OBO content hash changed.
+        Args:
+           filename (string): Path to go.obo
+           with_rels (boolean): Treat relationships as is_a edges
+           index_file (string): Compiled file location, defaults to next to go.obo
+        """
+        if index_file is None:
+            suffix = '_rels' if with_rels else ''
+            index_file = f'{os.path.splitext(filename)[0]}{suffix}.goidx'
+        digest = file_sha256(filename)
+        meta = read_meta(index_file) if os.path.exists(index_file) else None
+        if (meta is None or meta.get('version') != INDEX_VERSION
+                or meta.get('sha256') != digest or meta.get('with_rels') != with_rels):
+            myLogging.info(f'Compiling ontology index {index_file}')
+            meta, arrays = compile_terms(parse_obo(filename, with_rels))
+            meta.update({'version': INDEX_VERSION, 'sha256': digest, 'with_rels': with_rels})
+            try:
+                save_arrays(index_file, arrays, meta)
+            except OSError as e:
+                myLogging.info(f'Could not write ontology index {index_file}: {e}')
+                return cls(meta, arrays)
+        meta, arrays = load_arrays(index_file)
+        return cls(meta, arrays)
+
+    def index_of(self, term_id):
+        """Returns the integer id of a GO id or None"""
+        return self.key_index.get(term_id)
+
+    def term_of(self, key):
+        return int(self.key_term[key])
+
+    def parent_keys(self, key):
+        t = self.key_term[key]
+        return self.parent_indices[self.parent_indptr[t]:self.parent_indptr[t + 1]]
+
+    def child_keys(self, key):
+        t = self.key_term[key]
+        return self.child_indices[self.child_indptr[t]:self.child_indptr[t + 1]]
+
+    def namespace_of(self, key):
+        ns = self.namespace[self.key_term[key]]
+        if ns < 0:
+            raise KeyError('namespace')
+        return self.namespaces[ns]
+
+    def name_of(self, key):
+        t = self.key_term[key]
+        return self.names[self.name_offsets[t]:self.name_offsets[t + 1]].tobytes().decode('utf-8')
+
+    def namespace_keys(self, namespace):
+        """Returns integer ids of all keys in a namespace"""
+        if namespace not in self.namespaces:
+            return np.zeros(0, dtype=np.int64)
+        code = self.namespaces.index(namespace)
+        return np.flatnonzero(np.asarray(self.namespace)[self.key_term] == code)
+
+    def __contains__(self, term_id):
+        return term_id in self.key_index
+
+    def __len__(self):
+        return len(self.key_index)
+
+    def __iter__(self):
+        return iter(self.key_index)
+
+    def __getitem__(self, term_id):
+        key = self.key_index[term_id]
+        t = self.key_term[key]
+        obj = {
+            'id': str(self.term_ids[t]),
+            'name': self.name_of(key),
+            'is_a': [self.key_list[k] for k in self.parent_keys(key)],
+            'alt_ids': [self.key_list[k] for k in
+                        self.alt_indices[self.alt_indptr[t]:self.alt_indptr[t + 1]]],
+            'is_obsolete': bool(self.is_obsolete[t]),
+            'children': set(self.key_list[k] for k in self.child_keys(key)),
+        }
+        if self.namespace[t] >= 0:
+            obj['namespace'] = self.namespaces[self.namespace[t]]
+        return obj
+
+    def items(self):
+        for term_id in self.key_index:
+            yield term_id, self[term_id]
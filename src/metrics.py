@@ -5,6 +5,8 @@ sys.path.append(base_dir)
 import numpy as np
 from sklearn.metrics import roc_curve, auc, matthews_corrcoef
 import math
+import hashlib
+import multiprocessing as mp
 import pandas as pd
 from src.utils import FUNC_DICT, Ontology, NAMESPACES
 
@@ -12,83 +14,488 @@ from src.logging import MyLog
 
 myLogging = MyLog().logger
 
+# numpy.trapz was renamed to numpy.trapezoid in NumPy 2.0
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
 
-def compute_metrics(test_df, go, terms_dict, terms, ont, eval_preds):
+
+def compute_metrics(test_df, go, terms_dict, terms, ont, eval_preds, exact=False):
+    labels = label_matrix(test_df, terms_dict)
+    evaluator = ProteinCentricEvaluator(
+        go, terms, ont, test_df['prop_annotations'].values, test_df['exp_annotations'].values)
+    return metrics_from(labels, evaluator, eval_preds, exact)
+
+
+def label_matrix(test_df, terms_dict):
     labels = np.zeros((len(test_df), len(terms_dict)), dtype=np.float32)
     for i, row in enumerate(test_df.itertuples()):
         for go_id in row.prop_annotations:
             if go_id in terms_dict:
                 labels[i, terms_dict[go_id]] = 1
+    return labels
 
-    total_n = 0
-    total_sum = 0
-    for go_id, i in terms_dict.items():
-        pos_n = np.sum(labels[:, i])
-        if pos_n > 0 and pos_n < len(test_df):
-            total_n += 1
-            roc_auc = compute_roc(labels[:, i], eval_preds[:, i])
-            total_sum += roc_auc
 
-    avg_auc = total_sum / total_n
+def metrics_from(labels, evaluator, eval_preds, exact=False):
+    """
+    Computes the metrics of `compute_metrics` from a prepared label matrix
+    and protein-centric evaluator
+    """
+    avg_auc = term_centric_metrics(labels, eval_preds)['avg_auc']
 
     myLogging.info('Computing Fmax')
-    fmax = 0.0
-    tmax = 0.0
-    wfmax = 0.0
-    wtmax = 0.0
-    avgic = 0.0
-    precisions = []
-    recalls = []
+    curves = evaluator.curves_exact(eval_preds) if exact else evaluator.curves(eval_preds)
+    fmax, smin, tmax, wfmax, wtmax, aupr, avgic, fmax_spec_match = summarize_curves(curves)
+
+    return fmax, smin, tmax, wfmax, wtmax, avg_auc, aupr, avgic, fmax_spec_match
+
+
+def _seqsum(x):
+    """Sums rows in order (like a Python accumulation loop) instead of pairwise"""
+    if len(x) == 0:
+        return np.zeros(x.shape[1:], dtype=np.float64)
+    return np.cumsum(x, axis=0)[-1]
+
+
+def _reverse_cumsum(x):
+    return np.cumsum(x[:, ::-1], axis=1)[:, ::-1]
+
+
+class ProteinCentricEvaluator(object):
+    """
+    Computes CAFA protein-centric metrics (precision, recall, RU, MI and
+    their IC-weighted variants) for all thresholds in one pass.
+
+    Real annotations are kept as a sparse (CSR) label matrix over the
+    prediction columns which belong to the sub-ontology, together with IC
+    weights. Every score is mapped once to its threshold bin and per-protein
+    histograms are turned into counts for all thresholds with cumulative
+    sums. The results match `evaluate_annotations` on every threshold up to
+    the floating-point summation order (differences of about 1e-15).
+    Args:
+        go (utils.Ontology): Ontology with calculated IC
+        terms (list): GO ids of prediction columns
+        ont (string): Sub-ontology (mf, bp or cc)
+        real_annots (list): Propagated annotations of every test protein
+        spec_annots (list): Experimental annotations of every test protein
+    """
+
+    def __init__(self, go, terms, ont, real_annots, spec_annots=None):
+        go_set = go.get_namespace_terms(NAMESPACES[ont])
+        go_set.discard(FUNC_DICT[ont])
+        self.n_terms = len(terms)
+        self.columns = np.array([j for j, t in enumerate(terms) if t in go_set], dtype=np.int64)
+        col_pos = {terms[j]: k for k, j in enumerate(self.columns)}
+        self.nic = np.array([go.get_norm_ic(terms[j]) for j in self.columns], dtype=np.float64)
+        self.ic = np.array([go.get_ic(terms[j]) for j in self.columns], dtype=np.float64)
+        n = len(real_annots)
+        self.n_proteins = n
+        self.real_n = np.zeros(n, dtype=np.int64)
+        self.real_nic = np.zeros(n, dtype=np.float64)
+        self.real_ic = np.zeros(n, dtype=np.float64)
+        label_rows = []
+        for i, annots in enumerate(real_annots):
+            annots = set(filter(lambda y: y in go_set, annots))
+            self.real_n[i] = len(annots)
+            self.real_nic[i] = sum(go.get_norm_ic(go_id) for go_id in annots)
+            self.real_ic[i] = sum(go.get_ic(go_id) for go_id in annots)
+            label_rows.append(sorted(col_pos[go_id] for go_id in annots if go_id in col_pos))
+        self.label_indptr, self.label_indices = self._csr(label_rows)
+        spec_rows = []
+        for i in range(n):
+            annots = spec_annots[i] if spec_annots is not None else []
+            spec_rows.append(sorted(set(col_pos[go_id] for go_id in annots if go_id in col_pos)))
+        self.spec_indptr, self.spec_indices = self._csr(spec_rows)
+
+    @staticmethod
+    def _csr(rows):
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(r) for r in rows])
+        indices = np.fromiter((x for r in rows for x in r), dtype=np.int64, count=int(indptr[-1]))
+        return indptr, indices
+
+    def _entries(self, indptr, indices, scores):
+        rows = np.repeat(np.arange(self.n_proteins), np.diff(indptr))
+        return rows, indices, scores[rows, indices]
+
+    def curves(self, eval_preds, thresholds=None, chunk_size=2 ** 22):
+        """
+        Protein-centric curves on a fixed threshold grid
+        Args:
+           eval_preds (numpy.ndarray): Scores (n_proteins x n_terms)
+           thresholds (list): Increasing thresholds, defaults to 0.00, 0.01, ..., 1.00
+           chunk_size (int): Approximate number of scores binned at once
+        Returns:
+           curves (dict): Per-threshold arrays
+        """
+        if thresholds is None:
+            thresholds = [t / 100.0 for t in range(0, 101)]
+        thr = np.array(thresholds, dtype=np.float64)
+        eval_preds = np.asarray(eval_preds)
+        if np.issubdtype(eval_preds.dtype, np.floating):
+            # Same precision as comparing the score array with a Python float
+            thr = thr.astype(eval_preds.dtype)
+        n, k = self.n_proteins, len(thr)
+        scores = eval_preds[:, self.columns]
+
+        def bins(x):
+            b = np.searchsorted(thr, x, side='right') - 1
+            b[np.isnan(x)] = -1
+            return b
+
+        def histogram(rows, b, weights=None):
+            keep = b >= 0
+            flat = rows[keep] * k + b[keep]
+            w = None if weights is None else weights[keep]
+            return np.bincount(flat, weights=w, minlength=n * k).reshape(n, k)
+
+        all_cnt = np.zeros((n, k), dtype=np.int64)
+        all_nic = np.zeros((n, k), dtype=np.float64)
+        all_ic = np.zeros((n, k), dtype=np.float64)
+        step = max(1, chunk_size // max(1, len(self.columns)))
+        for s in range(0, n, step):
+            chunk = scores[s:s + step]
+            rows = np.repeat(np.arange(s, s + len(chunk)), chunk.shape[1])
+            b = bins(chunk.ravel())
+            cols = np.tile(np.arange(chunk.shape[1]), len(chunk))
+            all_cnt += histogram(rows, b)
+            all_nic += histogram(rows, b, self.nic[cols])
+            all_ic += histogram(rows, b, self.ic[cols])
+
+        rows, cols, x = self._entries(self.label_indptr, self.label_indices, scores)
+        b = bins(x)
+        pos_cnt = _reverse_cumsum(histogram(rows, b))
+        pos_nic = _reverse_cumsum(histogram(rows, b, self.nic[cols]))
+        pos_ic = _reverse_cumsum(histogram(rows, b, self.ic[cols]))
+        rows, _, x = self._entries(self.spec_indptr, self.spec_indices, scores)
+        spec = _reverse_cumsum(histogram(rows, bins(x))).sum(axis=0)
+        all_cnt = _reverse_cumsum(all_cnt)
+        all_nic = _reverse_cumsum(all_nic)
+        all_ic = _reverse_cumsum(all_ic)
+
+        has_real = (self.real_n > 0)[:, None]
+        pred_ok = has_real & (all_cnt > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            recall = np.where(has_real, pos_cnt / (1.0 * self.real_n[:, None]), 0.0)
+            wrecall = np.where(
+                has_real & (self.real_nic[:, None] > 0), pos_nic / self.real_nic[:, None], 0.0)
+            precision = np.where(pred_ok, pos_cnt / (1.0 * all_cnt), 0.0)
+            wprecision = np.where(pred_ok & (all_nic > 0), pos_nic / all_nic, 0.0)
+        sums = {
+            'threshold': np.array(thresholds, dtype=np.float64),
+            'total': int(has_real.sum()),
+            'p_total': pred_ok.sum(axis=0),
+            'r': _seqsum(recall),
+            'wr': _seqsum(wrecall),
+            'p': _seqsum(precision),
+            'wp': _seqsum(wprecision),
+            'tp_ic': _seqsum(np.where(has_real, pos_ic, 0.0)),
+            'ru': _seqsum(np.where(has_real, self.real_ic[:, None] - pos_ic, 0.0)),
+            'mi': _seqsum(np.where(has_real, all_ic - pos_ic, 0.0)),
+            'spec_match': spec,
+        }
+        return self._finalize(sums)
+
+    def curves_exact(self, eval_preds, chunk_size=2 ** 20):
+        """
+        Protein-centric curves evaluated at every distinct score. Proteins
+        are processed in chunks: the scores of a chunk are sorted per protein,
+        per-protein changes of precision, recall and IC sums are computed
+        along the sorted order and added to the bin of their score. Label
+        membership is looked up in the CSR label matrix, so no dense label
+        matrix is built.
+        Args:
+           eval_preds (numpy.ndarray): Scores (n_proteins x n_terms)
+           chunk_size (int): Approximate number of scores processed at once
+        Returns:
+           curves (dict): Per-threshold arrays, thresholds increasing. The
+               last point has a threshold above every score (nothing predicted)
+        """
+        n, m = self.n_proteins, len(self.columns)
+        step = max(1, chunk_size // max(1, m))
+
+        def chunk_scores(s):
+            return np.asarray(eval_preds[s:s + step])[:, self.columns]
+
+        # Distinct scores, the thresholds of the curves
+        thresholds = np.unique(np.concatenate(
+            [np.unique(chunk_scores(s)) for s in range(0, n, step)] or [np.zeros(0)]))
+        thresholds = thresholds[~np.isnan(thresholds)]
+        k = len(thresholds)
+
+        def member(indptr, indices, s, e, codes):
+            # Row-major codes row * m + column of the CSR entries are sorted
+            start, end = indptr[s], indptr[e]
+            lrows = np.repeat(np.arange(e - s), np.diff(indptr[s:e + 1]))
+            lcodes = lrows * m + indices[start:end]
+            i = np.searchsorted(lcodes, codes)
+            found = i < len(lcodes)
+            found[found] = lcodes[i[found]] == codes[found]
+            return found
+
+        names = ('p_total', 'r', 'wr', 'p', 'wp', 'tp_ic', 'ru', 'mi', 'spec_match')
+        binned = {name: np.zeros(k, dtype=np.float64) for name in names}
+        for s in range(0, n, step):
+            scores = chunk_scores(s)
+            e = s + len(scores)
+            # Scores of every protein in decreasing order, NaN last
+            cols = np.argsort(-scores, axis=1, kind='stable')
+            x = np.take_along_axis(scores, cols, axis=1)
+            codes = (np.arange(e - s)[:, None] * m + cols).ravel()
+            pos = member(self.label_indptr, self.label_indices, s, e, codes).reshape(cols.shape)
+            is_spec = member(self.spec_indptr, self.spec_indices, s, e, codes).reshape(cols.shape)
+
+            # Per-protein running sums along the sorted scores
+            nic, ic = self.nic[cols], self.ic[cols]
+            pred_a = np.cumsum(np.ones(cols.shape, dtype=np.int64), axis=1)
+            tp_a = np.cumsum(pos, axis=1)
+            tpnic_a = np.cumsum(nic * pos, axis=1)
+            allnic_a = np.cumsum(nic, axis=1)
+            # Terms with IC, so that zero weighted precision denominators are exact
+            nz_a = np.cumsum(nic > 0, axis=1)
+            pred_b, tp_b, nz_b = pred_a - 1, tp_a - pos, nz_a - (nic > 0)
+            tpnic_b, allnic_b = tpnic_a - nic * pos, allnic_a - nic
+
+            real_n = self.real_n[s:e, None]
+            real_nic = self.real_nic[s:e, None]
+            has_real = real_n > 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                def prec(tp, pred):
+                    return np.where(pred > 0, tp / (1.0 * pred), 0.0)
+
+                def wprec(tpnic, allnic, nz):
+                    return np.where(nz > 0, tpnic / allnic, 0.0)
+
+                deltas = {
+                    'p_total': has_real & (pred_b == 0),
+                    'r': np.where(has_real, pos / (1.0 * real_n), 0.0),
+                    'wr': np.where(has_real & (real_nic > 0), nic * pos / real_nic, 0.0),
+                    'p': np.where(has_real, prec(tp_a, pred_a) - prec(tp_b, pred_b), 0.0),
+                    'wp': np.where(has_real, wprec(tpnic_a, allnic_a, nz_a) - wprec(tpnic_b, allnic_b, nz_b), 0.0),
+                    'tp_ic': np.where(has_real & pos, ic, 0.0),
+                    'ru': np.where(has_real & pos, -ic, 0.0),
+                    'mi': np.where(has_real & ~pos, ic, 0.0),
+                    'spec_match': is_spec,
+                }
+            keep = ~np.isnan(x)
+            bins = np.searchsorted(thresholds, x[keep])
+            for name, d in deltas.items():
+                binned[name] += np.bincount(bins, weights=d[keep], minlength=k)
+
+        total = int((self.real_n > 0).sum())
+        sums = {'threshold': np.append(thresholds, np.inf), 'total': total}
+        for name in names:
+            start = np.sum(self.real_ic[self.real_n > 0]) if name == 'ru' else 0
+            cum = np.cumsum(binned[name][::-1])[::-1] + start
+            if name in ('p_total', 'spec_match'):
+                cum = np.rint(cum).astype(np.int64)
+            sums[name] = np.append(cum, start)
+        return self._finalize(sums)
+
+    @staticmethod
+    def _finalize(sums):
+        total = sums['total']
+        p_total = sums['p_total']
+        r = sums['r'] / total
+        wr = sums['wr'] / total
+        ru = sums['ru'] / total
+        mi = sums['mi'] / total
+        avg_ic = (sums['tp_ic'] + sums['mi']) / total
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = np.where(p_total > 0, sums['p'] / p_total, sums['p'])
+            wp = np.where(p_total > 0, sums['wp'] / p_total, sums['wp'])
+            f = np.where(p + r > 0, 2 * p * r / (p + r), 0.0)
+            wf = np.where((p + r > 0) & (wp + wr > 0), 2 * wp * wr / (wp + wr), 0.0)
+        s = np.sqrt(ru * ru + mi * mi)
+        return {
+            'threshold': sums['threshold'], 'f': f, 'p': p, 'r': r, 's': s, 'ru': ru,
+            'mi': mi, 'avg_ic': avg_ic, 'wf': wf, 'wp': wp, 'wr': wr,
+            'spec_match': sums['spec_match'],
+        }
+
+
+def summarize_curves(curves):
+    """
+    Picks Fmax, Smin, WFmax and AUPR from protein-centric curves the same
+    way the threshold loop of `compute_metrics` does (first best threshold)
+    Returns:
+       fmax, smin, tmax, wfmax, wtmax, aupr, avgic, fmax_spec_match
+    """
+    f, wf, s = curves['f'], curves['wf'], curves['s']
+    thresholds = curves['threshold']
+    fmax, tmax, avgic, fmax_spec_match = 0.0, 0.0, 0.0, 0
+    i = int(np.argmax(f)) if len(f) else 0
+    if len(f) and f[i] > 0:
+        fmax, tmax = float(f[i]), float(thresholds[i])
+        avgic, fmax_spec_match = float(curves['avg_ic'][i]), int(curves['spec_match'][i])
+    wfmax, wtmax = 0.0, 0.0
+    i = int(np.argmax(wf)) if len(wf) else 0
+    if len(wf) and wf[i] > 0:
+        wfmax, wtmax = float(wf[i]), float(thresholds[i])
     smin = 1000000.0
-    rus = []
-    mis = []
-    go_set = go.get_namespace_terms(NAMESPACES[ont])
-    go_set.remove(FUNC_DICT[ont])
-    labels = test_df['prop_annotations'].values
-    labels = list(map(lambda x: set(filter(lambda y: y in go_set, x)), labels))
-    spec_labels = test_df['exp_annotations'].values
-    spec_labels = list(map(lambda x: set(filter(lambda y: y in go_set, x)), spec_labels))
-    fmax_spec_match = 0
-    for t in range(0, 101):
-        threshold = t / 100.0
-        preds = [set() for _ in range(len(test_df))]
-        for i in range(len(test_df)):
-            annots = set()
-            above_threshold = np.argwhere(eval_preds[i] >= threshold).flatten()
-            for j in above_threshold:
-                annots.add(terms[j])
-
-            if t == 0:
-                preds[i] = annots
-                continue
-            preds[i] = annots
-
-        # Filter classes
-        preds = list(map(lambda x: set(filter(lambda y: y in go_set, x)), preds))
-        fscore, prec, rec, s, ru, mi, fps, fns, avg_ic, wf = evaluate_annotations(go, labels, preds)
-        spec_match = 0
-        for i, row in enumerate(test_df.itertuples()):
-            spec_match += len(spec_labels[i].intersection(preds[i]))
-        precisions.append(prec)
-        recalls.append(rec)
-        if fmax < fscore:
-            fmax = fscore
-            tmax = threshold
-            avgic = avg_ic
-            fmax_spec_match = spec_match
-        if wfmax < wf:
-            wfmax = wf
-            wtmax = threshold
-        if smin > s:
-            smin = s
-    precisions = np.array(precisions)
-    recalls = np.array(recalls)
+    if len(s) and s.min() < smin:
+        smin = float(s.min())
+    precisions = np.array(curves['p'])
+    recalls = np.array(curves['r'])
     sorted_index = np.argsort(recalls)
     recalls = recalls[sorted_index]
     precisions = precisions[sorted_index]
-    aupr = np.trapz(precisions, recalls)
+    aupr = _trapezoid(precisions, recalls)
+    return fmax, smin, tmax, wfmax, wtmax, aupr, avgic, fmax_spec_match
 
-    return fmax, smin, tmax, wfmax, wtmax, avg_auc, aupr, avgic, fmax_spec_match
+
+def term_centric_metrics(labels, preds, memory_budget=512 * 2 ** 20):
+    """
+    Computes per-term ROC AUC, AUPR (average precision) and Fmax for all
+    columns at once. Columns are sorted in chunks with a column-wise argsort;
+    AUC comes from tie-corrected rank sums, AUPR and Fmax are evaluated at
+    the end of every group of tied scores.
+    Args:
+       labels (numpy.ndarray): Binary labels (n_proteins x n_terms)
+       preds (numpy.ndarray): Scores (n_proteins x n_terms)
+       memory_budget (int): Approximate number of bytes used per column chunk
+    Returns:
+       metrics (dict): 'auc', 'aupr' and 'fmax' arrays (NaN for terms without
+           positives, AUC also NaN for terms without negatives), 'valid'
+           mask and their macro averages 'avg_auc', 'avg_aupr', 'avg_fmax'
+    """
+    labels = np.asarray(labels)
+    preds = np.asarray(preds)
+    n, t = preds.shape
+    aucs = np.full(t, np.nan)
+    auprs = np.full(t, np.nan)
+    fmaxs = np.full(t, np.nan)
+    chunk = max(1, memory_budget // max(1, n * 8 * 8))
+    idx = np.arange(n)[:, None]
+    for c in range(0, t, chunk):
+        x = preds[:, c:c + chunk].astype(np.float64)
+        order = np.argsort(-x, axis=0, kind='stable')
+        x = np.take_along_axis(x, order, axis=0)
+        y = np.take_along_axis(labels[:, c:c + chunk] > 0, order, axis=0)
+        # First and last position of the group of tied scores of every element
+        new_group = np.ones(x.shape, dtype=bool)
+        new_group[1:] = x[1:] != x[:-1]
+        start = np.maximum.accumulate(np.where(new_group, idx, 0), axis=0)
+        group_end = np.ones(x.shape, dtype=bool)
+        group_end[:-1] = new_group[1:]
+        end = np.minimum.accumulate(np.where(group_end, idx, n - 1)[::-1], axis=0)[::-1]
+        n_pos = y.sum(axis=0)
+        n_neg = n - n_pos
+        # Average ascending ranks of tied scores
+        ranks = n - (start + end) / 2.0
+        tp = np.cumsum(y, axis=0)
+        tp_end = np.take_along_axis(tp, end, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rank_sum = np.where(y, ranks, 0.0).sum(axis=0)
+            auc_c = (rank_sum - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg)
+            precision = tp_end / (end + 1.0)
+            aupr_c = np.where(y, precision, 0.0).sum(axis=0) / n_pos
+            f = np.where(group_end, 2.0 * tp / (idx + 1.0 + n_pos), 0.0)
+        has_pos = n_pos > 0
+        aucs[c:c + chunk] = np.where(has_pos & (n_neg > 0), auc_c, np.nan)
+        auprs[c:c + chunk] = np.where(has_pos, aupr_c, np.nan)
+        fmaxs[c:c + chunk] = np.where(has_pos, f.max(axis=0), np.nan)
+
+    def average(v):
+        v = v[~np.isnan(v)]
+        return _seqsum(v) / len(v) if len(v) else float('nan')
+
+    return {
+        'auc': aucs, 'aupr': auprs, 'fmax': fmaxs, 'valid': ~np.isnan(aucs),
+        'avg_auc': average(aucs), 'avg_aupr': average(auprs), 'avg_fmax': average(fmaxs),
+    }
+
+
+class StreamingMetrics(object):
+    """
+    Accumulates validation metrics batch by batch in O(batch) time without
+    keeping the prediction matrix: mean BCE, micro ROC AUC and AUPR from
+    score histograms, and an approximate protein-centric Fmax over the
+    predicted terms on a fixed threshold grid.
+    Args:
+        n_bins (int): Number of threshold steps, thresholds are i / n_bins
+    """
+
+    def __init__(self, n_bins=100):
+        self.n_bins = n_bins
+        self.thresholds = np.arange(n_bins + 1) / n_bins
+        self.pos_hist = np.zeros(n_bins + 1, dtype=np.int64)
+        self.neg_hist = np.zeros(n_bins + 1, dtype=np.int64)
+        self.bce_sum = 0.0
+        self.n_values = 0
+        self.total = 0
+        self.p_total = np.zeros(n_bins + 1, dtype=np.int64)
+        self.p_sum = np.zeros(n_bins + 1, dtype=np.float64)
+        self.r_sum = np.zeros(n_bins + 1, dtype=np.float64)
+
+    def update(self, preds, labels):
+        """
+        Adds a batch of scores and binary labels (batch x n_terms)
+        """
+        if hasattr(preds, 'detach'):
+            preds = preds.detach().cpu().numpy()
+        if hasattr(labels, 'detach'):
+            labels = labels.detach().cpu().numpy()
+        preds = np.asarray(preds, dtype=np.float64)
+        labels = np.asarray(labels) > 0
+        n, k = len(preds), self.n_bins + 1
+        # Same clamping of log terms as torch binary_cross_entropy
+        with np.errstate(divide='ignore'):
+            log_p = np.maximum(np.log(preds), -100.0)
+            log_q = np.maximum(np.log1p(-preds), -100.0)
+        self.bce_sum -= np.where(labels, log_p, log_q).sum()
+        self.n_values += preds.size
+
+        bins = np.clip(np.floor(preds * self.n_bins).astype(np.int64), 0, self.n_bins)
+        self.pos_hist += np.bincount(bins[labels], minlength=k)
+        self.neg_hist += np.bincount(bins[~labels], minlength=k)
+
+        rows = np.repeat(np.arange(n), preds.shape[1]).reshape(preds.shape)
+        flat = rows * k + bins
+        pred_n = _reverse_cumsum(np.bincount(flat.ravel(), minlength=n * k).reshape(n, k))
+        tp = _reverse_cumsum(np.bincount(flat[labels], minlength=n * k).reshape(n, k))
+        real_n = labels.sum(axis=1)[:, None]
+        has_real = real_n > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.r_sum += np.where(has_real, tp / real_n, 0.0).sum(axis=0)
+            ok = has_real & (pred_n > 0)
+            self.p_sum += np.where(ok, tp / pred_n, 0.0).sum(axis=0)
+        self.p_total += ok.sum(axis=0)
+        self.total += int(has_real.sum())
+
+    def loss(self):
+        """Mean binary cross-entropy over all values"""
+        return self.bce_sum / max(1, self.n_values)
+
+    def _rates(self):
+        tp = np.cumsum(self.pos_hist[::-1])[::-1]
+        fp = np.cumsum(self.neg_hist[::-1])[::-1]
+        tpr = np.append(tp / max(1, tp[0]), 0.0)
+        fpr = np.append(fp / max(1, fp[0]), 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.append(np.where(tp + fp > 0, tp / (tp + fp), 1.0), 1.0)
+        return tpr, fpr, precision
+
+    def roc_auc(self):
+        """Micro-averaged ROC AUC from the binned score histograms"""
+        tpr, fpr, _ = self._rates()
+        return float(np.sum((fpr[:-1] - fpr[1:]) * (tpr[:-1] + tpr[1:]) / 2.0))
+
+    def aupr(self):
+        """Micro-averaged area under the precision-recall curve"""
+        tpr, _, precision = self._rates()
+        return float(np.sum((tpr[:-1] - tpr[1:]) * (precision[:-1] + precision[1:]) / 2.0))
+
+    def fmax(self):
+        """
+        Approximate protein-centric Fmax over the predicted terms
+        Returns:
+           fmax, threshold
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = np.where(self.p_total > 0, self.p_sum / self.p_total, 0.0)
+            r = self.r_sum / max(1, self.total)
+            f = np.where(p + r > 0, 2 * p * r / (p + r), 0.0)
+        i = int(np.argmax(f))
+        return float(f[i]), float(self.thresholds[i])
 
 
 def compute_roc(labels, preds):
@@ -175,43 +582,119 @@ def evaluate_annotations(go, real_annots, pred_annots):
     return f, p, r, s, ru, mi, fps, fns, avg_ic, wf
 
 
+_WORKER_SESSION = None
+_WORKER_PREDS = None
+
+
+def _evaluate_worker(args):
+    name, exact = args
+    return name, _WORKER_SESSION.evaluate(_WORKER_PREDS[name], exact)
+
+
+class EvaluationSession(object):
+    """
+    Keeps everything needed to evaluate predictions for one (data_root, ont,
+    test set): the ontology with IC computed from train, valid and test
+    annotations, the terms, the label matrix and the protein-centric
+    evaluator. Sessions are cached, so evaluating many models only loads
+    these inputs once.
+    Args:
+        data_root (string): Data folder
+        ont (string): Sub-ontology (mf, bp or cc)
+        test_data_file (string): Test set file name inside data_root/ont
+        test_df (pandas.DataFrame): Test set rows, read from test_data_file when None
+    """
+    _sessions = {}
+
+    def __init__(self, data_root, ont, test_data_file='test_data.pkl', test_df=None):
+        self.data_root = data_root
+        self.ont = ont
+        if test_df is None:
+            test_df = pd.read_pickle(f'{data_root}/{ont}/{test_data_file}')
+        self.test_df = test_df
+        self.go = Ontology(f'{data_root}/go.obo', with_rels=True)
+        terms_df = pd.read_pickle(f'{data_root}/{ont}/terms.pkl')
+        self.terms = terms_df['gos'].values.flatten()
+        self.terms_dict = {v: i for i, v in enumerate(self.terms)}
+
+        train_df = pd.read_pickle(f'{data_root}/{ont}/train_data.pkl')
+        valid_df = pd.read_pickle(f'{data_root}/{ont}/valid_data.pkl')
+        train_df = pd.concat([train_df, valid_df])
+        annotations = train_df['prop_annotations'].values
+        annotations = list(map(lambda x: set(x), annotations))
+        test_annotations = test_df['prop_annotations'].values
+        test_annotations = list(map(lambda x: set(x), test_annotations))
+        self.go.calculate_ic(annotations + test_annotations)
+
+        self.labels = label_matrix(test_df, self.terms_dict)
+        self.evaluator = ProteinCentricEvaluator(
+            self.go, self.terms, ont, test_df['prop_annotations'].values,
+            test_df['exp_annotations'].values)
+
+    @classmethod
+    def get(cls, data_root, ont, test_data_file='test_data.pkl', test_df=None):
+        """
+        Returns a cached session. When `test_df` is given, the session is
+        keyed by a digest of its protein ids and annotations, so prediction
+        pickles of the same test set share one session.
+        """
+        if test_df is None:
+            key = (os.path.abspath(data_root), ont, test_data_file)
+        else:
+            h = hashlib.sha1()
+            for row in test_df[['proteins', 'prop_annotations', 'exp_annotations']].itertuples(index=False):
+                h.update(str(row.proteins).encode('utf-8'))
+                for annots in (row.prop_annotations, row.exp_annotations):
+                    h.update(b'\t' + ' '.join(sorted(annots)).encode('utf-8'))
+                h.update(b'\n')
+            key = (os.path.abspath(data_root), ont, h.hexdigest())
+        if key not in cls._sessions:
+            cls._sessions[key] = cls(data_root, ont, test_data_file, test_df)
+        return cls._sessions[key]
+
+    def evaluate(self, preds, exact=False):
+        """
+        Evaluates a prediction matrix (n_test_proteins x n_terms) whose rows
+        follow the test set order
+        Returns:
+           fmax, smin, tmax, wfmax, wtmax, avg_auc, aupr, avgic, fmax_spec_match
+        """
+        preds = np.asarray(preds)
+        if preds.shape != self.labels.shape:
+            raise ValueError(f'Expected predictions of shape {self.labels.shape}, got {preds.shape}')
+        return metrics_from(self.labels, self.evaluator, preds, exact)
+
+    def evaluate_many(self, preds, processes=None, exact=False):
+        """
+        Evaluates several models. Workers are forked after the session and
+        the predictions are set as module globals, so they share both
+        read-only instead of reloading or unpickling them; tasks only carry
+        model names.
+        Args:
+           preds (dict): Model name to prediction matrix
+           processes (int): Number of worker processes, evaluates serially when 1
+        Returns:
+           results (dict): Model name to the tuple returned by `evaluate`
+        """
+        global _WORKER_SESSION, _WORKER_PREDS
+        if processes == 1 or len(preds) <= 1 or 'fork' not in mp.get_all_start_methods():
+            return {name: self.evaluate(p, exact) for name, p in preds.items()}
+        _WORKER_SESSION, _WORKER_PREDS = self, preds
+        try:
+            with mp.get_context('fork').Pool(processes) as pool:
+                return dict(pool.map(_evaluate_worker, [(name, exact) for name in preds]))
+        finally:
+            _WORKER_SESSION, _WORKER_PREDS = None, None
+
+
 def evaluate(data_root, ont, model_name, out_file):
-    train_data_file = f'{data_root}/{ont}/train_data.pkl'
-    valid_data_file = f'{data_root}/{ont}/valid_data.pkl'
-    test_data_file = out_file
-    test_df = pd.read_pickle(test_data_file)
-
-    terms_file = f'{data_root}/{ont}/terms.pkl'
-    go = Ontology(f'{data_root}/go.obo', with_rels=True)
-    terms_df = pd.read_pickle(terms_file)
-    terms = terms_df['gos'].values.flatten()
-    terms_dict = {v: i for i, v in enumerate(terms)}
-
-    train_df = pd.read_pickle(train_data_file)
-    valid_df = pd.read_pickle(valid_data_file)
-    train_df = pd.concat([train_df, valid_df])
-
-    annotations = train_df['prop_annotations'].values
-    annotations = list(map(lambda x: set(x), annotations))
-    test_annotations = test_df['prop_annotations'].values
-    test_annotations = list(map(lambda x: set(x), test_annotations))
-    go.calculate_ic(annotations + test_annotations)
-
-    # Print IC values of terms
-    ics = {}
-    for i, term in enumerate(terms):
-        ics[term] = go.get_ic(term)
-
-    # Combine scores for diamond and deepgo
+    test_df = pd.read_pickle(out_file)
+    session = EvaluationSession.get(data_root, ont, test_df=test_df)
     eval_preds = []
 
     for i, row in enumerate(test_df.itertuples()):
         preds = row.preds
         eval_preds.append(preds)
 
-    eval_preds = np.concatenate(eval_preds).reshape(-1, len(terms))
-    # np.save(f'{data_root}/{ont}/{model_name}_preds.npy', eval_preds)
-    # return
-    fmax, smin, tmax, wfmax, wtmax, avg_auc, aupr, avgic, fmax_spec_match = compute_metrics(
-        test_df, go, terms_dict, terms, ont, eval_preds)
-    return fmax, smin, tmax, wfmax, wtmax, avg_auc, aupr, avgic, fmax_spec_match
\ No newline at end of file
+    eval_preds = np.concatenate(eval_preds).reshape(-1, len(session.terms))
+    return session.evaluate(eval_preds)
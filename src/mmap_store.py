@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+MAGIC = b'LLGARR01'
+ALIGN = 64
+
+
+def file_sha256(filename, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 digest of a file's content
+    Args:
+       filename (string): Path to the file
+    Returns:
+       digest (string): Hex digest
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save_arrays(filename, arrays, meta=None):
+    """
+    Writes a dictionary of NumPy arrays into a single file which can later be
+    memory-mapped. The file is written to a temporary location first and
+    renamed, so readers never see a partially written file.
+    Args:
+       filename (string): Output file
+       arrays (dict): Name to numpy.ndarray mapping (no object dtypes)
+       meta (dict): JSON-serializable metadata stored in the header
+    """
+    table = {}
+    offset = 0
+    arrays = {k: np.ascontiguousarray(v) for k, v in arrays.items()}
+    for name, arr in arrays.items():
+        if arr.dtype.hasobject:
+            raise ValueError(f'Array {name} has object dtype and cannot be stored')
+        table[name] = {
+            'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset = _align(offset + arr.nbytes)
+    header = json.dumps({'meta': meta or {}, 'arrays': table}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    out_dir = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_file = tempfile.mkstemp(dir=out_dir, prefix='.tmp_', suffix='.arr')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for name, arr in arrays.items():
+                f.seek(data_start + table[name]['offset'])
+                if arr.size > 0:
+                    arr.tofile(f)
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, filename)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def read_meta(filename):
+    """
+    Reads only the metadata header of a file written with `save_arrays`
+    Returns:
+       meta (dict): Stored metadata or None if the file is not valid
+    """
+    try:
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            size = int.from_bytes(f.read(8), 'little')
+            return json.loads(f.read(size).decode('utf-8'))['meta']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_arrays(filename, mmap=True, mode='r'):
+    """
+    Loads arrays written with `save_arrays`
+    Args:
+       filename (string): Input file
+       mmap (boolean): Memory-map arrays read-only instead of reading them
+       mode (string): Memory-map mode, 'c' maps arrays copy-on-write: they
+           are writable and changed pages stay private to the process
+    Returns:
+       meta (dict): Stored metadata
+       arrays (dict): Name to numpy.ndarray (or numpy.memmap) mapping
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{filename} is not an array store file')
+        size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(size).decode('utf-8'))
+    data_start = _align(len(MAGIC) + 8 + size)
+    arrays = {}
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        offset = data_start + info['offset']
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode=mode, offset=offset, shape=shape)
+        else:
+            arrays[name] = np.fromfile(
+                filename, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    return header['meta'], arrays
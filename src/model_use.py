@@ -1,8 +1,14 @@
+import dgl
 from dgl.nn.pytorch import GATConv
 import torch
 import torch.nn as nn
 import torch as th
 import math
+
+# Modules of BaseModel used only by the ELEmbedding losses
+EL_MODULES = ('go_embed', 'go_norm', 'go_rad', 'rel_embed')
+
+
 class MLPBlock(nn.Module):
     """
     A basic Multi-Layer Perceptron (MLP) block with one fully connected layer.
@@ -101,9 +107,13 @@ class BaseModel(nn.Module):
         hidden_dim (int): The hidden dimension for an MLP
         embed_dim (int): Embedding dimension for GO classes and relations
         margin (float): The margin parameter of ELEmbedding method
+        el_embeddings (boolean): Create the ELEmbedding tables now. They are
+            only needed by the ELEmbedding losses, otherwise they are created
+            by `init_el_embeddings` when such a loss is enabled.
     """
 
-    def __init__(self, input_length, nb_gos, nb_zero_gos, nb_rels, device, hidden_dim=2560, embed_dim=2560, margin=0.1):
+    def __init__(self, input_length, nb_gos, nb_zero_gos, nb_rels, device, hidden_dim=2560, embed_dim=2560, margin=0.1,
+                 el_embeddings=False):
         super().__init__()
         self.nb_gos = nb_gos
         self.nb_zero_gos = nb_zero_gos
@@ -112,46 +122,86 @@ class BaseModel(nn.Module):
         self.embed_dim = embed_dim
         # Create additional index for hasFunction relation
         self.hasFuncIndex = th.LongTensor([nb_rels])
+        self.go_embed = None
+        self.go_norm = None
+        self.go_rad = None
+        self.rel_embed = None
+        # indices of all1.csv GO classes
+        self.all_gos = th.arange(self.nb_gos)
+        self.margin = margin
+        if el_embeddings:
+            self.init_el_embeddings()
+
+    def init_el_embeddings(self):
+        """Creates the ELEmbedding tables if they do not exist yet"""
+        if self.go_embed is not None:
+            return
+        device = next(self.parameters(), th.empty(0)).device
         # Embedding layer for all1.csv classes in GO
-        self.go_embed = nn.Embedding(nb_gos + nb_zero_gos, embed_dim)
-        self.go_norm = nn.BatchNorm1d(embed_dim)
+        self.go_embed = nn.Embedding(self.nb_gos + self.nb_zero_gos, self.embed_dim)
+        self.go_norm = nn.BatchNorm1d(self.embed_dim)
         # Initialize embedding layers
-        k = math.sqrt(1 / embed_dim)
+        k = math.sqrt(1 / self.embed_dim)
         nn.init.uniform_(self.go_embed.weight, -k, k)
-        self.go_rad = nn.Embedding(nb_gos + nb_zero_gos, 1)
+        self.go_rad = nn.Embedding(self.nb_gos + self.nb_zero_gos, 1)
         nn.init.uniform_(self.go_rad.weight, -k, k)
-        self.rel_embed = nn.Embedding(nb_rels + 1, embed_dim)
+        self.rel_embed = nn.Embedding(self.nb_rels + 1, self.embed_dim)
         nn.init.uniform_(self.rel_embed.weight, -k, k)
-        # indices of all1.csv GO classes
-        self.all_gos = th.arange(self.nb_gos)
-        self.margin = margin
+        for name in EL_MODULES:
+            getattr(self, name).to(device)
+
+
 class SharedCoreDeepGATModel(nn.Module):
     def __init__(self, shared_input_length, shared_hidden_dim, shared_embed_dim):
         super().__init__()
         # 共享的核心模型部分
         self.shared_net1 = MLPBlock(shared_input_length, shared_hidden_dim)
         self.shared_conv1 = GATConv(shared_hidden_dim, shared_embed_dim, num_heads=1)
-        # 保存旧参数的字典
-        self.old_params = {}
-        self.fisher_information = None
+        self.embed_dim = shared_embed_dim
     def forward_shared(self, features, g1):
         x = self.shared_net1(features)
         x = self.shared_conv1(g1, x).squeeze(dim=1)
         return x
-    def save_old_parameters(self):
-        """保存共享模型的旧参数。"""
-        for name, param in self.named_parameters():
-            self.old_params[name] = param.clone().detach()
-    def ewc_loss(self, fisher_information, lambda_ewc=0.5):
-        loss = 0
-        if self.old_params is not None:
-            for name, param in self.named_parameters():
-                if name in self.old_params:
-                    loss += (fisher_information[name] * (param - self.old_params[name]) ** 2).sum()
-        return lambda_ewc * loss
+    def inference(self, g, nids, features=None, chunk_nodes=4096, chunk_edges=2 ** 15):
+        """
+        Layer-wise inference for a set of output nodes. The MLP is applied
+        once to every node that feeds the output nodes, then the GAT layer
+        runs over the in-edges of chunks of output nodes, so each neighbour
+        is encoded once per pass instead of once per sampled block.
+        Args:
+            g (DGLGraph): Whole graph with 'feat' node data
+            nids (Tensor): Output node ids
+            features (Tensor): Node features, g.ndata['feat'] by default
+            chunk_nodes (int): Nodes per MLP chunk
+            chunk_edges (int): Approximate number of in-edges per GAT chunk
+        Returns:
+            Tensor: Shared embeddings of the output nodes in `nids` order,
+                (0, embed_dim) for no nodes
+        """
+        if features is None:
+            features = g.ndata['feat']
+        nids = th.as_tensor(nids, dtype=g.idtype, device=g.device)
+        if len(nids) == 0:
+            return th.zeros((0, self.embed_dim), dtype=features.dtype, device=g.device)
+        src, _ = g.in_edges(nids)
+        needed = th.unique(th.cat([src, nids]))
+        pos = th.full((g.num_nodes(),), -1, dtype=th.long, device=g.device)
+        pos[needed.long()] = th.arange(len(needed), device=g.device)
+        h = th.cat([self.shared_net1(features[needed[i:i + chunk_nodes].long()])
+                    for i in range(0, len(needed), chunk_nodes)])
+        degrees = g.in_degrees(nids)
+        _, counts = th.unique_consecutive((th.cumsum(degrees, 0) - degrees) // chunk_edges, return_counts=True)
+        out = []
+        for dst in th.split(nids, counts.tolist()):
+            block = dgl.to_block(dgl.in_subgraph(g, dst), dst)
+            x = h[pos[block.srcdata[dgl.NID].long()]]
+            out.append(self.shared_conv1(block, x).squeeze(dim=1))
+        return th.cat(out)
 class TaskSpecificModel(BaseModel):
-    def __init__(self, shared_model, input_length, nb_gos, nb_zero_gos, nb_rels, device, hidden_dim=2560, embed_dim=2560):
-        super().__init__(input_length, nb_gos, nb_zero_gos, nb_rels, device, hidden_dim, embed_dim)
+    def __init__(self, shared_model, input_length, nb_gos, nb_zero_gos, nb_rels, device, hidden_dim=2560, embed_dim=2560,
+                 el_embeddings=False):
+        super().__init__(input_length, nb_gos, nb_zero_gos, nb_rels, device, hidden_dim, embed_dim,
+                         el_embeddings=el_embeddings)
         self.shared_model = shared_model
         self.task_net = nn.Sequential(
             nn.Linear(embed_dim, nb_gos),
@@ -162,3 +212,7 @@ class TaskSpecificModel(BaseModel):
         shared_features = self.shared_model.forward_shared(features, g1)
         logits = self.task_net(shared_features)
         return logits
+
+    def inference(self, g, nids, **kwargs):
+        """Layer-wise inference for the output nodes `nids`, see `SharedCoreDeepGATModel.inference`"""
+        return self.task_net(self.shared_model.inference(g, nids, **kwargs))
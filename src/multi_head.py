@@ -0,0 +1,149 @@
+import os
+import numpy as np
+import torch as th
+import torch.nn as nn
+import dgl
+from src.model_use import SharedCoreDeepGATModel, EL_MODULES
+from src.checkpoint import load_checkpoint
+from src.bundle import fingerprints
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+
+class MultiHeadModel(nn.Module):
+    """
+    Shared MLP+GAT backbone with the task heads of several sub-ontologies.
+    The backbone runs once per node block and the heads of all ontologies
+    are evaluated as one linear layer whose output is split per ontology.
+    Args:
+        shared_model (SharedCoreDeepGATModel): Shared backbone
+        n_terms (dict): Number of predicted classes of every ontology, in head order
+        embed_dim (int): Backbone output dimension
+    """
+
+    def __init__(self, shared_model, n_terms, embed_dim=2560):
+        super().__init__()
+        self.shared_model = shared_model
+        self.onts = list(n_terms)
+        self.sizes = [n_terms[ont] for ont in self.onts]
+        self.heads = nn.Linear(embed_dim, sum(self.sizes))
+
+    def forward(self, input_nodes, output_nodes, blocks):
+        g1 = blocks[0]
+        features = g1.ndata['feat']['_N']
+        shared_features = self.shared_model.forward_shared(features, g1)
+        logits = th.sigmoid(self.heads(shared_features))
+        return dict(zip(self.onts, th.split(logits, self.sizes, dim=1)))
+
+
+def merge_checkpoints(model_files, features_length, backbone=None, embed_dim=2560):
+    """
+    Builds a multi-head model from `TaskSpecificModel` checkpoints
+    Args:
+       model_files (dict): Ontology to checkpoint file, in head order
+       features_length (int): Input feature length
+       backbone (string): Ontology whose checkpoint provides the shared
+           backbone, the last one by default (the final model of a
+           lifelong training order)
+    Returns:
+       model (MultiHeadModel): Merged model on the CPU
+    """
+    if backbone is None:
+        backbone = list(model_files)[-1]
+    states = {ont: load_checkpoint(f, skip=EL_MODULES) for ont, f in model_files.items()}
+    shared_state = {
+        k[len('shared_model.'):]: v for k, v in states[backbone].items() if k.startswith('shared_model.')}
+    for ont, state in states.items():
+        if ont == backbone:
+            continue
+        diff = max((state[f'shared_model.{k}'] - v).abs().max().item() for k, v in shared_state.items())
+        myLogging.info(f'Multi-head: {ont} backbone differs from {backbone} by at most {diff:0.3g}')
+    shared_model = SharedCoreDeepGATModel(
+        shared_input_length=features_length, shared_hidden_dim=2560, shared_embed_dim=embed_dim)
+    shared_model.load_state_dict(shared_state)
+    n_terms = {ont: state['task_net.0.weight'].shape[0] for ont, state in states.items()}
+    model = MultiHeadModel(shared_model, n_terms, embed_dim)
+    with th.no_grad():
+        model.heads.weight.copy_(th.cat([states[ont]['task_net.0.weight'] for ont in model.onts]))
+        model.heads.bias.copy_(th.cat([states[ont]['task_net.0.bias'] for ont in model.onts]))
+    model.backbone = backbone
+    return model
+
+
+def save_multi_head(model, features_length, filename, sources=None):
+    """
+    Writes a merged model. `sources` are the fingerprints (see
+    `bundle.fingerprints`) of the checkpoints it was merged from.
+    """
+    th.save({
+        'onts': model.onts,
+        'sizes': model.sizes,
+        'features_length': features_length,
+        'embed_dim': model.heads.in_features,
+        'backbone': getattr(model, 'backbone', None),
+        'sources': sources,
+        'state_dict': model.state_dict(),
+    }, filename)
+
+
+def _from_checkpoint(checkpoint, device):
+    shared_model = SharedCoreDeepGATModel(
+        shared_input_length=checkpoint['features_length'], shared_hidden_dim=2560,
+        shared_embed_dim=checkpoint['embed_dim'])
+    model = MultiHeadModel(
+        shared_model, dict(zip(checkpoint['onts'], checkpoint['sizes'])), checkpoint['embed_dim'])
+    model.load_state_dict(checkpoint['state_dict'])
+    model.backbone = checkpoint['backbone']
+    return model.to(device)
+
+
+def load_multi_head(filename, device='cpu'):
+    """Loads a model written with `save_multi_head`"""
+    return _from_checkpoint(th.load(filename, map_location=device), device)
+
+
+def _sources_current(known, files):
+    if not known or sorted(known) != sorted(files):
+        return False
+    current = fingerprints(files, known)
+    return all(current[f]['sha256'] == known[f]['sha256'] for f in files)
+
+
+def build_multi_head(model_files, features_length, filename, device='cpu'):
+    """
+    Loads the multi-head model cached in `filename`. It is merged again
+    from `model_files` (see `merge_checkpoints`) when the file is missing or
+    any checkpoint changed since it was built.
+    """
+    files = list(model_files.values())
+    if os.path.exists(filename):
+        checkpoint = th.load(filename, map_location=device)
+        if _sources_current(checkpoint.get('sources'), files):
+            return _from_checkpoint(checkpoint, device)
+        myLogging.info(f'Multi-head: checkpoints changed, rebuilding {filename}')
+    save_multi_head(merge_checkpoints(model_files, features_length), features_length, filename,
+                    fingerprints(files))
+    return load_multi_head(filename, device)
+
+
+def predict_nodes(model, graph, nodes, batch_size=256):
+    """
+    Predicts all ontologies for the given graph nodes
+    Returns:
+       preds (dict): Ontology to (n_nodes x n_terms) numpy.ndarray
+    """
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    dataloader = dgl.dataloading.DataLoader(
+        graph, nodes, sampler,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=0)
+    preds = {ont: [] for ont in model.onts}
+    model.eval()
+    with th.no_grad():
+        for input_nodes, output_nodes, blocks in dataloader:
+            for ont, logits in model(input_nodes, output_nodes, blocks).items():
+                preds[ont].append(logits.detach().cpu().numpy())
+    return {ont: np.concatenate(p) for ont, p in preds.items()}
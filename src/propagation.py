@@ -0,0 +1,160 @@
+import numpy as np
+
+
+class AnnotationPropagator(object):
+    """
+    Max-propagates prediction scores through the ontology hierarchy for a
+    whole (proteins x terms) matrix at once. It produces exactly the same
+    values as calling `utils.propagate_annots` on every row.
+
+    For each predicted term k the propagator stores the columns j whose
+    ancestors include k (k itself included) as a CSR matrix. Propagation
+    gathers those columns and reduces them with `np.maximum.reduceat`,
+    processing rows in chunks so the gathered block fits `memory_budget`.
+
+    Args:
+        go (utils.Ontology): Ontology instance
+        terms_dict (dict): GO id to column index mapping
+        memory_budget (int): Approximate number of bytes for the gathered block
+    """
+
+    def __init__(self, go, terms_dict, memory_budget=256 * 2 ** 20):
+        self.n_terms = len(terms_dict)
+        self.memory_budget = memory_budget
+        sources = [{k} for k in range(self.n_terms)]
+        for go_id, j in terms_dict.items():
+            for sup_go in go.get_ancestors(go_id):
+                if sup_go in terms_dict:
+                    sources[terms_dict[sup_go]].add(j)
+        self.indptr = np.zeros(self.n_terms + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(s) for s in sources])
+        self.indices = np.fromiter(
+            (j for s in sources for j in sorted(s)), dtype=np.int64,
+            count=int(self.indptr[-1]))
+
+    def propagate(self, preds):
+        """
+        Propagates scores of a prediction matrix
+        Args:
+           preds (numpy.ndarray, torch.Tensor or list of rows): Scores with
+               shape (n_proteins, n_terms) or a single row (n_terms,)
+        Returns:
+           Propagated scores of the same type, shape and dtype. The input is
+           not modified.
+        """
+        if hasattr(preds, 'detach'):
+            import torch as th
+            result = self.propagate(preds.detach().cpu().numpy())
+            return th.from_numpy(result).to(preds.device)
+        preds = np.asarray(preds)
+        if preds.ndim == 1:
+            return self.propagate(preds[None, :])[0]
+        if preds.shape[1] != self.n_terms:
+            raise ValueError(f'Expected {self.n_terms} columns, got {preds.shape[1]}')
+        out = np.empty_like(preds)
+        if self.n_terms == 0 or len(preds) == 0:
+            return out
+        row_bytes = max(1, len(self.indices) * preds.dtype.itemsize)
+        chunk = max(1, self.memory_budget // row_bytes)
+        starts = self.indptr[:-1]
+        for s in range(0, len(preds), chunk):
+            block = np.take(preds[s:s + chunk], self.indices, axis=1)
+            out[s:s + chunk] = np.maximum.reduceat(block, starts, axis=1)
+        return out
+
+
+def _set_bits(words):
+    """Returns (word index, bit position) of every set bit, grouped by word"""
+    idx = np.arange(len(words))
+    words = words.astype(np.uint64)
+    word_idx = []
+    bits = []
+    while len(words) > 0:
+        low = words & (~words + np.uint64(1))
+        word_idx.append(idx)
+        bits.append(np.log2(low.astype(np.float64)).astype(np.int64))
+        words = words ^ low
+        keep = words != 0
+        words, idx = words[keep], idx[keep]
+    if not word_idx:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    word_idx = np.concatenate(word_idx)
+    order = np.argsort(word_idx, kind='stable')
+    return word_idx[order], np.concatenate(bits)[order]
+
+
+class AncestorClosure(object):
+    """
+    Propagates GO annotations with the precompiled ancestor bitsets of an
+    `OntologyIndex`. A protein's propagated annotation set is the OR of the
+    sparse bitsets of its terms, so a whole annotation column is handled with
+    a few array operations instead of a set union per term.
+
+    Args:
+        index (go_index.OntologyIndex): Compiled ontology index
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.n_blocks = len(index.key_list) // 64 + 1
+        self.key_names = np.array(index.key_list, dtype=object)
+
+    def _lookup(self, annotations):
+        key_index = self.index.key_index
+        rows = []
+        keys = []
+        for i, annots in enumerate(annotations):
+            for go_id in annots:
+                k = key_index.get(go_id)
+                if k is not None:
+                    rows.append(i)
+                    keys.append(k)
+        return np.array(rows, dtype=np.int64), np.array(keys, dtype=np.int64)
+
+    def _propagate_keys(self, rows, keys):
+        """ORs ancestor bitsets of (row, key) pairs and returns (row, key) pairs of the result"""
+        indptr = self.index.anc_indptr
+        starts = indptr[keys]
+        lengths = indptr[keys + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        pos = offsets + np.arange(total)
+        code = np.repeat(rows, lengths) * self.n_blocks + self.index.anc_blocks[pos]
+        words = np.asarray(self.index.anc_words)[pos]
+        order = np.argsort(code, kind='stable')
+        code, words = code[order], words[order]
+        uniq, first = np.unique(code, return_index=True)
+        word_idx, bit = _set_bits(np.bitwise_or.reduceat(words, first))
+        out_rows = uniq[word_idx] // self.n_blocks
+        ranks = (uniq[word_idx] % self.n_blocks) * 64 + bit
+        return out_rows, np.asarray(self.index.bit_key)[ranks].astype(np.int64)
+
+    def get_prop_terms(self, terms):
+        """Returns the set of all ancestors of a collection of GO ids"""
+        _, keys = self._lookup([terms])
+        _, out = self._propagate_keys(np.zeros(len(keys), dtype=np.int64), keys)
+        return set(self.key_names[out].tolist())
+
+    def propagate(self, annotations, chunk_size=20000):
+        """
+        Propagates a column of annotations
+        Args:
+           annotations (iterable): Collections of GO ids, one per protein
+           chunk_size (int): Number of proteins processed at once
+        Returns:
+           prop_annotations (list): List of propagated GO id lists
+        """
+        annotations = list(annotations)
+        result = []
+        for s in range(0, len(annotations), chunk_size):
+            chunk = annotations[s:s + chunk_size]
+            rows, keys = self._propagate_keys(*self._lookup(chunk))
+            bounds = np.zeros(len(chunk) + 1, dtype=np.int64)
+            bounds[1:] = np.cumsum(np.bincount(rows, minlength=len(chunk)))
+            names = self.key_names[keys].tolist()
+            bounds = bounds.tolist()
+            for i in range(len(chunk)):
+                result.append(names[bounds[i]:bounds[i + 1]])
+        return result
@@ -0,0 +1,109 @@
+import copy
+import numpy as np
+import torch as th
+import torch.nn as nn
+import dgl
+from src.metrics import compute_roc
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+
+class AutocastModule(nn.Module):
+    """Runs a module under CPU autocast and returns float32 outputs"""
+
+    def __init__(self, module, dtype=th.bfloat16):
+        super().__init__()
+        self.module = module
+        self.dtype = dtype
+
+    def forward(self, *args, **kwargs):
+        with th.autocast('cpu', dtype=self.dtype):
+            out = self.module(*args, **kwargs)
+        return out.float()
+
+
+def quantize_model(net, bf16_gat=False):
+    """
+    Returns a CPU inference copy of a `TaskSpecificModel` (or a model with a
+    `shared_model`) whose linear layers use dynamic int8 quantization
+    Args:
+       net (nn.Module): Trained model, left unchanged
+       bf16_gat (boolean): Run the GAT layer under bfloat16 autocast
+           instead of quantizing its projection
+    Returns:
+       qnet (nn.Module): Quantized model in eval mode
+    """
+    qnet = copy.deepcopy(net).cpu().eval()
+    names = set()
+    for name, module in qnet.named_modules():
+        if isinstance(module, nn.Linear):
+            if bf16_gat and name.startswith('shared_model.shared_conv1'):
+                continue
+            names.add(name)
+    qnet = th.ao.quantization.quantize_dynamic(qnet, names, dtype=th.qint8)
+    if bf16_gat:
+        qnet.shared_model.shared_conv1 = AutocastModule(qnet.shared_model.shared_conv1)
+    return qnet
+
+
+def predict_split(net, graph, nids, batch_size=256):
+    """Returns the predictions of a single-head model for graph nodes"""
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    dataloader = dgl.dataloading.DataLoader(
+        graph, nids, sampler,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=0)
+    preds = []
+    net.eval()
+    with th.no_grad():
+        for input_nodes, output_nodes, blocks in dataloader:
+            preds.append(net(input_nodes, output_nodes, blocks).detach().cpu().float().numpy())
+    return np.concatenate(preds)
+
+
+def check_accuracy(ref_preds, preds, labels, session, propagator, tolerance=0.01):
+    """
+    Compares a quantized model's test predictions with the float32 ones
+    Args:
+       ref_preds (numpy.ndarray): Float32 model predictions
+       preds (numpy.ndarray): Quantized model predictions
+       labels (numpy.ndarray): Test labels
+       session (metrics.EvaluationSession): Test set evaluation session
+       propagator (propagation.AnnotationPropagator): Score propagation
+       tolerance (float): Largest allowed drop of Fmax and of AUC
+    Returns:
+       ok (boolean): Both drops are within the tolerance
+       report (dict): Fmax and AUC of both models
+    """
+    report = {}
+    for key, p in (('fp32', ref_preds), ('quantized', preds)):
+        fmax, _, _, _, _, avg_auc, _, _, _ = session.evaluate(propagator.propagate(p))
+        report[key] = {'fmax': float(fmax), 'auc': float(compute_roc(labels, p)), 'avg_auc': float(avg_auc)}
+    report['max_abs_diff'] = float(np.abs(ref_preds - preds).max()) if len(preds) else 0.0
+    fmax_drop = report['fp32']['fmax'] - report['quantized']['fmax']
+    auc_drop = report['fp32']['auc'] - report['quantized']['auc']
+    ok = fmax_drop <= tolerance and auc_drop <= tolerance
+    myLogging.info(
+        f"Fmax {report['fp32']['fmax']:0.4f} -> {report['quantized']['fmax']:0.4f}, "
+        f"AUC {report['fp32']['auc']:0.4f} -> {report['quantized']['auc']:0.4f}, "
+        f"max score difference {report['max_abs_diff']:0.4g}")
+    return ok, report
+
+
+def save_quantized(qnet, filename, bf16_gat, report):
+    th.save({'state_dict': qnet.state_dict(), 'bf16_gat': bf16_gat, 'report': report}, filename)
+
+
+def load_quantized(net, filename):
+    """
+    Loads an exported quantized model
+    Args:
+       net (nn.Module): Float32 model with the same architecture
+    """
+    checkpoint = th.load(filename, map_location='cpu', weights_only=False)
+    qnet = quantize_model(net, checkpoint['bf16_gat'])
+    qnet.load_state_dict(checkpoint['state_dict'])
+    return qnet
@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import torch as th
+import torch.nn as nn
+from src.bundle import bundle_path
+from src.feature_store import FeatureStore
+from src.mmap_store import load_arrays
+from src.model_use import MLPBlock
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+SGC_NORMS = ['mean', 'sym']
+
+
+def aggregate_features(src, dst, feat, norm='mean', chunk_size=4096):
+    """
+    Degree-normalized one-hop aggregation of node features over the edges
+    src -> dst, computed as a sparse matrix product
+    Args:
+       src, dst (numpy.ndarray): Edge end points
+       feat (numpy.ndarray): Node features (n_nodes x dim)
+       norm (string): 'mean' divides by the in-degree of the destination
+           (a convex combination of the neighbours, like attention
+           weights), 'sym' by sqrt(out-degree(src) * in-degree(dst)) as in SGC
+       chunk_size (int): Feature columns per sparse product
+    Returns:
+       agg (numpy.ndarray): Aggregated float32 features (n_nodes x dim)
+    """
+    n_nodes = len(feat)
+    src = th.from_numpy(np.array(src, dtype=np.int64))
+    dst = th.from_numpy(np.array(dst, dtype=np.int64))
+    in_deg = th.bincount(dst, minlength=n_nodes).float().clamp_(min=1)
+    if norm == 'mean':
+        weights = 1.0 / in_deg[dst]
+    elif norm == 'sym':
+        out_deg = th.bincount(src, minlength=n_nodes).float().clamp_(min=1)
+        weights = (out_deg[src] * in_deg[dst]).rsqrt()
+    else:
+        raise ValueError(f'Unknown normalization {norm}')
+    adj = th.sparse_coo_tensor(th.stack([dst, src]), weights, (n_nodes, n_nodes)).coalesce()
+    agg = np.empty((n_nodes, feat.shape[1]), dtype=np.float32)
+    for i in range(0, feat.shape[1], chunk_size):
+        block = th.from_numpy(np.ascontiguousarray(feat[:, i:i + chunk_size], dtype=np.float32))
+        agg[:, i:i + chunk_size] = th.sparse.mm(adj, block).numpy()
+    return agg
+
+
+def sgc_features(data_root, ont, features_column, ppi_graph_file='ppi_test.bin', norm='mean'):
+    """
+    Returns the [self, aggregated] input matrix of every graph node. The
+    aggregated features are computed from the compiled training bundle (see
+    `bundle.load_bundle`, which must have been called) and kept in the
+    feature store, where they are recomputed when the bundle is newer.
+    Returns:
+       inputs (numpy.ndarray): float32 (n_nodes x 2 * features_length)
+    """
+    bundle_file = bundle_path(data_root, ont, features_column, ppi_graph_file)
+    graph_name = os.path.splitext(os.path.basename(ppi_graph_file))[0]
+    name = f'agg_{ont}_{graph_name}_{features_column}_{norm}'
+    store = FeatureStore(f'{data_root}/features')
+    _, arrays = load_arrays(bundle_file)
+    proteins = arrays['proteins']
+    feat = arrays['feat']
+    if not store.has(name) or os.path.getmtime(store.path(name)) < os.path.getmtime(bundle_file):
+        myLogging.info(f'Aggregating {features_column} features over {ont} {graph_name} ({norm})')
+        store.write(name, proteins, aggregate_features(arrays['src'], arrays['dst'], feat, norm))
+    dim = feat.shape[1]
+    inputs = np.empty((len(proteins), 2 * dim), dtype=np.float32)
+    inputs[:, :dim] = feat
+    inputs[:, dim:] = store.gather(name, proteins)
+    return inputs
+
+
+class SGCModel(nn.Module):
+    """
+    Precomputed-aggregation variant of `TaskSpecificModel`: the shared MLP
+    block reads the concatenated [self, aggregated] features of a node and
+    replaces the MLP and GAT layers, the task head is the same
+    Args:
+        shared_model (MLPBlock): Shared MLP block
+        embed_dim (int): Shared MLP output dimension
+        nb_gos (int): The number of GO classes to predict
+    """
+
+    def __init__(self, shared_model, embed_dim, nb_gos):
+        super().__init__()
+        self.shared_model = shared_model
+        self.task_net = nn.Sequential(
+            nn.Linear(embed_dim, nb_gos),
+            nn.Sigmoid())
+
+    def forward(self, features):
+        return self.task_net(self.shared_model(features))
+
+
+def sgc_shared_model(input_length, hidden_dim=2560):
+    """Shared MLP block of the SGC variant for `input_length` self features"""
+    return MLPBlock(2 * input_length, hidden_dim)
+
+
+def predict_batches(net, features, batch_size=4096):
+    """Yields the scores of `net` for a feature matrix, batch by batch"""
+    net.eval()
+    for i in range(0, len(features), batch_size):
+        with th.no_grad():
+            preds = net(features[i:i + batch_size])
+        yield preds
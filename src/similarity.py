@@ -0,0 +1,207 @@
+import os
+import hashlib
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from src.utils import read_fasta
+from src.mmap_store import save_arrays, load_arrays
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+# Columns of Diamond's default tabular output (--outfmt 6)
+HIT_FIELDS = [
+    ('target', str), ('identity', np.float32), ('length', np.int32),
+    ('mismatches', np.int32), ('gap_opens', np.int32), ('qstart', np.int32),
+    ('qend', np.int32), ('sstart', np.int32), ('send', np.int32),
+    ('evalue', np.float64), ('bitscore', np.float32)]
+
+
+def sequence_hash(seq):
+    """Cache key of a protein sequence"""
+    return hashlib.sha1(seq.strip().upper().encode('utf-8')).hexdigest()
+
+
+def hits_array(queries, columns):
+    """
+    Builds a structured array of hits
+    Args:
+       queries (list): Query id of every hit
+       columns (dict): Hit field name to list (or array) of values
+    Returns:
+       hits (numpy.ndarray): Structured array with a 'query' field and the
+           HIT_FIELDS fields
+    """
+    def str_width(values):
+        values = np.asarray(values, dtype=str)
+        return max(int(np.char.str_len(values).max()) if len(values) else 0, 1)
+    dtype = [('query', f'U{str_width(queries)}')]
+    for name, tp in HIT_FIELDS:
+        dtype.append((name, f'U{str_width(columns[name])}' if tp is str else tp))
+    hits = np.zeros(len(queries), dtype=dtype)
+    hits['query'] = queries
+    for name, _ in HIT_FIELDS:
+        hits[name] = columns[name]
+    return hits
+
+
+def _gather(indptr, columns, index):
+    """Returns (indptr, columns) of the hit groups `index` in this order"""
+    counts = np.diff(indptr)[index]
+    new_indptr = np.zeros(len(index) + 1, dtype=np.int64)
+    new_indptr[1:] = np.cumsum(counts)
+    rows = np.arange(new_indptr[-1]) + np.repeat(indptr[:-1][index] - new_indptr[:-1], counts)
+    return new_indptr, {name: values[rows] for name, values in columns.items()}
+
+
+def _empty_hits():
+    return (np.zeros(0, dtype='U40'), np.zeros(1, dtype=np.int64),
+            {name: np.zeros(0, dtype='U1' if tp is str else tp) for name, tp in HIT_FIELDS})
+
+
+class DiamondSearch(object):
+    """
+    Similarity search against a Diamond database. Queries are deduplicated
+    by sequence hash, only sequences that are not cached are searched, and
+    all of them are sent to a single Diamond run. Hits are cached per
+    database and search options in `cache_dir`.
+    Args:
+        database (string): Diamond database (.dmnd)
+        cache_dir (string): Hit cache folder, no caching when None
+        diamond (string): Diamond executable
+        options (list): Extra blastp options, sensitive mode by default
+        threads (int): Number of Diamond threads
+    """
+
+    def __init__(self, database, cache_dir=None, diamond='diamond',
+                 options=('--sensitive',), threads=None):
+        self.database = database
+        self.cache_dir = cache_dir
+        self.diamond = diamond
+        self.options = list(options)
+        if threads is not None:
+            self.options += ['--threads', str(threads)]
+        self._cache = None
+
+    def cache_file(self):
+        st = os.stat(self.database)
+        key = '\t'.join([os.path.abspath(self.database), str(st.st_size), str(st.st_mtime_ns)] + self.options)
+        tag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(self.database))[0]
+        return f'{self.cache_dir}/{name}_{tag}.hits'
+
+    def _load_cache(self):
+        """Returns (sorted query hashes, hit row offsets, hit columns) of the cache as arrays"""
+        if self._cache is None:
+            self._cache = _empty_hits()
+            if self.cache_dir is not None and os.path.exists(self.cache_file()):
+                _, arrays = load_arrays(self.cache_file(), mmap=False)
+                self._cache = (
+                    arrays['hashes'], arrays['indptr'], {name: arrays[name] for name, _ in HIT_FIELDS})
+        return self._cache
+
+    def _save_cache(self, found):
+        """Merges hits of new queries, given like the cache, into it and writes it"""
+        hashes, indptr, columns = self._load_cache()
+        new_hashes, new_indptr, new_columns = found
+        # New queries are not cached, so the hashes stay unique
+        all_hashes = np.concatenate([hashes, new_hashes])
+        all_indptr = np.concatenate([indptr, new_indptr[1:] + indptr[-1]])
+        all_columns = {name: np.concatenate([columns[name], new_columns[name]]) for name, _ in HIT_FIELDS}
+        order = np.argsort(all_hashes, kind='stable')
+        indptr, columns = _gather(all_indptr, all_columns, order)
+        self._cache = (all_hashes[order], indptr, columns)
+        if self.cache_dir is None:
+            return
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        arrays = {'hashes': self._cache[0], 'indptr': indptr}
+        arrays.update(columns)
+        save_arrays(self.cache_file(), arrays, {'database': self.database, 'options': self.options})
+
+    def _run(self, seqs):
+        """
+        Runs Diamond on {hash: sequence}
+        Returns:
+           (sorted hashes, hit row offsets, hit columns) of the sequences,
+           hits of a sequence in Diamond's order
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            query_file = f'{tmp_dir}/queries.fa'
+            out_file = f'{tmp_dir}/hits.tsv'
+            with open(query_file, 'w') as f:
+                for h, seq in seqs.items():
+                    f.write(f'>{h}\n{seq}\n')
+            command = [self.diamond, 'blastp', '-d', self.database, '-q', query_file,
+                       '-o', out_file] + self.options
+            myLogging.info(f'Running Diamond on {len(seqs)} sequences')
+            subprocess.run(command, check=True)
+            names = ['query'] + [name for name, _ in HIT_FIELDS]
+            dtypes = dict([('query', str)] + HIT_FIELDS)
+            if os.path.exists(out_file) and os.path.getsize(out_file) > 0:
+                df = pd.read_csv(out_file, sep='\t', header=None, names=names, usecols=range(len(names)),
+                                 dtype=dtypes, keep_default_na=False)
+            else:
+                df = pd.DataFrame({name: pd.Series(dtype=object if tp is str else tp) for name, tp in dtypes.items()})
+        hashes = np.array(sorted(seqs), dtype='U40')
+        df = df[np.isin(np.asarray(df['query'], dtype='U40'), hashes)]
+        queries = np.asarray(df['query'], dtype='U40')
+        order = np.argsort(queries, kind='stable')
+        indptr = np.zeros(len(hashes) + 1, dtype=np.int64)
+        indptr[1:] = np.searchsorted(queries[order], hashes, side='right')
+        columns = {}
+        for name, tp in HIT_FIELDS:
+            columns[name] = np.asarray(df[name], dtype=str if tp is str else tp)[order]
+        return hashes, indptr, columns
+
+    def search(self, proteins, sequences):
+        """
+        Finds similar database proteins of the query sequences
+        Args:
+           proteins (list): Query ids
+           sequences (list): Query sequences
+        Returns:
+           hits (numpy.ndarray): Structured array of all hits (see
+               `hits_array`), grouped by query in input order and sorted
+               as reported by Diamond (best hit first)
+        """
+        keys = np.array([sequence_hash(seq) for seq in sequences], dtype='U40')
+        hashes, _, _ = self._load_cache()
+        unique = {}
+        for h, seq in zip(keys.tolist(), sequences):
+            unique.setdefault(h, seq.strip())
+        unique_keys = np.array(list(unique), dtype='U40')
+        cached = np.isin(unique_keys, hashes)
+        missing = {h: unique[h] for h in unique_keys[~cached].tolist()}
+        if missing:
+            self._save_cache(self._run(missing))
+        myLogging.info(f'Diamond: {int(cached.sum())} cached, {len(missing)} searched')
+        hashes, indptr, columns = self._load_cache()
+        index = np.searchsorted(hashes, keys)
+        out_indptr, out = _gather(indptr, columns, index)
+        queries = np.repeat(np.asarray(proteins, dtype=str), np.diff(out_indptr))
+        return hits_array(queries, out)
+
+    def search_fasta(self, fasta_file):
+        """Searches all sequences of a FASTA file"""
+        proteins, sequences = read_fasta(fasta_file)
+        return self.search(proteins, sequences)
+
+
+def first_hits(hits, candidates=None):
+    """
+    Returns the best hit of every query
+    Args:
+       hits (numpy.ndarray): Hits returned by `DiamondSearch.search`
+       candidates (collection): Only consider these target proteins
+    Returns:
+       targets (dict): Query id to target protein id
+    """
+    targets = {}
+    for query, target in zip(hits['query'].tolist(), hits['target'].tolist()):
+        if query in targets:
+            continue
+        if candidates is None or target in candidates:
+            targets[query] = target
+    return targets
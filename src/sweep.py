@@ -0,0 +1,71 @@
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+
+def all_orders(onts=('mf', 'bp', 'cc')):
+    """Returns every training order of the sub-ontologies as tuples"""
+    return list(itertools.permutations(onts))
+
+
+def prefix_tree(orders):
+    """
+    Arranges training orders as a prefix tree. Orders that start with the
+    same tasks share the nodes of that prefix, so each prefix is trained once.
+    Args:
+       orders (list): Training orders as sequences of sub-ontologies
+    Returns:
+       children (dict): Prefix tuple to the list of its child prefixes, the
+           empty tuple is the root
+       orders_of (dict): Prefix tuple to the orders passing through it
+    """
+    children = {(): []}
+    orders_of = {}
+    for order in orders:
+        order = tuple(order)
+        for k in range(1, len(order) + 1):
+            prefix = order[:k]
+            if prefix not in children:
+                children[prefix] = []
+                children[order[:k - 1]].append(prefix)
+            orders_of.setdefault(prefix, []).append(order)
+    return children, orders_of
+
+
+def run_prefix_tree(children, run_task, workers=1, **kwargs):
+    """
+    Trains every prefix once in a process pool. A prefix is submitted when
+    its parent finished, independent branches run concurrently.
+    Args:
+       children (dict): Prefix tree from `prefix_tree`
+       run_task (callable): Picklable function called as
+           run_task(prefix, parent_snapshot, has_children, **kwargs) in a
+           worker process, returning (snapshot, result), where snapshot is
+           the file holding the state after the prefix (or None)
+       workers (int): Number of worker processes
+    Returns:
+       results (dict): Prefix to the result of its task
+    """
+    results = {}
+    snapshots = {(): None}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        running = {}
+
+        def submit(parent):
+            for prefix in children[parent]:
+                myLogging.info(f"Sweep: training {'_'.join(prefix)}")
+                future = pool.submit(run_task, prefix, snapshots[parent], bool(children[prefix]), **kwargs)
+                running[future] = prefix
+
+        submit(())
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                prefix = running.pop(future)
+                snapshots[prefix], results[prefix] = future.result()
+                submit(prefix)
+    return results
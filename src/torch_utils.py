@@ -1,4 +1,5 @@
 import torch
+from src.checkpoint import save_checkpoint
 from src.logging import MyLog
 myLogging = MyLog().logger
 class FastTensorDataLoader:
@@ -48,9 +49,14 @@ class FastTensorDataLoader:
 
 
 class EarlyStopping:
-    def __init__(self, patience=10, verbose=False):
+    def __init__(self, patience=10, verbose=False, path='checkpoint.pt'):
+        """
+        :param path: where the best model is saved, None to not save it
+            (when the caller already keeps the best model)
+        """
         self.patience = patience
         self.verbose = verbose
+        self.path = path
         self.counter = 0
         self.best_score = None
         self.early_stop = False
@@ -77,9 +83,16 @@ class EarlyStopping:
         '''Saves model when validation loss decreases.'''
         if self.verbose:
             myLogging.info(f'Validation loss decreased ({self.val_loss_min:.6f} --> {val_loss:.6f}).  Saving model ...')
-        torch.save(model.state_dict(), 'checkpoint.pt')
+        if self.path is not None:
+            save_checkpoint(model.state_dict(), self.path)
         self.val_loss_min = val_loss
 
+    def state_dict(self):
+        return {'counter': self.counter, 'best_score': self.best_score, 'early_stop': self.early_stop,
+                'val_loss_min': self.val_loss_min}
 
-
-
+    def load_state_dict(self, state):
+        self.counter = state['counter']
+        self.best_score = state['best_score']
+        self.early_stop = state['early_stop']
+        self.val_loss_min = state['val_loss_min']
@@ -0,0 +1,128 @@
+import numpy as np
+from torch.nn import functional as F
+from src.torch_utils import EarlyStopping
+from src.metrics import EvaluationSession
+from src.propagation import AnnotationPropagator
+from src.logging import MyLog
+
+myLogging = MyLog().logger
+
+
+def batch_losses(preds, labels, batch_size):
+    """Binary cross-entropy losses of consecutive batches of `batch_size` rows"""
+    return [F.binary_cross_entropy(preds[i:i + batch_size], labels[i:i + batch_size]).item()
+            for i in range(0, len(preds), batch_size)]
+
+
+def evaluate_chunks(chunks, batch_size, metrics=None, outputs=None):
+    """
+    Evaluates predictions chunk by chunk without keeping the whole
+    prediction matrix
+    Args:
+       chunks (iterable): (preds, labels) tensors of consecutive chunks,
+           every chunk but the last a multiple of `batch_size` rows
+       metrics (StreamingMetrics): Updated with every chunk
+       outputs (list): Receives the predictions of every chunk as numpy arrays
+    Returns:
+       loss (float): Mean of the per-batch losses, as computed batch by batch
+    """
+    losses = []
+    for preds, labels in chunks:
+        losses += batch_losses(preds, labels, batch_size)
+        if metrics is not None:
+            metrics.update(preds, labels)
+        if outputs is not None:
+            outputs.append(preds.detach().cpu().numpy())
+    return sum(losses) / len(losses)
+
+
+def train_epoch(batches, loss_fn, optimizer, ewc=None):
+    """
+    Runs one training epoch
+    Args:
+       batches (iterable): Training batches
+       loss_fn (callable): Returns the loss of a batch
+       ewc (FlatEWC): Penalizes shared model changes and updates the Fisher
+           estimate after every backward pass
+    Returns:
+       loss (float): Mean training loss
+    """
+    train_loss = 0
+    steps = 0
+    for batch in batches:
+        loss = loss_fn(batch)
+        train_loss += loss.detach().item()
+        steps += 1
+        optimizer.zero_grad(set_to_none=False)
+        loss.backward()
+        if ewc is not None:
+            ewc.after_backward()
+        optimizer.step()
+    if ewc is not None:
+        ewc.end_epoch(steps)
+    return train_loss / max(1, steps)
+
+
+class ModelSelection(object):
+    """
+    Keeps the best validation score, saves the model when it improves and
+    stops training early
+    Args:
+        early_stop (string): Validation metric, 'loss' or 'fmax'
+        save_best (callable): Called whenever the validation score improves
+        ewc (FlatEWC): Its old parameters are updated with the best model
+            in 'running' mode
+        patience (int): Epochs without improvement before stopping
+        verbose (boolean): Log every validation score change of early stopping
+    """
+
+    def __init__(self, early_stop='loss', save_best=None, ewc=None, patience=15, verbose=True):
+        self.early_stop = early_stop
+        self.save_best = save_best
+        self.ewc = ewc
+        self.best_score = 10000.0
+        self.early_stopping = EarlyStopping(patience=patience, verbose=verbose, path=None)
+
+    def step(self, net, valid_loss, valid_fmax):
+        """Records an epoch, returns True when training should stop"""
+        valid_score = valid_loss if self.early_stop == 'loss' else -valid_fmax
+        if valid_score < self.best_score:
+            self.best_score = valid_score
+            myLogging.info('Saving model')
+            if self.save_best is not None:
+                self.save_best()
+            if self.ewc is not None and self.ewc.mode == 'running':
+                self.ewc.save_old_parameters()
+        self.early_stopping(valid_score, net)
+        if self.early_stopping.early_stop:
+            myLogging.info("Early stopping")
+            return True
+        return False
+
+    def state_dict(self):
+        return {'best_loss': self.best_score, 'early_stopping': self.early_stopping.state_dict()}
+
+    def load_state_dict(self, state):
+        self.best_score = state['best_loss']
+        self.early_stopping.load_state_dict(state['early_stopping'])
+
+
+def save_test_predictions(preds, go, terms_dict, test_df, out_file, data_root, ont, test_data_file):
+    """
+    Propagates test predictions with the ontology structure, writes them to
+    `out_file` and evaluates them
+    Returns:
+       fmax, avg_auc, aupr
+    """
+    preds = AnnotationPropagator(go, terms_dict).propagate(np.asarray(preds))
+    test_df['preds'] = list(preds)
+    test_df.to_pickle(out_file)
+    myLogging.info(f'Test Files Saved - {out_file}')
+    myLogging.info('########## evaluate ##########')
+    session = EvaluationSession.get(data_root, ont, test_data_file)
+    fmax, smin, tmax, wfmax, wtmax, avg_auc, aupr, avgic, fmax_spec_match = session.evaluate(preds)
+    myLogging.info(f'Fmax: {fmax:0.3f}, Smin: {smin:0.3f}, threshold: {tmax}, spec: {fmax_spec_match}')
+    myLogging.info(f'WFmax: {wfmax:0.3f}, threshold: {wtmax}')
+    myLogging.info(f'AUC: {avg_auc:0.3f}')
+    myLogging.info(f'AUPR: {aupr:0.3f}')
+    return fmax, avg_auc, aupr
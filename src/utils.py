@@ -4,6 +4,8 @@ import pandas as pd
 import numpy as np
 from xml.etree import ElementTree as ET
 import math
+from src.go_index import OntologyIndex
+from src.propagation import AncestorClosure
 
 BIOLOGICAL_PROCESS = 'GO:0008150'
 MOLECULAR_FUNCTION = 'GO:0003674'
@@ -110,6 +112,7 @@ class Ontology(object):
 
     def __init__(self, filename='data/go.obo', with_rels=False):
         self.ont = self.load(filename, with_rels)
+        self.closure = AncestorClosure(self.ont)
         self.ic = None
         self.ic_norm = 0.0
         self.ancestors = {}
@@ -148,123 +151,56 @@ class Ontology(object):
         return self.get_ic(go_id) / self.ic_norm
 
     def load(self, filename, with_rels):
-        ont = dict()
-        obj = None
-        with open(filename, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                if line == '[Term]':
-                    if obj is not None:
-                        ont[obj['id']] = obj
-                    obj = dict()
-                    obj['is_a'] = list()
-                    obj['part_of'] = list()
-                    obj['regulates'] = list()
-                    obj['alt_ids'] = list()
-                    obj['is_obsolete'] = False
-                    continue
-                elif line == '[Typedef]':
-                    if obj is not None:
-                        ont[obj['id']] = obj
-                    obj = None
-                else:
-                    if obj is None:
-                        continue
-                    l = line.split(": ")
-                    if l[0] == 'id':
-                        obj['id'] = l[1]
-                    elif l[0] == 'alt_id':
-                        obj['alt_ids'].append(l[1])
-                    elif l[0] == 'namespace':
-                        obj['namespace'] = l[1]
-                    elif l[0] == 'is_a':
-                        obj['is_a'].append(l[1].split(' ! ')[0])
-                    elif with_rels and l[0] == 'relationship':
-                        it = l[1].split()
-                        # add all1.csv types of relationships
-                        obj['is_a'].append(it[1])
-                    elif l[0] == 'name':
-                        obj['name'] = l[1]
-                    elif l[0] == 'is_obsolete' and l[1] == 'true':
-                        obj['is_obsolete'] = True
-            if obj is not None:
-                ont[obj['id']] = obj
-        for term_id in list(ont.keys()):
-            for t_id in ont[term_id]['alt_ids']:
-                ont[t_id] = ont[term_id]
-            if ont[term_id]['is_obsolete']:
-                del ont[term_id]
-        for term_id, val in ont.items():
-            if 'children' not in val:
-                val['children'] = set()
-            for p_id in val['is_a']:
-                if p_id in ont:
-                    if 'children' not in ont[p_id]:
-                        ont[p_id]['children'] = set()
-                    ont[p_id]['children'].add(term_id)
-     
-        return ont
+        return OntologyIndex.load(filename, with_rels)
 
     def get_ancestors(self, term_id):
         if term_id not in self.ont:
             return set()
         if term_id in self.ancestors:
             return self.ancestors[term_id]
-        term_set = set()
-        q = deque()
-        q.append(term_id)
-        while(len(q) > 0):
-            t_id = q.popleft()
-            if t_id not in term_set:
-                term_set.add(t_id)
-                for parent_id in self.ont[t_id]['is_a']:
-                    if parent_id in self.ont:
-                        q.append(parent_id)
+        term_set = self.closure.get_prop_terms([term_id])
         self.ancestors[term_id] = term_set
         return term_set
 
     def get_prop_terms(self, terms):
-        prop_terms = set()
-        for term_id in terms:
-            prop_terms |= self.get_ancestors(term_id)
-        return prop_terms
+        return self.closure.get_prop_terms(terms)
+
+    def propagate_annotations(self, annotations):
+        """
+        Propagates a column of annotations (one collection of GO ids per
+        protein) and returns a list of propagated GO id lists
+        """
+        return self.closure.propagate(annotations)
 
 
     def get_parents(self, term_id):
         if term_id not in self.ont:
             return set()
-        term_set = set()
-        for parent_id in self.ont[term_id]['is_a']:
-            if parent_id in self.ont:
-                term_set.add(parent_id)
-        return term_set
+        keys = self.ont.key_list
+        return set(keys[i] for i in self.ont.parent_keys(self.ont.index_of(term_id)).tolist())
 
 
     def get_namespace_terms(self, namespace):
-        terms = set()
-        for go_id, obj in self.ont.items():
-            if obj['namespace'] == namespace:
-                terms.add(go_id)
-        return terms
+        keys = self.ont.key_list
+        return set(keys[i] for i in self.ont.namespace_keys(namespace).tolist())
 
     def get_namespace(self, term_id):
-        return self.ont[term_id]['namespace']
+        return self.ont.namespace_of(self.ont.key_index[term_id])
     
     def get_term_set(self, term_id):
         if term_id not in self.ont:
             return set()
-        term_set = set()
-        q = deque()
-        q.append(term_id)
+        keys = self.ont.key_list
+        start = self.ont.index_of(term_id)
+        seen = {start}
+        q = deque([start])
         while len(q) > 0:
             t_id = q.popleft()
-            if t_id not in term_set:
-                term_set.add(t_id)
-                for ch_id in self.ont[t_id]['children']:
+            for ch_id in self.ont.child_keys(t_id).tolist():
+                if ch_id not in seen:
+                    seen.add(ch_id)
                     q.append(ch_id)
-        return term_set
+        return set(keys[i] for i in seen)
 
 def read_fasta(filename):
     """
@@ -0,0 +1,101 @@
+import sys, os
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+import numpy as np
+import torch as th
+import pytest
+
+dgl = pytest.importorskip('dgl')
+from src.block_cache import BlockCache
+from src.bundle import CSRLabels
+
+
+def random_graph(n_nodes=50, n_edges=300, n_terms=7, seed=0):
+    g = th.Generator().manual_seed(seed)
+    src = th.randint(0, n_nodes, (n_edges,), generator=g)
+    dst = th.randint(0, n_nodes, (n_edges,), generator=g)
+    graph = dgl.add_self_loop(dgl.graph((src, dst), num_nodes=n_nodes))
+    graph.ndata['feat'] = th.randn(n_nodes, 5, generator=g)
+    dense = (th.rand(n_nodes, n_terms, generator=g) < 0.3).numpy()
+    indptr = np.concatenate([[0], np.cumsum(dense.sum(1))])
+    labels = CSRLabels(indptr, np.nonzero(dense)[1], n_terms)
+    return graph, labels, th.from_numpy(dense).float()
+
+
+def dataloader_batches(graph, nids, batch_size):
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    dataloader = dgl.dataloading.DataLoader(
+        graph, nids, sampler, batch_size=batch_size, shuffle=False, drop_last=False, num_workers=0)
+    return list(dataloader)
+
+
+def batch_key(batch):
+    input_nodes, output_nodes, blocks = batch
+    return tuple(output_nodes.tolist())
+
+
+def global_edges(block):
+    src, dst = block.edges()
+    edges = th.stack([block.srcdata[dgl.NID][src.long()], block.dstdata[dgl.NID][dst.long()]], 1)
+    return sorted(map(tuple, edges.tolist()))
+
+
+def assert_same_batch(cached, expected, dense_labels=None):
+    """
+    Compares a cached batch with a DataLoader batch. DGL numbers the source
+    nodes that are not output nodes in a different order from run to run,
+    so those are compared as sets, and edges and features by graph node id.
+    """
+    input_nodes, output_nodes, blocks = cached
+    exp_input_nodes, exp_output_nodes, exp_blocks = expected
+    block, exp_block = blocks[0], exp_blocks[0]
+    n_dst = exp_block.num_dst_nodes()
+    assert th.equal(output_nodes, exp_output_nodes)
+    assert block.num_dst_nodes() == n_dst and block.num_src_nodes() == exp_block.num_src_nodes()
+    assert th.equal(input_nodes[:n_dst], exp_input_nodes[:n_dst])
+    assert sorted(input_nodes[n_dst:].tolist()) == sorted(exp_input_nodes[n_dst:].tolist())
+    assert th.equal(block.srcdata[dgl.NID], input_nodes)
+    assert th.equal(block.dstdata[dgl.NID], output_nodes)
+    assert global_edges(block) == global_edges(exp_block)
+    order, exp_order = th.argsort(input_nodes), th.argsort(exp_input_nodes)
+    assert th.equal(block.srcdata['feat'][order], exp_block.srcdata['feat'][exp_order])
+    assert th.equal(block.dstdata['feat'], exp_block.dstdata['feat'])
+    if dense_labels is not None:
+        assert th.equal(block.dstdata['label'], dense_labels[exp_output_nodes.long()])
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+@pytest.mark.parametrize('batch_size', [8, 64])
+def test_matches_dataloader(prefetch, batch_size):
+    graph, labels, dense = random_graph()
+    nids = th.randperm(graph.num_nodes(), generator=th.Generator().manual_seed(1))[:37]
+    expected = dataloader_batches(graph, nids, batch_size)
+    cache = BlockCache(graph, nids, batch_size, labels, prefetch=prefetch)
+    # The cached blocks are rebuilt identically in every epoch
+    for _ in range(2):
+        cached = list(cache)
+        assert len(cached) == len(expected) == len(cache)
+        for batch, exp_batch in zip(cached, expected):
+            assert_same_batch(batch, exp_batch, dense)
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_shuffle_permutes_batches(prefetch):
+    graph, labels, dense = random_graph()
+    nids = th.arange(graph.num_nodes())
+    expected = {batch_key(b): b for b in dataloader_batches(graph, nids, 8)}
+    th.manual_seed(0)
+    cached = list(BlockCache(graph, nids, 8, labels, shuffle=True, prefetch=prefetch))
+    assert sorted(batch_key(b) for b in cached) == sorted(expected)
+    for batch in cached:
+        assert_same_batch(batch, expected[batch_key(batch)], dense)
+
+
+def test_stops_early():
+    graph, labels, _ = random_graph()
+    cache = BlockCache(graph, th.arange(graph.num_nodes()), 4, labels, prefetch=2)
+    for i, batch in enumerate(cache):
+        if i == 1:
+            break
+    assert len(list(cache)) == len(cache)
@@ -0,0 +1,116 @@
+import sys, os
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+import threading
+import torch as th
+import torch.nn as nn
+import pytest
+from src.checkpoint import save_checkpoint, load_checkpoint, load_model, is_tensor_checkpoint, AsyncCheckpointWriter
+
+
+class Net(nn.Module):
+    def __init__(self, with_embeddings=True):
+        super().__init__()
+        self.shared = nn.Linear(4, 3)
+        self.norm = nn.LayerNorm(3)
+        self.head = nn.Linear(3, 2)
+        self.go_embed = nn.Embedding(10, 3) if with_embeddings else None
+
+
+def random_state(seed=0):
+    th.manual_seed(seed)
+    state = Net().state_dict()
+    state['counts'] = th.arange(5, dtype=th.int64)
+    state['mask'] = th.tensor([True, False, True])
+    state['half'] = th.randn(2, 2).half()
+    return state
+
+
+def assert_same(a, b):
+    assert list(a) == list(b)
+    for name in a:
+        assert a[name].dtype == b[name].dtype, name
+        assert a[name].shape == b[name].shape, name
+        assert th.equal(a[name], b[name]), name
+
+
+@pytest.mark.parametrize('legacy', [False, True])
+def test_round_trip(tmp_path, legacy):
+    state = random_state()
+    filename = str(tmp_path / 'model.th')
+    if legacy:
+        th.save(state, filename)
+    else:
+        save_checkpoint(state, filename, {'task': 'mf'})
+    assert is_tensor_checkpoint(filename) != legacy
+    assert_same(load_checkpoint(filename), state)
+
+
+@pytest.mark.parametrize('legacy', [False, True])
+def test_keys_and_skip(tmp_path, legacy):
+    state = random_state()
+    filename = str(tmp_path / 'model.th')
+    if legacy:
+        th.save(state, filename)
+    else:
+        save_checkpoint(state, filename)
+    keys = ['head.weight', 'go_embed.weight', 'missing']
+    assert list(load_checkpoint(filename, keys=keys)) == ['head.weight', 'go_embed.weight']
+    loaded = load_checkpoint(filename, skip=('go_embed', 'counts'))
+    assert sorted(loaded) == sorted(k for k in state if k.split('.')[0] not in ('go_embed', 'counts'))
+    assert list(load_checkpoint(filename, keys=keys, skip=('go_embed',))) == ['head.weight']
+    assert th.equal(load_checkpoint(filename, keys=['head.bias'])['head.bias'], state['head.bias'])
+
+
+@pytest.mark.parametrize('legacy', [False, True])
+def test_load_model_skips_missing_modules(tmp_path, legacy):
+    th.manual_seed(1)
+    trained = Net()
+    filename = str(tmp_path / 'model.th')
+    if legacy:
+        th.save(trained.state_dict(), filename)
+    else:
+        save_checkpoint(trained.state_dict(), filename)
+    net = load_model(Net(with_embeddings=False), filename)
+    expected = {k: v for k, v in trained.state_dict().items() if not k.startswith('go_embed')}
+    assert_same(net.state_dict(), expected)
+
+
+def test_async_writer_keeps_queue_order(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    written = []
+
+    def block(payload, filename):
+        started.set()
+        release.wait(5)
+
+    def record(payload, filename):
+        written.append((os.path.basename(filename), payload))
+
+    writer = AsyncCheckpointWriter()
+    writer.submit(str(tmp_path / 'busy'), block, None)
+    started.wait(5)
+    writer.submit(str(tmp_path / 'model.th'), record, 1)
+    writer.submit(str(tmp_path / 'state'), record, 1)
+    # A newer model replaces the pending one but stays ahead of the state
+    writer.submit(str(tmp_path / 'model.th'), record, 2)
+    release.set()
+    writer.close()
+    assert written == [('model.th', 2), ('state', 1)]
+
+
+def test_async_writer_skips_identical_checkpoints(tmp_path):
+    filename = str(tmp_path / 'model.th')
+    state = random_state()
+    writer = AsyncCheckpointWriter(keep=2)
+    writer.save_checkpoint(state, filename)
+    writer.flush()
+    writer.save_checkpoint(state, filename)
+    writer.flush()
+    assert not os.path.exists(filename + '.1')
+    state['head.bias'] += 1
+    writer.save_checkpoint(state, filename)
+    writer.close()
+    assert_same(load_checkpoint(filename), state)
+    assert not th.equal(load_checkpoint(filename + '.1')['head.bias'], state['head.bias'])
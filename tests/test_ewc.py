@@ -0,0 +1,148 @@
+import sys, os
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+import copy
+import torch as th
+import torch.nn as nn
+from torch.nn import functional as F
+from src.ewc import FlatEWC
+
+
+class ReferenceEWC(object):
+    """The original per-parameter EWC: autograd penalty and Fisher dictionaries"""
+
+    def __init__(self, model, lambda_ewc=0.5):
+        self.model = model
+        self.lambda_ewc = lambda_ewc
+        self.old_params = {}
+        self.fisher_information = {name: th.zeros_like(p) for name, p in model.named_parameters()}
+
+    def save_old_parameters(self):
+        for name, param in self.model.named_parameters():
+            self.old_params[name] = param.clone().detach()
+
+    def ewc_loss(self):
+        loss = 0
+        for name, param in self.model.named_parameters():
+            if name in self.old_params:
+                loss += (self.fisher_information[name] * (param - self.old_params[name]) ** 2).sum()
+        return self.lambda_ewc * loss
+
+    def accumulate(self):
+        for name, param in self.model.named_parameters():
+            self.fisher_information[name] += param.grad ** 2
+
+    def end_epoch(self, n_steps):
+        self.save_old_parameters()
+        for name in self.fisher_information:
+            self.fisher_information[name] /= n_steps
+
+
+def make_model(seed=0):
+    th.manual_seed(seed)
+    return nn.Sequential(nn.Linear(6, 8), nn.ReLU(), nn.Linear(8, 3), nn.Sigmoid())
+
+
+def make_batches(n_batches, seed=1):
+    g = th.Generator().manual_seed(seed)
+    return [(th.randn(5, 6, generator=g), (th.rand(5, 3, generator=g) < 0.5).float()) for _ in range(n_batches)]
+
+
+def flat_epoch(model, ewc, optimizer, batches):
+    for x, y in batches:
+        loss = F.binary_cross_entropy(model(x), y)
+        optimizer.zero_grad(set_to_none=False)
+        loss.backward()
+        ewc.after_backward()
+        optimizer.step()
+    ewc.end_epoch(len(batches))
+
+
+def reference_epoch(model, ewc, optimizer, batches):
+    for x, y in batches:
+        loss = F.binary_cross_entropy(model(x), y) + ewc.ewc_loss()
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        ewc.accumulate()
+    ewc.end_epoch(len(batches))
+
+
+def flat_fisher(ewc, model):
+    return dict(zip([name for name, _ in model.named_parameters()], th.split(ewc.fisher, [
+        p.numel() for p in model.parameters()])))
+
+
+def test_running_mode_matches_reference():
+    ref_model = make_model()
+    model = copy.deepcopy(ref_model)
+    ref_ewc = ReferenceEWC(ref_model, lambda_ewc=50.0)
+    ewc = FlatEWC(model, lambda_ewc=50.0, mode='running')
+    ref_opt = th.optim.SGD(ref_model.parameters(), lr=0.1)
+    opt = th.optim.SGD(model.parameters(), lr=0.1)
+    for epoch in range(4):
+        batches = make_batches(6, seed=epoch)
+        reference_epoch(ref_model, ref_ewc, ref_opt, batches)
+        flat_epoch(model, ewc, opt, batches)
+        if epoch == 1:
+            # Best model saved in the middle of training
+            ref_ewc.save_old_parameters()
+            ewc.save_old_parameters()
+        fisher = flat_fisher(ewc, model)
+        for (name, p), ref_p in zip(model.named_parameters(), ref_model.parameters()):
+            assert th.allclose(p, ref_p, atol=1e-6), name
+            assert th.allclose(fisher[name].view_as(p), ref_ewc.fisher_information[name], rtol=1e-5, atol=1e-9), name
+    # Move away from the anchor saved at the end of the last epoch
+    x, y = make_batches(1, seed=9)[0]
+    for m, optimizer in ((ref_model, ref_opt), (model, opt)):
+        optimizer.zero_grad()
+        F.binary_cross_entropy(m(x), y).backward()
+        optimizer.step()
+    assert ewc.penalty() > 0
+    assert abs(ewc.penalty() - ref_ewc.ewc_loss().item()) < 1e-6
+
+
+def test_penalty_gradient_matches_autograd():
+    ref_model = make_model()
+    model = copy.deepcopy(ref_model)
+    ewc = FlatEWC(model, lambda_ewc=2.0, mode='task')
+    g = th.Generator().manual_seed(3)
+    state = {'fisher': th.rand(ewc.fisher.shape, generator=g), 'anchor': ewc.flat.detach() + 0.1}
+    ewc.load_state_dict(state)
+    ref_ewc = ReferenceEWC(ref_model, lambda_ewc=2.0)
+    sizes = [p.numel() for p in ref_model.parameters()]
+    for (name, p), fisher, anchor in zip(ref_model.named_parameters(), th.split(state['fisher'], sizes),
+                                         th.split(state['anchor'], sizes)):
+        ref_ewc.fisher_information[name] = fisher.view_as(p)
+        ref_ewc.old_params[name] = anchor.view_as(p)
+    x, y = make_batches(1)[0]
+    ref_model.zero_grad()
+    (F.binary_cross_entropy(ref_model(x), y) + ref_ewc.ewc_loss()).backward()
+    F.binary_cross_entropy(model(x), y).backward()
+    ewc.after_backward()
+    for p, ref_p in zip(model.parameters(), ref_model.parameters()):
+        assert th.allclose(p.grad, ref_p.grad, atol=1e-7)
+
+
+def test_state_dict_resume_continues_identically():
+    model = make_model()
+    ewc = FlatEWC(model, lambda_ewc=5.0, mode='running')
+    opt = th.optim.Adam(model.parameters(), lr=0.01)
+    for epoch in range(2):
+        flat_epoch(model, ewc, opt, make_batches(4, seed=epoch))
+    saved = copy.deepcopy({'model': model.state_dict(), 'opt': opt.state_dict(), 'ewc': ewc.state_dict()})
+
+    resumed = make_model(seed=7)
+    resumed.load_state_dict(saved['model'])
+    resumed_ewc = FlatEWC(resumed, lambda_ewc=5.0, mode='running')
+    resumed_ewc.load_state_dict(saved['ewc'])
+    resumed_opt = th.optim.Adam(resumed.parameters(), lr=0.01)
+    resumed_opt.load_state_dict(saved['opt'])
+    for epoch in range(2, 4):
+        flat_epoch(model, ewc, opt, make_batches(4, seed=epoch))
+        flat_epoch(resumed, resumed_ewc, resumed_opt, make_batches(4, seed=epoch))
+    for p, q in zip(model.parameters(), resumed.parameters()):
+        assert th.equal(p, q)
+    assert th.equal(ewc.fisher, resumed_ewc.fisher)
+    assert th.equal(ewc.anchor, resumed_ewc.anchor)
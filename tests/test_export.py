@@ -0,0 +1,93 @@
+import sys, os
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+import numpy as np
+import torch as th
+import pytest
+from src.export import export_model, load_exported, block_inputs
+
+INPUT_LENGTH, HIDDEN_DIM, EMBED_DIM, NB_GOS = 12, 8, 6, 5
+
+
+def random_state(seed=0):
+    """Random `TaskSpecificModel` tensors with the checkpoint shapes of a one-head GATConv"""
+    g = th.Generator().manual_seed(seed)
+    conv = 'shared_model.shared_conv1.'
+    return {
+        'shared_model.shared_net1.linear.weight': th.randn(HIDDEN_DIM, INPUT_LENGTH, generator=g),
+        'shared_model.shared_net1.linear.bias': th.randn(HIDDEN_DIM, generator=g),
+        'shared_model.shared_net1.layer_norm.weight': th.rand(HIDDEN_DIM, generator=g) + 0.5,
+        'shared_model.shared_net1.layer_norm.bias': th.randn(HIDDEN_DIM, generator=g),
+        conv + 'fc.weight': th.randn(EMBED_DIM, HIDDEN_DIM, generator=g),
+        conv + 'attn_l': th.randn(1, 1, EMBED_DIM, generator=g),
+        conv + 'attn_r': th.randn(1, 1, EMBED_DIM, generator=g),
+        conv + 'bias': th.randn(EMBED_DIM, generator=g),
+        'task_net.0.weight': th.randn(NB_GOS, EMBED_DIM, generator=g),
+        'task_net.0.bias': th.randn(NB_GOS, generator=g),
+    }
+
+
+def dense_reference(state, features, src, dst, num_dst):
+    """The model equations with a dense attention matrix, in float64"""
+    s = {k: v.double() for k, v in state.items()}
+    conv = 'shared_model.shared_conv1.'
+    x = th.relu(features.double() @ s['shared_model.shared_net1.linear.weight'].T
+                + s['shared_model.shared_net1.linear.bias'])
+    x = th.nn.functional.layer_norm(x, (HIDDEN_DIM,), s['shared_model.shared_net1.layer_norm.weight'],
+                                    s['shared_model.shared_net1.layer_norm.bias'])
+    h = x @ s[conv + 'fc.weight'].T
+    el = h @ s[conv + 'attn_l'].reshape(-1)
+    er = h[:num_dst] @ s[conv + 'attn_r'].reshape(-1)
+    scores = th.full((num_dst, len(features)), float('-inf'), dtype=th.float64)
+    for u, v in zip(src.tolist(), dst.tolist()):
+        scores[v, u] = th.nn.functional.leaky_relu(el[u] + er[v], 0.2)
+    out = th.softmax(scores, dim=1) @ h + s[conv + 'bias']
+    return th.sigmoid(out @ s['task_net.0.weight'].T + s['task_net.0.bias'])
+
+
+def random_graph(n_nodes=20, n_edges=60, seed=0):
+    rng = np.random.default_rng(seed)
+    src = rng.integers(0, n_nodes, n_edges)
+    dst = rng.integers(0, n_nodes, n_edges)
+    # Self loops give every node an incoming edge, as in the training graphs
+    src = np.concatenate([src, np.arange(n_nodes)])
+    dst = np.concatenate([dst, np.arange(n_nodes)])
+    keep = np.unique(np.stack([src, dst], 1), axis=0, return_index=True)[1]
+    keep.sort()
+    return src[keep], dst[keep]
+
+
+def test_block_inputs_ordering():
+    src, dst = random_graph()
+    nids = np.array([7, 3, 15, 0])
+    src_nodes, block_src, block_dst = block_inputs(src, dst, nids)
+    # Output nodes come first in the given order, then the other sources sorted
+    assert src_nodes[:len(nids)].tolist() == nids.tolist()
+    others = src_nodes[len(nids):]
+    assert others.tolist() == sorted(set(src[np.isin(dst, nids)].tolist()) - set(nids.tolist()))
+    # The block edges are the graph edges into the output nodes, in graph order
+    edges = np.flatnonzero(np.isin(dst, nids))
+    assert src_nodes[block_src].tolist() == src[edges].tolist()
+    assert nids[block_dst].tolist() == dst[edges].tolist()
+
+
+@pytest.mark.parametrize('nids', [[7, 3, 15, 0], list(range(20))])
+def test_exported_model_matches_dense_equations(tmp_path, nids):
+    state = random_state()
+    out_file = str(tmp_path / 'model.pt')
+    export_model(state, out_file, {'terms': ['GO:%07d' % i for i in range(NB_GOS)]})
+    model, meta = load_exported(out_file)
+    assert meta['input_length'] == INPUT_LENGTH and meta['nb_gos'] == NB_GOS
+    assert len(meta['terms']) == NB_GOS
+
+    src, dst = random_graph()
+    feat = th.randn(20, INPUT_LENGTH, generator=th.Generator().manual_seed(1))
+    src_nodes, block_src, block_dst = block_inputs(src, dst, nids)
+    features = feat[th.from_numpy(src_nodes)]
+    block_src, block_dst = th.from_numpy(block_src), th.from_numpy(block_dst)
+    with th.no_grad():
+        preds = model(features, block_src, block_dst, len(nids))
+    expected = dense_reference(state, features, block_src, block_dst, len(nids))
+    assert preds.shape == (len(nids), NB_GOS)
+    assert th.allclose(preds.double(), expected, atol=1e-6)
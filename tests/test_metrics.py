@@ -0,0 +1,111 @@
+import sys, os
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+import numpy as np
+import pytest
+from src.metrics import ProteinCentricEvaluator, evaluate_annotations, summarize_curves
+from src.utils import FUNC_DICT, NAMESPACES
+
+TOL = 1e-9
+
+
+class ToyOntology(object):
+    """Stand-in for `utils.Ontology` with fixed IC values"""
+
+    def __init__(self, ont, n_terms, rng):
+        self.root = FUNC_DICT[ont]
+        self.terms = [self.root] + [f'GO:{i:07d}' for i in range(1, n_terms)]
+        self.ic = {t: float(v) for t, v in zip(self.terms, rng.uniform(0.0, 5.0, n_terms))}
+        self.ic[self.root] = 0.0
+        self.ic_norm = max(self.ic.values())
+
+    def get_namespace_terms(self, namespace):
+        return set(self.terms)
+
+    def get_ic(self, go_id):
+        return self.ic[go_id]
+
+    def get_norm_ic(self, go_id):
+        return self.get_ic(go_id) / self.ic_norm
+
+
+def make_case(seed, ont='mf', n_proteins=40, n_terms=30):
+    rng = np.random.RandomState(seed)
+    go = ToyOntology(ont, n_terms, rng)
+    # One column outside the sub-ontology, which the evaluation ignores
+    terms = go.terms + ['GO:9999999']
+    real_annots, spec_annots = [], []
+    for i in range(n_proteins):
+        k = 0 if i % 7 == 0 else rng.randint(1, 8)
+        annots = set(rng.choice(terms, k, replace=False))
+        real_annots.append(annots)
+        spec_annots.append(set(list(annots)[:rng.randint(0, len(annots) + 1)]))
+    # Two decimals give many ties and scores equal to grid thresholds
+    preds = np.round(rng.uniform(0.0, 1.0, (n_proteins, len(terms))), 2)
+    preds[rng.uniform(size=preds.shape) < 0.05] = np.nan
+    return go, terms, real_annots, spec_annots, preds
+
+
+def threshold_loop(go, terms, ont, real_annots, spec_annots, preds, thresholds):
+    """Per-threshold evaluation as in the original `compute_metrics` loop"""
+    go_set = go.get_namespace_terms(NAMESPACES[ont])
+    go_set.discard(FUNC_DICT[ont])
+    labels = [set(filter(lambda y: y in go_set, annots)) for annots in real_annots]
+    rows = []
+    for threshold in thresholds:
+        pred_annots = []
+        for i in range(len(preds)):
+            above = set(terms[j] for j in np.argwhere(preds[i] >= threshold).flatten())
+            pred_annots.append(set(filter(lambda y: y in go_set, above)))
+        f, p, r, s, ru, mi, _, _, avg_ic, wf = evaluate_annotations(go, labels, pred_annots)
+        spec_match = sum(len(spec_annots[i].intersection(pred_annots[i])) for i in range(len(preds)))
+        rows.append({'f': f, 'p': p, 'r': r, 's': s, 'ru': ru, 'mi': mi, 'avg_ic': avg_ic, 'wf': wf,
+                     'spec_match': spec_match})
+    return rows
+
+
+def check_point(curves, i, expected):
+    for name, value in expected.items():
+        assert curves[name][i] == pytest.approx(value, abs=TOL), name
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('chunk_size', [1, 97, 2 ** 20])
+def test_curves_exact_matches_threshold_loop(seed, chunk_size):
+    go, terms, real_annots, spec_annots, preds = make_case(seed)
+    evaluator = ProteinCentricEvaluator(go, terms, 'mf', real_annots, spec_annots)
+    curves = evaluator.curves_exact(preds, chunk_size=chunk_size)
+    thresholds = curves['threshold']
+    distinct = np.unique(preds[~np.isnan(preds)])
+    assert np.array_equal(thresholds[:-1], distinct) and np.isinf(thresholds[-1])
+    expected = threshold_loop(go, terms, 'mf', real_annots, spec_annots, preds, thresholds)
+    for i, row in enumerate(expected):
+        check_point(curves, i, row)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_curves_grid_matches_threshold_loop(seed):
+    go, terms, real_annots, spec_annots, preds = make_case(seed)
+    evaluator = ProteinCentricEvaluator(go, terms, 'mf', real_annots, spec_annots)
+    grid = [t / 100.0 for t in range(0, 101)]
+    curves = evaluator.curves(preds, chunk_size=97)
+    expected = threshold_loop(go, terms, 'mf', real_annots, spec_annots, preds, grid)
+    for i, row in enumerate(expected):
+        check_point(curves, i, row)
+
+    # Scores have two decimals, so the exact curves contain the grid optimum
+    fmax, smin, tmax, wfmax, wtmax, _, avgic, spec_match = summarize_curves(curves)
+    exact = summarize_curves(evaluator.curves_exact(preds))
+    assert exact[0] == pytest.approx(fmax, abs=TOL)
+    assert exact[1] <= smin + TOL
+    assert exact[3] >= wfmax - TOL
+
+
+def test_curves_exact_without_scores():
+    go, terms, real_annots, spec_annots, preds = make_case(0, n_proteins=5)
+    preds[:] = np.nan
+    evaluator = ProteinCentricEvaluator(go, terms, 'mf', real_annots, spec_annots)
+    curves = evaluator.curves_exact(preds)
+    assert len(curves['threshold']) == 1
+    assert curves['f'][0] == 0.0 and curves['spec_match'][0] == 0
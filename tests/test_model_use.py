@@ -0,0 +1,63 @@
+import sys, os
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+import torch as th
+import pytest
+
+dgl = pytest.importorskip('dgl')
+from src.model_use import SharedCoreDeepGATModel
+
+
+def random_graph(n_nodes=60, n_edges=400, seed=0):
+    g = th.Generator().manual_seed(seed)
+    src = th.randint(0, n_nodes, (n_edges,), generator=g)
+    # Most edges end in a few hub nodes so chunks cut through their in-edges
+    dst = th.where(th.rand(n_edges, generator=g) < 0.5, th.randint(0, 4, (n_edges,), generator=g),
+                   th.randint(0, n_nodes, (n_edges,), generator=g))
+    graph = dgl.add_self_loop(dgl.graph((src, dst), num_nodes=n_nodes))
+    graph.ndata['feat'] = th.randn(n_nodes, 10, generator=g)
+    return graph
+
+
+def make_model():
+    th.manual_seed(0)
+    model = SharedCoreDeepGATModel(10, 16, 8)
+    model.eval()
+    return model
+
+
+def sampled(model, graph, nids, batch_size):
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    dataloader = dgl.dataloading.DataLoader(
+        graph, nids, sampler, batch_size=batch_size, shuffle=False, drop_last=False, num_workers=0)
+    return th.cat([model.forward_shared(blocks[0].srcdata['feat'], blocks[0]) for _, _, blocks in dataloader])
+
+
+@pytest.mark.parametrize('chunk_nodes,chunk_edges', [(4096, 2 ** 15), (7, 10), (1, 1)])
+def test_inference_matches_sampled_forward(chunk_nodes, chunk_edges):
+    graph = random_graph()
+    model = make_model()
+    nids = th.randperm(graph.num_nodes(), generator=th.Generator().manual_seed(1))[:45]
+    src, dst = graph.in_edges(nids)
+    # Some source nodes feed output nodes of several chunks
+    assert len(th.unique(src)) < len(src)
+    with th.no_grad():
+        expected = sampled(model, graph, nids, batch_size=16)
+        layerwise = model.inference(graph, nids, chunk_nodes=chunk_nodes, chunk_edges=chunk_edges)
+    assert layerwise.shape == (len(nids), 8)
+    assert th.allclose(layerwise, expected, atol=1e-5)
+
+
+def test_inference_features_and_empty_nids():
+    graph = random_graph()
+    model = make_model()
+    features = th.randn(graph.num_nodes(), 10)
+    nids = th.arange(0, graph.num_nodes(), 3)
+    with th.no_grad():
+        layerwise = model.inference(graph, nids, features=features, chunk_edges=20)
+        graph.ndata['feat'] = features
+        expected = sampled(model, graph, nids, batch_size=64)
+        empty = model.inference(graph, th.tensor([], dtype=th.int64))
+    assert th.allclose(layerwise, expected, atol=1e-5)
+    assert empty.shape == (0, 8)
@@ -0,0 +1,123 @@
+import sys, os
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+import stat
+import textwrap
+import numpy as np
+import pytest
+from src.similarity import DiamondSearch, HIT_FIELDS, first_hits
+
+# Stand-in for `diamond blastp`: hits every database sequence with the same
+# first residue, best first, and logs the number of queries of every run
+FAKE_DIAMOND = '''\
+import sys
+args = sys.argv[1:]
+database, queries, out = (args[args.index(flag) + 1] for flag in ('-d', '-q', '-o'))
+
+def read_fasta(filename):
+    entries, name = [], None
+    for line in open(filename):
+        line = line.strip()
+        if line.startswith('>'):
+            name = line[1:]
+        elif line:
+            entries.append((name, line))
+    return entries
+
+targets = read_fasta(database)
+queries = read_fasta(queries)
+with open(database + '.runs', 'a') as f:
+    f.write(f'{{len(queries)}}\\n')
+with open(out, 'w') as f:
+    for q_id, q_seq in queries:
+        hits = []
+        for t_id, t_seq in targets:
+            if t_seq[0] != q_seq[0]:
+                continue
+            same = sum(a == b for a, b in zip(q_seq, t_seq))
+            length = min(len(q_seq), len(t_seq))
+            hits.append((same, t_id, length))
+        hits.sort(key=lambda x: -x[0])
+        for same, t_id, length in hits:
+            f.write('\\t'.join(map(str, [
+                q_id, t_id, f'{{100.0 * same / length:.1f}}', length, length - same, 0,
+                1, length, 1, length, f'{{10.0 ** -same:.3g}}', f'{{2.5 * same:.1f}}'])) + '\\n')
+'''
+
+DATABASE = [('P1', 'MKVLAT'), ('P2', 'MKVLGG'), ('P3', 'AKKLLT'), ('P4', 'MAAAAA')]
+
+
+@pytest.fixture
+def search_env(tmp_path):
+    diamond = tmp_path / 'diamond'
+    diamond.write_text(f'#!{sys.executable}\n' + FAKE_DIAMOND.format())
+    diamond.chmod(diamond.stat().st_mode | stat.S_IEXEC)
+    database = tmp_path / 'db.fa'
+    database.write_text(''.join(f'>{p}\n{s}\n' for p, s in DATABASE))
+    return str(database), str(tmp_path / 'cache'), str(diamond)
+
+
+def runs(database):
+    if not os.path.exists(database + '.runs'):
+        return []
+    return [int(x) for x in open(database + '.runs').read().split()]
+
+
+def expected_hits(query, seq):
+    rows = []
+    for t_id, t_seq in DATABASE:
+        if t_seq[0] != seq[0]:
+            continue
+        same = sum(a == b for a, b in zip(seq, t_seq))
+        rows.append((same, t_id, min(len(seq), len(t_seq))))
+    rows.sort(key=lambda x: -x[0])
+    return [(query, t_id, same, length) for same, t_id, length in rows]
+
+
+def check_hits(hits, queries):
+    assert hits.dtype.names == ('query',) + tuple(name for name, _ in HIT_FIELDS)
+    assert hits['identity'].dtype == np.float32 and hits['evalue'].dtype == np.float64
+    assert hits['length'].dtype == np.int32 and hits['bitscore'].dtype == np.float32
+    expected = [row for query, seq in queries for row in expected_hits(query, seq)]
+    assert len(hits) == len(expected)
+    for hit, (query, target, same, length) in zip(hits, expected):
+        assert hit['query'] == query and hit['target'] == target
+        assert hit['length'] == length and hit['mismatches'] == length - same
+        assert hit['identity'] == pytest.approx(round(100.0 * same / length, 1))
+        assert hit['evalue'] == pytest.approx(float(f'{10.0 ** -same:.3g}'))
+        assert hit['bitscore'] == pytest.approx(2.5 * same)
+        assert (hit['qstart'], hit['qend'], hit['sstart'], hit['send']) == (1, length, 1, length)
+
+
+def test_search_batches_and_caches(search_env):
+    database, cache_dir, diamond = search_env
+    queries = [('Q1', 'MKVLAA'), ('Q2', 'AKKLLA'), ('Q3', 'MKVLAA'), ('Q4', 'WWWW')]
+    search = DiamondSearch(database, cache_dir=cache_dir, diamond=diamond, options=())
+    hits = search.search([q for q, _ in queries], [s for _, s in queries])
+    # Duplicate sequences are searched once, all in one run
+    assert runs(database) == [3]
+    check_hits(hits, queries)
+    assert first_hits(hits) == {'Q1': 'P1', 'Q2': 'P3', 'Q3': 'P1'}
+
+    # A new instance reads the cache and only searches the new sequence
+    search = DiamondSearch(database, cache_dir=cache_dir, diamond=diamond, options=())
+    more = [('Q5', 'MAAAAT'), ('Q2', 'AKKLLA'), ('Q1', 'MKVLAA')]
+    hits = search.search([q for q, _ in more], [s for _, s in more])
+    assert runs(database) == [3, 1]
+    check_hits(hits, more)
+
+    # Everything cached: no run
+    hits = search.search(['Q6', 'Q7'], ['MAAAAT', 'WWWW'])
+    assert runs(database) == [3, 1]
+    check_hits(hits, [('Q6', 'MAAAAT'), ('Q7', 'WWWW')])
+    assert len(search.search([], [])) == 0
+
+
+def test_search_without_cache_dir(search_env):
+    database, _, diamond = search_env
+    search = DiamondSearch(database, diamond=diamond, options=())
+    check_hits(search.search(['Q1'], ['MKVLAA']), [('Q1', 'MKVLAA')])
+    check_hits(search.search(['Q1', 'Q2'], ['MKVLAA', 'MAAAAT']), [('Q1', 'MKVLAA'), ('Q2', 'MAAAAT')])
+    assert runs(database) == [1, 1]
+    check_hits(search.search(['Q3'], ['WWWW']), [('Q3', 'WWWW')])
@@ -4,19 +4,212 @@ import os
 import torch as th
 import numpy as np
 from torch.nn import functional as F
-import math
+import itertools
 from torch.optim.lr_scheduler import MultiStepLR
-from src.torch_utils import EarlyStopping
-from src.utils import Ontology, propagate_annots
+from src.checkpoint import save_checkpoint, load_model, CheckpointManager, AsyncCheckpointWriter, rng_state, set_rng_state
+from src.utils import Ontology
 from src.model_use import SharedCoreDeepGATModel,TaskSpecificModel
-from src.data import load_ppi_data,load_normal_forms
-from src.metrics import compute_roc, evaluate
-from multiprocessing import Pool
-from functools import partial
-import dgl
+from src.data import load_normal_forms
+from src.bundle import load_bundle
+from src.features import MODEL_FEATURES, features_dim
+from src.metrics import compute_roc, StreamingMetrics
+from src.ewc import FlatEWC, EWC_MODES
+from src.block_cache import BlockCache
+from src.frozen import set_frozen, shared_embeddings, fit_head
+from src.training import evaluate_chunks, train_epoch, ModelSelection, save_test_predictions
 from src.utils import validate_subontology
 from src.logging import MyLog
 myLogging = MyLog().logger
+
+
+def predict_batches(net, graph, nids, dataloader, layerwise=True, chunk_size=16384):
+    """
+    Predicts the nodes `nids` in order, either with layer-wise inference over
+    the whole graph in chunks of output nodes or batch by batch with the
+    sampled blocks of `dataloader`
+    Yields:
+       output_nodes, preds
+    """
+    if layerwise:
+        for i in range(0, len(nids), chunk_size):
+            output_nodes = nids[i:i + chunk_size]
+            yield output_nodes, net.inference(graph, output_nodes)
+        return
+    with ck.progressbar(length=len(dataloader), show_pos=True) as bar:
+        for input_nodes, output_nodes, blocks in dataloader:
+            bar.update(1)
+            yield output_nodes, net(input_nodes, output_nodes, blocks)
+
+
+def evaluate_nodes(net, graph, nids, dataloader, labels, batch_size, layerwise=True, metrics=None, outputs=None):
+    """
+    Evaluates the nodes `nids` chunk by chunk (see `predict_batches` and
+    `training.evaluate_chunks`), gathering their labels per chunk
+    """
+    # Chunks hold whole batches, so the losses are those of the training batch size
+    chunk_size = batch_size * max(1, 16384 // batch_size)
+    chunks = ((preds, labels[output_nodes])
+              for output_nodes, preds in predict_batches(net, graph, nids, dataloader, layerwise, chunk_size))
+    return evaluate_chunks(chunks, batch_size, metrics, outputs)
+
+
+def train_task(ont, shared_model, ewc, model_file, out_file, data_root, model_name, test_data_name, batch_size,
+               epochs, device, load=False, early_stop='loss', ewc_samples=100, layerwise=True,
+               shuffle_batches=False, checkpoint=None, resume=None, writer=None, frozen=False, finetune_epochs=0,
+               head_batch_size=1024, head_lr=1e-3):
+    """
+    Trains (or with `load` only evaluates) the task of one sub-ontology on
+    top of the current shared model and EWC state, saves the best model to
+    `model_file` and the propagated test predictions to `out_file`
+    Args:
+       checkpoint (callable): Called as checkpoint(epoch, task_state) after
+           every epoch with the state needed to continue the task
+       resume (dict): A `task_state` to continue from, with the random
+           states under 'rng'
+       writer (AsyncCheckpointWriter): Save the best model in the background
+       frozen (boolean): Keep the shared model frozen and train only the
+           task head on cached shared embeddings, then train the whole
+           model for `finetune_epochs` epochs
+       head_batch_size (int): Batch size of the frozen head training
+       head_lr (float): Learning rate of the frozen head training
+    Returns:
+       result (list): ont, Fmax, average AUC and AUPR on the test set
+    """
+    features = MODEL_FEATURES[model_name]
+    features_column = '_'.join(features)
+    features_length = features_dim(features)
+    go_file = f'{data_root}/go.obo'
+    go_norm_file = f'{data_root}/go.norm'
+    go = Ontology(go_file, with_rels=True)
+    # Load the datasets
+    ppi_graph_file = f'ppi_{test_data_name}.bin'
+    test_data_file = f'{test_data_name}_data.pkl'
+
+    mfs_dict, terms_dict, graph, train_nids, valid_nids, test_nids, data, labels, test_df = load_bundle(
+        data_root, ont, features_length, features_column, test_data_file, ppi_graph_file)
+    n_terms = len(terms_dict)
+
+    if features_column == 'prop_annotations':
+        features_length = len(mfs_dict)
+
+    test_labels = labels[test_nids].numpy()
+
+    labels = labels.to(device)
+    graph = graph.to(device)
+
+    train_nids = train_nids.to(device)
+    valid_nids = valid_nids.to(device)
+    test_nids = test_nids.to(device)
+
+    _, _, _, _, relations, zero_classes = load_normal_forms(
+        go_norm_file, terms_dict)
+    n_rels = len(relations)
+    myLogging.info(n_rels)
+    n_zeros = len(zero_classes)
+    myLogging.info(n_zeros)
+    net = TaskSpecificModel(shared_model, features_length, n_terms,n_zeros,n_rels, device).to(device)
+    myLogging.info(net)
+    train_dataloader = BlockCache(graph, train_nids, batch_size, labels, shuffle=shuffle_batches)
+    valid_dataloader = BlockCache(graph, valid_nids, batch_size)
+    test_dataloader = BlockCache(graph, test_nids, batch_size)
+    optimizer = th.optim.Adam(net.parameters(), lr=1e-5)
+    scheduler = MultiStepLR(optimizer, milestones=[20, 40, 60, 80, 120], gamma=0.1)
+
+    def save_best():
+        if writer is not None:
+            writer.save_checkpoint(net.state_dict(), model_file)
+        else:
+            save_checkpoint(net.state_dict(), model_file)
+
+    selection = ModelSelection(early_stop, save_best, ewc)
+    start_epoch = 0
+    if resume is not None:
+        net.task_net.load_state_dict(resume['task_net'])
+        optimizer.load_state_dict(resume['optimizer'])
+        scheduler.load_state_dict(resume['scheduler'])
+        selection.load_state_dict(resume)
+        start_epoch = resume['epoch']
+        set_rng_state(resume['rng'])
+        myLogging.info(f'Resuming {ont} at epoch {start_epoch}')
+
+    train_epochs = epochs
+    if frozen and not load:
+        if resume is None:
+            myLogging.info(f"##########Training the {ont} head on frozen shared embeddings##########")
+            set_frozen(shared_model)
+            nids = th.cat([train_nids, valid_nids])
+            embeddings = shared_embeddings(shared_model, graph, nids, f'{os.path.splitext(model_file)[0]}.emb')
+            # Views of the memory-mapped cache, copied only when moved to another device
+            train_x = th.from_numpy(embeddings[:len(train_nids)]).to(device)
+            valid_x = th.from_numpy(embeddings[len(train_nids):]).to(device)
+            selection.best_score = fit_head(
+                net.task_net, train_x, labels[train_nids], valid_x, labels[valid_nids], epochs, head_batch_size,
+                batch_size, early_stop, save_best, lr=head_lr)
+            del embeddings, train_x, valid_x
+            set_frozen(shared_model, False)
+            if writer is not None:
+                writer.flush()
+            load_model(net, model_file, device)
+        train_epochs = finetune_epochs
+    def batch_loss(batch):
+        input_nodes, output_nodes, blocks = batch
+        return F.binary_cross_entropy(net(input_nodes, output_nodes, blocks), blocks[-1].dstdata['label'])
+
+    if not load:
+        myLogging.info(f"##########Training  for {ont}...##########")
+        for epoch in range(start_epoch, train_epochs):
+            net.train()
+            with ck.progressbar(train_dataloader, show_pos=True) as batches:
+                train_loss = train_epoch(batches, batch_loss, optimizer, ewc)
+            myLogging.info('Validation')
+            net.eval()
+            with th.no_grad():
+                valid_metrics = StreamingMetrics()
+                valid_loss = evaluate_nodes(
+                    net, graph, valid_nids, valid_dataloader, labels, batch_size, layerwise, valid_metrics)
+                roc_auc = valid_metrics.roc_auc()
+                valid_fmax, valid_tmax = valid_metrics.fmax()
+                myLogging.info(f'Epoch {epoch}: Loss - {train_loss}, Valid loss - {valid_loss}, AUC - {roc_auc}, '
+                               f'Fmax - {valid_fmax:0.3f} ({valid_tmax})')
+            if selection.step(net, valid_loss, valid_fmax):
+                break
+            scheduler.step()
+            if checkpoint is not None:
+                task_state = {
+                    'epoch': epoch + 1,
+                    'task_net': net.task_net.state_dict(),
+                    'optimizer': optimizer.state_dict(),
+                    'scheduler': scheduler.state_dict(),
+                }
+                task_state.update(selection.state_dict())
+                checkpoint(epoch, task_state)
+    # Loading best model
+    myLogging.info('Loading the best model')
+    myLogging.info('########## Test the model ##########')
+    if writer is not None:
+        writer.flush()
+    load_model(net, model_file, device)
+    if not load:
+        net.eval()
+        ewc.consolidate(batch_loss, itertools.islice(train_dataloader, ewc_samples))
+    num_params = sum(p.numel() for p in net.parameters())
+    print(f"Total Params Numbers: {num_params}")
+    net.eval()
+    with th.no_grad():
+        valid_loss = evaluate_nodes(net, graph, valid_nids, valid_dataloader, labels, batch_size, layerwise)
+        outputs = []
+        test_loss = evaluate_nodes(
+            net, graph, test_nids, test_dataloader, labels, batch_size, layerwise, outputs=outputs)
+        preds = np.concatenate(outputs)
+        roc_auc = compute_roc(test_labels, preds)
+    myLogging.info(f'Valid Loss - {valid_loss}, Test Loss - {test_loss}, AUC - {roc_auc}')
+    myLogging.info(
+        f'model_file:{model_file}, ont:{ont}, batch_size:{batch_size}, epochs:{epochs}, script:{load}, device:{device}')
+    fmax, avg_auc, aupr = save_test_predictions(
+        preds, go, terms_dict, test_df, out_file, data_root, ont, test_data_file)
+    return [ont, fmax, avg_auc, aupr]
+
+
 @ck.command()
 @ck.option(
     '--data-root', '-dr', default='data',
@@ -28,9 +221,7 @@ myLogging = MyLog().logger
     '--results-dir', '-rd', default='results',
     help='Results folder')
 @ck.option(
-    '--model-name', '-m', type=ck.Choice([
-        'LifeLongGo_esm_pdb2', 'LifeLongGo_esm', 'LifeLongGo_pdb2',
-        'LifeLongGo_esmS', 'LifeLongGo_esmS_pdb2']),
+    '--model-name', '-m', type=ck.Choice(list(MODEL_FEATURES)),
     default='LifeLongGo_esm_pdb2',
     help='Prediction model name')
 @ck.option(
@@ -52,7 +243,46 @@ myLogging = MyLog().logger
 @ck.option(
     '--sub-ontologies', '-so', default='bp_mf_cc',
     help='Sub-ontologies list (comma-separated)')
-def main(data_root, model_dir, results_dir, model_name, model_id, test_data_name, batch_size, epochs, load, device, sub_ontologies):
+@ck.option(
+    '--early-stop', '-es', default='loss', type=ck.Choice(['loss', 'fmax']),
+    help='Validation metric for model selection and early stopping')
+@ck.option(
+    '--ewc-mode', '-em', default='running', type=ck.Choice(EWC_MODES),
+    help='EWC Fisher estimation: every step (running), once per task (task) or online with decay')
+@ck.option(
+    '--ewc-lambda', '-el', default=0.5, help='EWC penalty weight')
+@ck.option(
+    '--ewc-decay', '-ed', default=0.9, help='Fisher decay across tasks of online EWC')
+@ck.option(
+    '--ewc-samples', '-esm', default=100, help='Training batches used to estimate Fisher at task end')
+@ck.option(
+    '--ewc-fp16', is_flag=True, help='Store Fisher and old parameters in float16')
+@ck.option(
+    '--layerwise/--sampled', default=True,
+    help='Validate and test with layer-wise full-graph inference or with sampled blocks')
+@ck.option(
+    '--shuffle-batches', is_flag=True, help='Reshuffle the order of the cached training batches every epoch')
+@ck.option(
+    '--checkpoint-every', '-ce', default=1,
+    help='Save the full training state every this many epochs (0: only between tasks)')
+@ck.option(
+    '--resume', is_flag=True, help='Continue an interrupted run from its saved training state')
+@ck.option(
+    '--keep-checkpoints', '-kc', default=1, help='Versions of every model checkpoint to keep')
+@ck.option(
+    '--frozen-backbone', is_flag=True,
+    help='After the first task, train only the task heads on cached shared embeddings')
+@ck.option(
+    '--finetune-epochs', '-fe', default=0, help='Epochs of whole-model training after a frozen head')
+@ck.option(
+    '--head-batch-size', '-hbs', default=1024, help='Batch size of the frozen head training')
+@ck.option(
+    '--head-lr', '-hlr', default=1e-3,
+    help='Learning rate of the frozen head training, higher than the whole-model rate for the larger batches')
+def main(data_root, model_dir, results_dir, model_name, model_id, test_data_name, batch_size, epochs, load, device, sub_ontologies,
+         early_stop, ewc_mode, ewc_lambda, ewc_decay, ewc_samples, ewc_fp16, layerwise,
+         shuffle_batches, checkpoint_every, resume, keep_checkpoints, frozen_backbone, finetune_epochs,
+         head_batch_size, head_lr):
     """
     This script is used to train LifeLongGo models
     """
@@ -60,199 +290,57 @@ def main(data_root, model_dir, results_dir, model_name, model_id, test_data_name
     if not os.path.exists(results_dir): os.makedirs(results_dir)
     myLogging.info(f"Is load :{load}")
     ontList = sub_ontologies
+    features_length = features_dim(MODEL_FEATURES[model_name])
+    base_model_name = model_name
     model_name = f'{model_name}_{ontList}'
     myLogging.info(model_name)
-    if model_name.find('esmS_pdb2') != -1:
-        features_length = 1280 + 20
-        features_column = 'esmS_pdb2'
-    elif model_name.find('esm_pdb2') != -1:
-        features_length = 2560 + 20
-        features_column = 'esm_pdb2'
-    elif model_name.find('esm') != -1:
-        features_length = 2560
-        features_column = 'esm'
-    elif model_name.find('esmS') != -1:
-        features_length = 1280
-        features_column = 'esmS'
-    elif model_name.find('pdb2') != -1:
-        features_length = 20
-        features_column = 'pdb2'
     shared_model = SharedCoreDeepGATModel(shared_input_length=features_length, shared_hidden_dim=2560, shared_embed_dim=2560).to(device)
+    ewc = FlatEWC(shared_model, lambda_ewc=ewc_lambda, mode=ewc_mode, decay=ewc_decay,
+                  dtype=th.float16 if ewc_fp16 else th.float32)
     results = []
     csv_file = f'{results_dir}/{model_name}_predictions_{test_data_name}.csv'
     sub_ontologies = validate_subontology(sub_ontologies)
     myLogging.info(sub_ontologies)
-    for ont in sub_ontologies:
+    checkpoint_writer = AsyncCheckpointWriter(keep=keep_checkpoints)
+    manager = CheckpointManager(f'{model_dir}/{model_name}_{test_data_name}.state', checkpoint_every, checkpoint_writer)
+
+    def lifelong_state(task, task_state=None):
+        return {'task': task, 'results': list(results), 'shared_model': shared_model.state_dict(),
+                'ewc': ewc.state_dict(), 'task_state': task_state, 'rng': rng_state()}
+
+    state = manager.load() if resume and not load else None
+    start_task = 0
+    if state is not None:
+        start_task = state['task']
+        results = state['results']
+        shared_model.load_state_dict(state['shared_model'])
+        ewc.load_state_dict(state['ewc'])
+        if state['task_state'] is None:
+            set_rng_state(state['rng'])
+    for i, ont in enumerate(sub_ontologies):
         if model_id is not None:
             model_name = f'{model_name}_{model_id}'
-        go_file = f'{data_root}/go.obo'
-        go_norm_file = f'{data_root}/go.norm'
+        if i < start_task:
+            continue
         model_file = f'{model_dir}/{ont}_{model_name}_{test_data_name}.th'
         out_file = f'{results_dir}/{ont}_{model_name}_predictions_{test_data_name}.pkl'
-        go = Ontology(go_file, with_rels=True)
-        # Load the datasets
-        ppi_graph_file = f'ppi_{test_data_name}.bin'
-        test_data_file = f'{test_data_name}_data.pkl'
-
-        mfs_dict, terms_dict, graph, train_nids, valid_nids, test_nids, data, labels, test_df = load_ppi_data(
-            data_root, ont, features_length, features_column, test_data_file, ppi_graph_file)
-        n_terms = len(terms_dict)
+        task_resume = None
+        if state is not None and i == start_task and state['task_state'] is not None:
+            task_resume = dict(state['task_state'], rng=state['rng'])
 
-        if features_column == 'prop_annotations':
-            features_length = len(mfs_dict)
+        def checkpoint(epoch, task_state, task=i):
+            if manager.due(epoch):
+                manager.save(lifelong_state(task, task_state))
 
-        valid_labels = labels[valid_nids].numpy()
-        test_labels = labels[test_nids].numpy()
-
-        labels = labels.to(device)
-        graph = graph.to(device)
-
-        train_nids = train_nids.to(device)
-        valid_nids = valid_nids.to(device)
-        test_nids = test_nids.to(device)
-
-        _, _, _, _, relations, zero_classes = load_normal_forms(
-            go_norm_file, terms_dict)
-        n_rels = len(relations)
-        myLogging.info(n_rels)
-        n_zeros = len(zero_classes)
-        myLogging.info(n_zeros)
-        net = TaskSpecificModel(shared_model, features_length, n_terms,n_zeros,n_rels, device).to(device)
-        myLogging.info(net)
-        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
-        train_dataloader = dgl.dataloading.DataLoader(
-            graph, train_nids, sampler,
-            batch_size=batch_size,
-            shuffle=False,
-            drop_last=False,
-            num_workers=0)
-
-        valid_dataloader = dgl.dataloading.DataLoader(
-            graph, valid_nids, sampler,
-            batch_size=batch_size,
-            shuffle=False,
-            drop_last=False,
-            num_workers=0)
-
-        test_dataloader = dgl.dataloading.DataLoader(
-            graph, test_nids, sampler,
-            batch_size=batch_size,
-            shuffle=False,
-            drop_last=False,
-            num_workers=0)
-        optimizer = th.optim.Adam(net.parameters(), lr=1e-5)
-        scheduler = MultiStepLR(optimizer, milestones=[20, 40, 60, 80, 120], gamma=0.1)
-        early_stopping = EarlyStopping(patience=15, verbose=True)
-        best_loss = 10000.0
-        if shared_model.fisher_information is None:
-            shared_model.fisher_information = {}
-            for name, param in shared_model.named_parameters():
-                shared_model.fisher_information[name] = th.zeros_like(param)
+        results.append([model_name] + train_task(
+            ont, shared_model, ewc, model_file, out_file, data_root, base_model_name, test_data_name, batch_size,
+            epochs, device, load, early_stop, ewc_samples, layerwise, shuffle_batches,
+            checkpoint=None if load else checkpoint, resume=task_resume, writer=checkpoint_writer,
+            frozen=frozen_backbone and i > 0, finetune_epochs=finetune_epochs, head_batch_size=head_batch_size,
+            head_lr=head_lr))
         if not load:
-            myLogging.info(f"##########Training  for {ont}...##########")
-            for epoch in range(epochs):
-                net.train()
-                train_loss = 0
-                train_steps = int(math.ceil(len(train_nids) / batch_size))
-                with ck.progressbar(length=train_steps, show_pos=True) as bar:
-                    for input_nodes, output_nodes, blocks in train_dataloader:
-                        bar.update(1)
-                        logits = net(input_nodes, output_nodes, blocks)
-                        batch_labels = labels[output_nodes]
-                        loss = F.binary_cross_entropy(logits, batch_labels)
-                        ewc_loss = shared_model.ewc_loss(shared_model.fisher_information)
-                        total_loss = loss + ewc_loss
-                        train_loss += loss.detach().item()
-                        optimizer.zero_grad()
-                        total_loss.backward()
-                        optimizer.step()
-                        for name, param in shared_model.named_parameters():
-                            shared_model.fisher_information[name] += param.grad ** 2
-                    shared_model.save_old_parameters()
-                    for name, fisher in shared_model.fisher_information.items():
-                        shared_model.fisher_information[name] /= len(train_dataloader)
-                train_loss /= train_steps
-                myLogging.info('Validation')
-                net.eval()
-                with th.no_grad():
-                    valid_steps = int(math.ceil(len(valid_nids) / batch_size))
-                    valid_loss = 0
-                    preds = []
-                    with ck.progressbar(length=valid_steps, show_pos=True) as bar:
-                        for input_nodes, output_nodes, blocks in valid_dataloader:
-                            bar.update(1)
-                            logits = net(input_nodes, output_nodes, blocks)
-                            batch_labels = labels[output_nodes]
-                            batch_loss = F.binary_cross_entropy(logits, batch_labels)
-                            valid_loss += batch_loss.detach().item()
-                            preds = np.append(preds, logits.detach().cpu().numpy())
-                    valid_loss /= valid_steps
-                    roc_auc = compute_roc(valid_labels, preds)
-                    myLogging.info(f'Epoch {epoch}: Loss - {train_loss}, Valid loss - {valid_loss}, AUC - {roc_auc}')
-                if valid_loss < best_loss:
-                    best_loss = valid_loss
-                    myLogging.info('Saving model')
-                    th.save(net.state_dict(), model_file)
-                    shared_model.save_old_parameters()
-                    myLogging.info('Saving shared_model')
-                early_stopping(valid_loss, net)
-                if early_stopping.early_stop:
-                    myLogging.info("Early stopping")
-                    break
-                scheduler.step()
-        # Loading best model
-        myLogging.info('Loading the best model')
-        myLogging.info('########## Test the model ##########')
-        net.load_state_dict(th.load(model_file))
-        num_params = sum(p.numel() for p in net.parameters())
-        print(f"Total Params Numbers: {num_params}")
-        net.eval()
-        with th.no_grad():
-            valid_steps = int(math.ceil(len(valid_nids) / batch_size))
-            valid_loss = 0
-            preds = []
-            with ck.progressbar(length=valid_steps, show_pos=True) as bar:
-                for input_nodes, output_nodes, blocks in valid_dataloader:
-                    bar.update(1)
-                    logits = net(input_nodes, output_nodes, blocks)
-                    batch_labels = labels[output_nodes]
-                    batch_loss = F.binary_cross_entropy(logits, batch_labels)
-                    valid_loss += batch_loss.detach().item()
-                    preds = np.append(preds, logits.detach().cpu().numpy())
-                valid_loss /= valid_steps
-        with th.no_grad():
-            test_steps = int(math.ceil(len(test_nids) / batch_size))
-            test_loss = 0
-            preds = []
-            with ck.progressbar(length=test_steps, show_pos=True) as bar:
-                for input_nodes, output_nodes, blocks in test_dataloader:
-                    bar.update(1)
-                    logits = net(input_nodes, output_nodes, blocks)
-                    batch_labels = labels[output_nodes]
-                    batch_loss = F.binary_cross_entropy(logits, batch_labels)
-                    test_loss += batch_loss.detach().cpu().item()
-                    preds.append(logits.detach().cpu().numpy())
-                test_loss /= test_steps
-            preds = np.concatenate(preds)
-            roc_auc = compute_roc(test_labels, preds)
-        myLogging.info(f'Valid Loss - {valid_loss}, Test Loss - {test_loss}, AUC - {roc_auc}')
-        preds = list(preds)
-        # Propagate scores using ontology structure
-        with Pool(2) as p:
-            preds = p.map(partial(propagate_annots, go=go, terms_dict=terms_dict), preds)
-        test_df['preds'] = preds
-        test_df.to_pickle(out_file)
-        myLogging.info(f'Test Files Saved - {out_file}')
-        myLogging.info('########## evaluate ##########')
-        fmax, smin, tmax, wfmax, wtmax, avg_auc, aupr, avgic, fmax_spec_match = evaluate(data_root, ont, model_name,
-                                                                                         out_file)
-        myLogging.info(
-            f'model_name:{model_name}, ont:{ont}, batch_size:{batch_size}, epochs:{epochs}, script:{load}, device:{device}')
-        myLogging.info(f'Fmax: {fmax:0.3f}, Smin: {smin:0.3f}, threshold: {tmax}, spec: {fmax_spec_match}')
-        myLogging.info(f'WFmax: {wfmax:0.3f}, threshold: {wtmax}')
-        myLogging.info(f'AUC: {avg_auc:0.3f}')
-        myLogging.info(f'AUPR: {aupr:0.3f}')
-        results.append([model_name, ont, fmax, avg_auc, aupr])
+            manager.save(lifelong_state(i + 1))
+    checkpoint_writer.close()
     with open(csv_file, 'w', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(['model_name', 'ont', 'fmax', 'avg_auc', 'aupr'])  # 写入表头
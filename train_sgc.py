@@ -0,0 +1,144 @@
+import click as ck
+import csv
+import os
+import time
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+from torch.optim.lr_scheduler import MultiStepLR
+from src.torch_utils import FastTensorDataLoader
+from src.checkpoint import save_checkpoint, load_model
+from src.utils import Ontology, validate_subontology
+from src.bundle import load_bundle
+from src.features import SGC_MODEL_FEATURES, features_dim
+from src.metrics import compute_roc, StreamingMetrics
+from src.ewc import FlatEWC, EWC_MODES
+from src.sgc import SGC_NORMS, sgc_features, sgc_shared_model, SGCModel, predict_batches
+from src.training import evaluate_chunks, train_epoch, ModelSelection, save_test_predictions
+from src.logging import MyLog
+myLogging = MyLog().logger
+
+
+@ck.command()
+@ck.option(
+    '--data-root', '-dr', default='data',
+    help='Data folder')
+@ck.option(
+    '--model-dir', '-md', default='models',
+    help='Models folder')
+@ck.option(
+    '--results-dir', '-rd', default='results',
+    help='Results folder')
+@ck.option(
+    '--model-name', '-m', type=ck.Choice(list(SGC_MODEL_FEATURES)),
+    default='LifeLongGo_esm_pdb2_sgc',
+    help='Prediction model name')
+@ck.option(
+    '--test-data-name', '-td', default='test', type=ck.Choice(['test', 'cafa3']),
+    help='Test data set name')
+@ck.option(
+    '--batch-size', '-bs', default=8,
+    help='Batch size for training, also used to compute the validation loss as train_llg.py does')
+@ck.option(
+    '--epochs', '-ep', default=512,
+    help='Training epochs')
+@ck.option(
+    '--device', '-d', default='cpu',
+    help='Device')
+@ck.option(
+    '--sub-ontologies', '-so', default='bp_mf_cc',
+    help='Sub-ontologies list (comma-separated)')
+@ck.option(
+    '--norm', '-n', default='mean', type=ck.Choice(SGC_NORMS),
+    help='Neighbour aggregation normalization')
+@ck.option(
+    '--early-stop', '-es', default='loss', type=ck.Choice(['loss', 'fmax']),
+    help='Validation metric for model selection and early stopping')
+@ck.option(
+    '--ewc-mode', '-em', default='running', type=ck.Choice(EWC_MODES),
+    help='EWC Fisher estimation: every step (running), once per task (task) or online with decay')
+@ck.option(
+    '--ewc-lambda', '-el', default=0.5, help='EWC penalty weight')
+@ck.option(
+    '--ewc-decay', '-ed', default=0.9, help='Fisher decay across tasks of online EWC')
+@ck.option(
+    '--ewc-samples', '-esm', default=100, help='Training batches used to estimate Fisher at task end')
+@ck.option(
+    '--shuffle-batches', is_flag=True, help='Reshuffle the training samples every epoch')
+def main(data_root, model_dir, results_dir, model_name, test_data_name, batch_size, epochs, device, sub_ontologies,
+         norm, early_stop, ewc_mode, ewc_lambda, ewc_decay, ewc_samples, shuffle_batches):
+    """
+    Trains the precomputed-aggregation MLP variant of LifeLongGo: the
+    degree-normalized neighbour aggregates of the input features are
+    computed once, and an MLP is trained on [self, aggregated] features in
+    the same lifelong order, with EWC and evaluation as train_llg.py
+    """
+    if not os.path.exists(model_dir): os.makedirs(model_dir)
+    if not os.path.exists(results_dir): os.makedirs(results_dir)
+    features = SGC_MODEL_FEATURES[model_name]
+    features_column = '_'.join(features)
+    features_length = features_dim(features)
+    model_name = f'{model_name}_{sub_ontologies}'
+    shared_model = sgc_shared_model(features_length).to(device)
+    ewc = FlatEWC(shared_model, lambda_ewc=ewc_lambda, mode=ewc_mode, decay=ewc_decay)
+    go = Ontology(f'{data_root}/go.obo', with_rels=True)
+    ppi_graph_file = f'ppi_{test_data_name}.bin'
+    test_data_file = f'{test_data_name}_data.pkl'
+    results = []
+    for ont in validate_subontology(sub_ontologies):
+        model_file = f'{model_dir}/{ont}_{model_name}_{test_data_name}.th'
+        out_file = f'{results_dir}/{ont}_{model_name}_predictions_{test_data_name}.pkl'
+        _, terms_dict, _, train_nids, valid_nids, test_nids, _, labels, test_df = load_bundle(
+            data_root, ont, features_length, features_column, test_data_file, ppi_graph_file)
+        inputs = th.from_numpy(sgc_features(data_root, ont, features_column, ppi_graph_file, norm))
+        train_x, valid_x, test_x = (inputs[nids.long()].to(device) for nids in (train_nids, valid_nids, test_nids))
+        train_y, valid_y = labels[train_nids.long()].to(device), labels[valid_nids.long()].to(device)
+        test_labels = labels[test_nids.long()].numpy()
+
+        net = SGCModel(shared_model, 2560, len(terms_dict)).to(device)
+        train_loader = FastTensorDataLoader(train_x, train_y, batch_size=batch_size, shuffle=shuffle_batches)
+        optimizer = th.optim.Adam(net.parameters(), lr=1e-5)
+        scheduler = MultiStepLR(optimizer, milestones=[20, 40, 60, 80, 120], gamma=0.1)
+        selection = ModelSelection(early_stop, lambda: save_checkpoint(net.state_dict(), model_file), ewc)
+        # Validation chunks hold whole batches, so the losses are those of the training batch size
+        chunk_size = batch_size * max(1, 4096 // batch_size)
+
+        def batch_loss(batch):
+            return F.binary_cross_entropy(net(batch[0]), batch[1])
+
+        myLogging.info(f"##########Training  for {ont}...##########")
+        for epoch in range(epochs):
+            net.train()
+            start = time.perf_counter()
+            train_loss = train_epoch(train_loader, batch_loss, optimizer, ewc)
+            speed = len(train_x) / (time.perf_counter() - start)
+            valid_metrics = StreamingMetrics()
+            valid_loss = evaluate_chunks(
+                zip(predict_batches(net, valid_x, chunk_size), th.split(valid_y, chunk_size)), batch_size,
+                valid_metrics)
+            valid_fmax, valid_tmax = valid_metrics.fmax()
+            myLogging.info(f'Epoch {epoch}: Loss - {train_loss}, Valid loss - {valid_loss}, '
+                           f'Fmax - {valid_fmax:0.3f} ({valid_tmax}), {speed:0.0f} proteins/s')
+            if selection.step(net, valid_loss, valid_fmax):
+                break
+            scheduler.step()
+        myLogging.info('########## Test the model ##########')
+        load_model(net, model_file, device)
+        batches = ((train_x[i:i + batch_size], train_y[i:i + batch_size])
+                   for i in range(0, min(len(train_x), ewc_samples * batch_size), batch_size))
+        net.eval()
+        ewc.consolidate(batch_loss, batches)
+        preds = np.concatenate([p.cpu().numpy() for p in predict_batches(net, test_x, chunk_size)])
+        myLogging.info(f'Test AUC - {compute_roc(test_labels, preds)}')
+        fmax, avg_auc, aupr = save_test_predictions(
+            preds, go, terms_dict, test_df, out_file, data_root, ont, test_data_file)
+        results.append([model_name, ont, fmax, avg_auc, aupr])
+    csv_file = f'{results_dir}/{model_name}_predictions_{test_data_name}.csv'
+    with open(csv_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['model_name', 'ont', 'fmax', 'avg_auc', 'aupr'])
+        writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()